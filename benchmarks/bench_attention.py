@@ -0,0 +1,103 @@
+"""
+Benchmark pointer-net decoder attention on CPU: the original 1x1 `conv2d`
+key computation with a per-head loop, against `make_attention`'s single
+matmul over all heads, in additive and dot-product modes.
+
+Each step attends over `attn_length` states with `num_queries` queries, as a
+decoder does over a rollout.
+
+    PYTHONPATH=. python benchmarks/bench_attention.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.models.rnn import linear
+
+from rlcomp.pointer_network import make_attention
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--attn_lengths", default="5,20,100")
+argparser.add_argument("--num_heads", default="1,4")
+argparser.add_argument("--attn_size", type=int, default=20)
+argparser.add_argument("--batch_size", type=int, default=64)
+argparser.add_argument("--num_steps", type=int, default=100)
+
+
+def conv2d_attention(attention_states, num_heads):
+  """Original `ptr_net_decoder` attention, extended to use every head."""
+  attn_length = attention_states.get_shape()[1].value
+  attn_size = attention_states.get_shape()[2].value
+
+  hidden = tf.reshape(attention_states, [-1, attn_length, 1, attn_size])
+  hidden_features, v = [], []
+  for a in xrange(num_heads):
+    k = tf.get_variable("AttnW_%d" % a, [1, 1, attn_size, attn_size])
+    hidden_features.append(tf.nn.conv2d(hidden, k, [1, 1, 1, 1], "SAME"))
+    v.append(tf.get_variable("AttnV_%d" % a, [attn_size]))
+
+  def attention(query):
+    ptrs = []
+    for a in xrange(num_heads):
+      with tf.variable_scope("Attention_%i" % a):
+        y = linear.linear(query, attn_size, True)
+        y = tf.reshape(y, [-1, 1, 1, attn_size])
+        s = tf.reduce_sum(v[a] * tf.tanh(hidden_features[a] + y), [2, 3])
+        ptrs.append(tf.nn.softmax(s))
+    return ptrs[0], ptrs
+
+  return attention
+
+
+def bench(args, attn_length, num_heads, build_fn):
+  with tf.Graph().as_default(), tf.Session() as sess:
+    attention_states = tf.placeholder(
+        tf.float32, (None, attn_length, args.attn_size))
+    queries = [tf.placeholder(tf.float32, (None, args.attn_size))
+               for _ in range(attn_length)]
+
+    attention = build_fn(attention_states, num_heads)
+    fetches = []
+    for i, query in enumerate(queries):
+      if i > 0:
+        tf.get_variable_scope().reuse_variables()
+      # A single head has no read vectors.
+      fetches.extend(x for x in attention(query) if x is not None)
+
+    sess.run(tf.initialize_all_variables())
+    feed_dict = {attention_states: np.random.randn(args.batch_size,
+                                                   attn_length,
+                                                   args.attn_size)}
+    feed_dict.update({query: np.random.randn(args.batch_size, args.attn_size)
+                      for query in queries})
+    sess.run(fetches, feed_dict)
+
+    start = time.time()
+    for _ in xrange(args.num_steps):
+      sess.run(fetches, feed_dict)
+    return (time.time() - start) / args.num_steps
+
+
+def main(args):
+  modes = [
+    ("conv2d", conv2d_attention),
+    ("additive", lambda states, heads: make_attention(states, heads,
+                                                      mode="additive")),
+    ("dot", lambda states, heads: make_attention(states, heads, mode="dot")),
+  ]
+
+  print "%8s %6s %14s %14s %14s" % (("length", "heads")
+                                    + tuple(name for name, _ in modes))
+  for attn_length in [int(x) for x in args.attn_lengths.split(",")]:
+    for num_heads in [int(x) for x in args.num_heads.split(",")]:
+      times = [bench(args, attn_length, num_heads, build_fn)
+               for _, build_fn in modes]
+      print "%8i %6i %13.3fms %13.3fms %13.3fms" % (
+          (attn_length, num_heads) + tuple(t * 1000 for t in times))
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -0,0 +1,119 @@
+"""
+Benchmark step time of the recurrent pointer-net critic against sequence
+length: one `critic_model` application per timestep (as `PointerNetDPG`
+used to do) against a single application over all stacked timesteps.
+Both variants are first checked to give the same per-timestep outputs over
+the same critic variables.
+
+    PYTHONPATH=. python benchmarks/bench_batched_critic.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp import util
+from rlcomp.dpg import critic_model
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--seq_lengths", default="5,10,20,50,100")
+argparser.add_argument("--action_dim", type=int, default=20)
+argparser.add_argument("--critic_dims", default="20")
+argparser.add_argument("--batch_size", type=int, default=64)
+argparser.add_argument("--num_steps", type=int, default=200)
+
+
+def critic_tracking_params():
+  """Tracking parameters for the top-level `critic` model built so far."""
+  params = {var.op.name[len("critic/"):]: var for var in tf.all_variables()
+            if var.op.name.startswith("critic/")}
+  with tf.variable_scope("critic_track"):
+    return util.TrackingParams(params)
+
+
+def per_timestep_critic(actions_lst, mdp, spec):
+  scores, scores_track = [], []
+  prev_action = tf.zeros_like(actions_lst[0])
+  for t, actions_t in enumerate(actions_lst):
+    reuse_t = (t > 0) or None
+    scores.append(tf.sigmoid(critic_model(prev_action, actions_t, mdp, spec,
+                                          name="critic", reuse=reuse_t)))
+    if t == 0:
+      track_params = critic_tracking_params()
+    scores_track.append(tf.sigmoid(critic_model(
+        prev_action, actions_t, mdp, spec, name="critic_track",
+        track_params=track_params, reuse=reuse_t)))
+    prev_action = actions_t
+  return scores + scores_track
+
+
+def batched_critic(actions_lst, mdp, spec):
+  states = tf.concat(0, [tf.zeros_like(actions_lst[0])] + actions_lst[:-1])
+  actions = tf.concat(0, actions_lst)
+  critic = critic_model(states, actions, mdp, spec, name="critic")
+  critic_track = critic_model(states, actions, mdp, spec,
+                              name="critic_track",
+                              track_params=critic_tracking_params())
+  return (tf.split(0, len(actions_lst), tf.sigmoid(critic))
+          + tf.split(0, len(actions_lst), tf.sigmoid(critic_track)))
+
+
+def bench(args, seq_length, build_fn):
+  mdp = util.MDPSpec(args.action_dim, args.action_dim)
+  spec = util.DPGSpec([], [int(x) for x in filter(None,
+                                                  args.critic_dims.split(","))])
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    actions_lst = [tf.placeholder(tf.float32, (None, args.action_dim))
+                   for _ in range(seq_length)]
+    fetches = build_fn(actions_lst, mdp, spec)
+    sess.run(tf.initialize_all_variables())
+
+    feed_dict = {actions_t: np.random.randn(args.batch_size, args.action_dim)
+                 for actions_t in actions_lst}
+    sess.run(fetches, feed_dict)
+
+    start = time.time()
+    for _ in xrange(args.num_steps):
+      sess.run(fetches, feed_dict)
+    return (time.time() - start) / args.num_steps
+
+
+def check(args, seq_length=5):
+  """Verify that both critics agree when built over the same variables."""
+  mdp = util.MDPSpec(args.action_dim, args.action_dim)
+  spec = util.DPGSpec([], [int(x) for x in filter(None,
+                                                  args.critic_dims.split(","))])
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    actions_lst = [tf.placeholder(tf.float32, (None, args.action_dim))
+                   for _ in range(seq_length)]
+    per_timestep = per_timestep_critic(actions_lst, mdp, spec)
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      batched = batched_critic(actions_lst, mdp, spec)
+    sess.run(tf.initialize_all_variables())
+
+    feed_dict = {actions_t: np.random.randn(args.batch_size, args.action_dim)
+                 for actions_t in actions_lst}
+    per_timestep_vals, batched_vals = sess.run([per_timestep, batched],
+                                               feed_dict)
+    for per_timestep_val, batched_val in zip(per_timestep_vals, batched_vals):
+      assert np.allclose(per_timestep_val, batched_val, atol=1e-6)
+
+
+def main(args):
+  check(args)
+
+  print "%10s %16s %16s" % ("T", "per-timestep", "batched")
+  for seq_length in [int(x) for x in args.seq_lengths.split(",")]:
+    per_timestep = bench(args, seq_length, per_timestep_critic)
+    batched = bench(args, seq_length, batched_critic)
+    print "%10i %15.3fms %15.3fms" % (seq_length, per_timestep * 1000,
+                                      batched * 1000)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
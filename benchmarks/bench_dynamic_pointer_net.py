@@ -0,0 +1,83 @@
+"""
+Benchmark graph construction (build time and op count) of the statically
+unrolled `PointerNetDPG` at several sequence lengths against the single
+loop-based `DynamicPointerNetDPG` graph, and the step time of the dynamic
+graph on each sequence length.
+
+    PYTHONPATH=. python benchmarks/bench_dynamic_pointer_net.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp import util
+from rlcomp.dpg import DynamicPointerNetDPG, PointerNetDPG
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--seq_lengths", default="5,10,20,50,100")
+argparser.add_argument("--input_dim", type=int, default=20)
+argparser.add_argument("--policy_dims", default="20")
+argparser.add_argument("--critic_dims", default="")
+argparser.add_argument("--batch_size", type=int, default=64)
+argparser.add_argument("--num_steps", type=int, default=20)
+
+
+def build(args, dpg_cls, *dpg_args):
+  """
+  Returns:
+    graph:
+    dpg:
+    build_time: Seconds to build the model
+  """
+  mdp = util.MDPSpec(args.input_dim, args.input_dim)
+  spec = util.DPGSpec([int(x) for x in args.policy_dims.split(",")],
+                      [int(x) for x in filter(None,
+                                              args.critic_dims.split(","))])
+
+  graph = tf.Graph()
+  with graph.as_default():
+    start = time.time()
+    dpg = dpg_cls(mdp, spec, args.input_dim, *dpg_args)
+    build_time = time.time() - start
+
+  return graph, dpg, build_time
+
+
+def main(args):
+  seq_lengths = [int(x) for x in args.seq_lengths.split(",")]
+
+  print "%10s %12s %10s" % ("static T", "build", "ops")
+  for seq_length in seq_lengths:
+    graph, _, build_time = build(args, PointerNetDPG, seq_length)
+    print "%10i %11.2fs %10i" % (seq_length, build_time,
+                                 len(graph.get_operations()))
+
+  graph, dpg, build_time = build(args, DynamicPointerNetDPG)
+  print "%10s %11.2fs %10i" % ("dynamic", build_time,
+                               len(graph.get_operations()))
+
+  print
+  print "%10s %16s" % ("T", "dynamic step")
+  with graph.as_default(), tf.Session() as sess:
+    sess.run(tf.initialize_all_variables())
+
+    for seq_length in seq_lengths:
+      inputs = np.random.randn(args.batch_size, seq_length, args.input_dim)
+      lengths = np.random.randint(1, seq_length + 1, size=args.batch_size)
+      feed_dict = {dpg.inputs: inputs, dpg.lengths: lengths}
+      fetches = [dpg.a_pred, dpg.critic_on]
+
+      sess.run(fetches, feed_dict)
+      start = time.time()
+      for _ in xrange(args.num_steps):
+        sess.run(fetches, feed_dict)
+      step_time = (time.time() - start) / args.num_steps
+      print "%10i %15.1fms" % (seq_length, step_time * 1000)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
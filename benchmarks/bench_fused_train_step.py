@@ -0,0 +1,76 @@
+"""
+Benchmark DPG training steps/sec for the original four-call step (target
+computation, policy update, critic update, tracking update) against the
+fused single-call `DPG.make_train_step` op with in-graph TD targets.
+
+    PYTHONPATH=. python benchmarks/bench_fused_train_step.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp import util
+from rlcomp.dpg import DPG
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--batch_sizes", default="32,64,256,1024")
+argparser.add_argument("--num_steps", type=int, default=500)
+argparser.add_argument("--policy_dims", default="20")
+argparser.add_argument("--critic_dims", default="20")
+
+
+def main(args):
+  mdp = util.MDPSpec(4, 1)
+  spec = util.DPGSpec([int(x) for x in args.policy_dims.split(",")],
+                      [int(x) for x in args.critic_dims.split(",")])
+  gamma, tau = 0.95, [0.001]
+
+  dpg = DPG(mdp, spec, gamma=gamma)
+
+  # Separate update ops for the unfused step.
+  policy_update = tf.train.MomentumOptimizer(1e-4, 0.9).minimize(
+      dpg.policy_objective, var_list=dpg.policy_params)
+  critic_update = tf.train.MomentumOptimizer(1e-5, 0.9).minimize(
+      dpg.critic_objective, var_list=dpg.critic_params)
+
+  _, _, train_step = dpg.make_train_step(
+      tf.train.MomentumOptimizer(1e-4, 0.9),
+      tf.train.MomentumOptimizer(1e-5, 0.9))
+
+  with tf.Session() as sess:
+    sess.run(tf.initialize_all_variables())
+
+    print "%10s %16s %16s" % ("batch", "unfused steps/s", "fused steps/s")
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+      states = np.random.randn(batch_size, mdp.state_dim).astype(np.float32)
+      states_next = np.random.randn(batch_size, mdp.state_dim)
+      rewards = np.random.randn(batch_size).astype(np.float32)
+      terminals = np.zeros((batch_size,), dtype=np.float32)
+
+      start = time.time()
+      for _ in xrange(args.num_steps):
+        q_next = sess.run(dpg.q_next_track, {dpg.states_next: states_next})
+        targets = rewards + gamma * q_next
+        sess.run(policy_update, {dpg.inputs: states})
+        sess.run([dpg.critic_objective, critic_update],
+                 {dpg.inputs: states, dpg.q_targets: targets})
+        sess.run(dpg.track_update, {dpg.tau: tau})
+      unfused = args.num_steps / (time.time() - start)
+
+      feed_dict = {dpg.inputs: states, dpg.rewards: rewards,
+                   dpg.states_next: states_next, dpg.terminals: terminals,
+                   dpg.tau: tau}
+      start = time.time()
+      for _ in xrange(args.num_steps):
+        sess.run([dpg.critic_objective, train_step], feed_dict)
+      fused = args.num_steps / (time.time() - start)
+
+      print "%10i %16.1f %16.1f" % (batch_size, unfused, fused)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
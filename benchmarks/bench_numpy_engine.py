@@ -0,0 +1,134 @@
+"""
+Check the NumPy policy engines against TF, and benchmark them.
+
+Randomly initialized `DPG` and `DynamicPointerNetDPG` models are saved to a
+checkpoint and exported with `numpy_engine.export_params`. For each, this
+reports the maximum absolute difference between TF's `a_pred` and the NumPy
+forward pass, the NumPy engine's load time, and throughput (sequences or
+states per second) of a TF session against the NumPy engine.
+
+    PYTHONPATH=. python benchmarks/bench_numpy_engine.py
+"""
+
+import argparse
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp import numpy_engine, util
+from rlcomp.dpg import DPG, DynamicPointerNetDPG
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--batch_sizes", default="1,16,256")
+argparser.add_argument("--seq_length", type=int, default=10)
+argparser.add_argument("--input_dim", type=int, default=20)
+argparser.add_argument("--num_heads", type=int, default=1)
+argparser.add_argument("--num_steps", type=int, default=50)
+argparser.add_argument("--tolerance", type=float, default=1e-4)
+
+
+def time_per_call(fn, num_steps):
+  fn()
+  start = time.time()
+  for _ in xrange(num_steps):
+    fn()
+  return (time.time() - start) / num_steps
+
+
+def export(sess, tmpdir, name):
+  checkpoint = tf.train.Saver().save(sess, os.path.join(tmpdir, name))
+  out_path = os.path.join(tmpdir, name + ".npz")
+  numpy_engine.export_params(checkpoint, out_path)
+
+  start = time.time()
+  params = numpy_engine.load_params(out_path)
+  return params, time.time() - start
+
+
+def bench_mlp(args, tmpdir):
+  mdp = util.MDPSpec(args.input_dim, args.input_dim)
+  spec = util.DPGSpec([args.input_dim], [args.input_dim])
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    dpg = DPG(mdp, spec)
+    sess.run(tf.initialize_all_variables())
+    params, load_time = export(sess, tmpdir, "mlp")
+    policy = numpy_engine.MLPPolicy(params)
+
+    rows = []
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+      states = np.random.randn(batch_size, args.input_dim).astype(np.float32)
+      tf_fn = lambda: sess.run(dpg.a_pred, {dpg.inputs: states})
+      np_fn = lambda: policy(states)
+
+      error = np.abs(tf_fn() - np_fn()).max()
+      rows.append((batch_size, error,
+                   batch_size / time_per_call(tf_fn, args.num_steps),
+                   batch_size / time_per_call(np_fn, args.num_steps)))
+  return load_time, rows
+
+
+def bench_pointer_net(args, tmpdir):
+  mdp = util.MDPSpec(args.input_dim, args.input_dim)
+  spec = util.DPGSpec([args.input_dim], [args.input_dim])
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    dpg = DynamicPointerNetDPG(mdp, spec, args.input_dim,
+                               num_heads=args.num_heads)
+    sess.run(tf.initialize_all_variables())
+    params, load_time = export(sess, tmpdir, "pointer_net")
+    policy = numpy_engine.PointerNetPolicy(params)
+
+    rows = []
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+      inputs = np.random.randn(batch_size, args.seq_length,
+                               args.input_dim).astype(np.float32)
+      lengths = np.random.randint(1, args.seq_length + 1, size=batch_size)
+      lengths[0] = args.seq_length
+      tf_fn = lambda: sess.run(dpg.a_pred, {dpg.inputs: inputs,
+                                            dpg.lengths: lengths})
+      np_fn = lambda: policy.rollout(inputs, lengths)
+
+      error = np.abs(tf_fn() - np_fn()).max()
+      rows.append((batch_size, error,
+                   batch_size / time_per_call(tf_fn, args.num_steps),
+                   batch_size / time_per_call(np_fn, args.num_steps)))
+  return load_time, rows
+
+
+def startup_time(statement):
+  """Wall time of a fresh interpreter running `statement`."""
+  start = time.time()
+  subprocess.check_call([sys.executable, "-c", statement])
+  return time.time() - start
+
+
+def main(args):
+  print "startup: python + numpy %.3fs, python + tensorflow %.3fs" % (
+      startup_time("import numpy"), startup_time("import tensorflow"))
+
+  tmpdir = tempfile.mkdtemp()
+  try:
+    for name, bench_fn in [("mlp policy", bench_mlp),
+                           ("pointer net", bench_pointer_net)]:
+      load_time, rows = bench_fn(args, tmpdir)
+      print
+      print "%s (npz load %.2fms)" % (name, load_time * 1000)
+      print "%10s %12s %8s %14s %14s" % ("batch", "max error", "ok",
+                                         "tf /s", "numpy /s")
+      for batch_size, error, tf_rate, np_rate in rows:
+        print "%10i %12.2e %8s %14.1f %14.1f" % (
+            batch_size, error, error <= args.tolerance, tf_rate, np_rate)
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -0,0 +1,80 @@
+"""
+Benchmark prioritized (sum-tree) replay sampling against uniform sampling.
+
+Reports microseconds per call for
+  - the original `np.random.choice(n, batch_size, replace=False)` sampler,
+  - uniform `ReplayBuffer.sample_idxs`,
+  - `PrioritizedReplayBuffer.sample_prioritized` (indices, weights, gather),
+  - `PrioritizedReplayBuffer.update_priorities`,
+at several buffer capacities.
+
+    PYTHONPATH=. python benchmarks/bench_prioritized_replay.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from rlcomp import replay, specs
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--capacities", default="10000,100000,1000000")
+argparser.add_argument("--batch_size", type=int, default=64)
+argparser.add_argument("--num_calls", type=int, default=1000)
+
+
+def time_per_call(fn, num_calls):
+  start = time.time()
+  for _ in xrange(num_calls):
+    fn()
+  return (time.time() - start) / num_calls * 1e6
+
+
+def fill(buffer):
+  n = buffer.buffer_size
+  buffer.extend(np.random.randn(n, buffer.mdp.state_dim),
+                np.random.randn(n, buffer.mdp.action_dim),
+                np.random.randn(n), np.random.randn(n, buffer.mdp.state_dim))
+
+
+def main(args):
+  mdp = specs.MDPSpec(4, 1)
+  capacities = [int(x) for x in args.capacities.split(",")]
+  batch_size = args.batch_size
+
+  print "%10s %14s %14s %14s %14s" % ("capacity", "choice us",
+                                       "uniform us", "per sample us",
+                                       "per update us")
+  for capacity in capacities:
+    uniform = replay.ReplayBuffer(capacity, mdp)
+    fill(uniform)
+    prioritized = replay.PrioritizedReplayBuffer(capacity, mdp)
+    fill(prioritized)
+    batch = prioritized.make_batch(batch_size)
+
+    # The choice sampler is O(n), so it gets fewer calls at large capacity.
+    choice_calls = max(10, args.num_calls * 10000 // capacity)
+    choice_us = time_per_call(
+        lambda: np.random.choice(capacity, size=batch_size, replace=False),
+        choice_calls)
+    uniform_us = time_per_call(lambda: uniform.sample_idxs(batch_size),
+                               args.num_calls)
+    sample_us = time_per_call(
+        lambda: prioritized.sample_prioritized(batch_size, out=batch),
+        args.num_calls)
+
+    idxs = prioritized.sample_prioritized(batch_size)[2]
+    td_errors = np.random.randn(batch_size)
+    update_us = time_per_call(
+        lambda: prioritized.update_priorities(idxs, td_errors),
+        args.num_calls)
+
+    print "%10i %14.1f %14.1f %14.1f %14.1f" % (capacity, choice_us,
+                                                 uniform_us, sample_us,
+                                                 update_us)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -0,0 +1,71 @@
+"""
+Microbenchmark for replay buffer throughput.
+
+Measures rows/sec for `extend` (episode-sized writes, including wraparound)
+and `sample` (into preallocated output arrays) at several buffer capacities.
+
+    PYTHONPATH=. python benchmarks/bench_replay_buffer.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from rlcomp import replay, specs
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--capacities", default="10000,100000,1000000")
+argparser.add_argument("--state_dim", type=int, default=4)
+argparser.add_argument("--action_dim", type=int, default=1)
+argparser.add_argument("--episode_length", type=int, default=100)
+argparser.add_argument("--batch_size", type=int, default=64)
+argparser.add_argument("--num_samples", type=int, default=10000,
+                       help="Number of `sample` calls per capacity")
+
+
+def bench_extend(buffer, args):
+  n = args.episode_length
+  states = np.random.randn(n, args.state_dim).astype(np.float32)
+  actions = np.random.randn(n, args.action_dim).astype(np.float32)
+  rewards = np.random.randn(n).astype(np.float32)
+  states_next = np.random.randn(n, args.state_dim).astype(np.float32)
+  terminals = np.zeros((n,), dtype=np.bool_)
+  terminals[-1] = True
+
+  # Write twice the capacity so that wraparound writes are exercised.
+  num_episodes = max(1, 2 * buffer.buffer_size // n)
+  start = time.time()
+  for _ in xrange(num_episodes):
+    buffer.extend(states, actions, rewards, states_next, terminals)
+  elapsed = time.time() - start
+
+  return num_episodes * n / elapsed
+
+
+def bench_sample(buffer, args):
+  batch = buffer.make_batch(args.batch_size)
+
+  start = time.time()
+  for _ in xrange(args.num_samples):
+    buffer.sample(args.batch_size, out=batch)
+  elapsed = time.time() - start
+
+  return args.num_samples * args.batch_size / elapsed
+
+
+def main(args):
+  mdp = specs.MDPSpec(args.state_dim, args.action_dim)
+  capacities = [int(x) for x in args.capacities.split(",")]
+
+  print "%12s %16s %16s" % ("capacity", "extend rows/s", "sample rows/s")
+  for capacity in capacities:
+    buffer = replay.ReplayBuffer(capacity, mdp)
+    extend_rate = bench_extend(buffer, args)
+    sample_rate = bench_sample(buffer, args)
+    print "%12i %16.0f %16.0f" % (capacity, extend_rate, sample_rate)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -0,0 +1,106 @@
+"""
+Benchmark graph-construction time and step time of the sorting reward
+computation: the original per-example `tf.unpack` / `tf.gather` version
+against the batched flat-gather `sorting_seq2seq.sort_rewards`.
+
+    PYTHONPATH=. python benchmarks/bench_sort_rewards.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp.tasks.sorting_seq2seq import sort_rewards
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--batch_sizes", default="32,64,128,256,512,1024")
+argparser.add_argument("--seq_length", type=int, default=5)
+argparser.add_argument("--vocab_size", type=int, default=10)
+argparser.add_argument("--num_steps", type=int, default=200)
+
+
+def legacy_sort_rewards(token_matrix, actions, seq_length, batch_size):
+  """Per-example reward computation, as previously in `SortingDPG`."""
+  actions = tf.unpack(actions, batch_size)
+  token_matrix = tf.unpack(token_matrix, batch_size)
+
+  predicted = [tf.gather(token_matrix[i], actions[i])
+               for i in range(batch_size)]
+  predicted = tf.concat(0, [tf.expand_dims(predicted_i, 0)
+                            for predicted_i in predicted])
+
+  rewards = (tf.slice(predicted, [0, 1], [-1, -1])
+             > tf.slice(predicted, [0, 0], [-1, seq_length - 1]))
+  rewards = tf.cast(rewards, tf.float32)
+  return tf.concat(1, [tf.zeros((batch_size, 1)), rewards])
+
+
+def bench(args, batch_size, legacy):
+  """
+  Returns:
+    build_time: Seconds to build the reward graph
+    step_time: Mean seconds per evaluation
+  """
+  with tf.Graph().as_default(), tf.Session() as sess:
+    start = time.time()
+    tokens = tf.placeholder(tf.int32, (None, args.seq_length))
+    actions = tf.placeholder(tf.int64, (None, args.seq_length))
+    if legacy:
+      rewards = legacy_sort_rewards(tokens, actions, args.seq_length,
+                                    batch_size)
+    else:
+      rewards = sort_rewards(tokens, actions, args.seq_length)
+    build_time = time.time() - start
+
+    feed_dict = {
+      tokens: np.random.randint(args.vocab_size,
+                                size=(batch_size, args.seq_length)),
+      actions: np.random.randint(args.seq_length,
+                                 size=(batch_size, args.seq_length)),
+    }
+    sess.run(rewards, feed_dict)
+
+    start = time.time()
+    for _ in xrange(args.num_steps):
+      sess.run(rewards, feed_dict)
+    step_time = (time.time() - start) / args.num_steps
+
+  return build_time, step_time
+
+
+def check(args, batch_size=32):
+  """Verify that both implementations agree."""
+  with tf.Graph().as_default(), tf.Session() as sess:
+    tokens = tf.placeholder(tf.int32, (None, args.seq_length))
+    actions = tf.placeholder(tf.int64, (None, args.seq_length))
+    legacy = legacy_sort_rewards(tokens, actions, args.seq_length, batch_size)
+    batched = sort_rewards(tokens, actions, args.seq_length)
+
+    feed_dict = {
+      tokens: np.random.randint(args.vocab_size,
+                                size=(batch_size, args.seq_length)),
+      actions: np.random.randint(args.seq_length,
+                                 size=(batch_size, args.seq_length)),
+    }
+    legacy_val, batched_val = sess.run([legacy, batched], feed_dict)
+    np.testing.assert_array_equal(legacy_val, batched_val)
+
+
+def main(args):
+  check(args)
+
+  print "%10s %14s %14s %14s %14s" % ("batch", "legacy build", "build",
+                                      "legacy step", "step")
+  for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+    legacy_build, legacy_step = bench(args, batch_size, legacy=True)
+    build, step = bench(args, batch_size, legacy=False)
+    print "%10i %13.1fms %13.1fms %13.3fms %13.3fms" \
+        % (batch_size, legacy_build * 1000, build * 1000,
+           legacy_step * 1000, step * 1000)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
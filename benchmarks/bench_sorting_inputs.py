@@ -0,0 +1,99 @@
+"""
+Benchmark the sorting task's host-side input path:
+
+1. batch generation with per-example `np.random.choice` (the original
+   `make_batch`) against the vectorized `gen_inputs`, and
+2. steps/sec of a small graph consuming batches through a per-step
+   `feed_dict` against dequeueing from a `util.QueuePrefetcher`.
+
+    PYTHONPATH=. python benchmarks/bench_sorting_inputs.py
+"""
+
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp import util
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--batch_sizes", default="64,256,1024,4096")
+argparser.add_argument("--seq_length", type=int, default=5)
+argparser.add_argument("--vocab_size", type=int, default=10)
+argparser.add_argument("--num_steps", type=int, default=200)
+
+
+def per_example_batch(batch_size, seq_length, vocab_size):
+  inputs = np.array([np.random.choice(vocab_size, replace=False,
+                                      size=seq_length)
+                     for _ in range(batch_size)])
+  return inputs.T
+
+
+def vectorized_batch(batch_size, seq_length, vocab_size):
+  noise = np.random.random((batch_size, vocab_size))
+  return np.argsort(noise, axis=1)[:, :seq_length].astype(np.int32).T
+
+
+def time_per_call(fn, num_steps):
+  start = time.time()
+  for _ in xrange(num_steps):
+    fn()
+  return (time.time() - start) / num_steps
+
+
+def bench_graph(args, batch_size):
+  """Steps/sec of a toy consumer, fed per step vs. dequeueing."""
+  make_batch = lambda: vectorized_batch(batch_size, args.seq_length,
+                                        args.vocab_size).T
+  embeddings = np.random.randn(args.vocab_size, 32).astype(np.float32)
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    # Per-step feeding of `seq_length` token vectors, as the trainer did.
+    tokens_fed = [tf.placeholder(tf.int32, (None,))
+                  for _ in range(args.seq_length)]
+    fed_op = tf.reduce_sum(tf.nn.embedding_lookup(embeddings,
+                                                  tf.pack(tokens_fed)))
+
+    prefetcher = util.QueuePrefetcher(lambda: [make_batch()], [tf.int32],
+                                      [(None, args.seq_length)])
+    tokens, = prefetcher.outputs
+    queued_op = tf.reduce_sum(tf.nn.embedding_lookup(embeddings, tokens))
+
+    def fed_step():
+      inputs = make_batch().T
+      sess.run(fed_op, {tokens_fed[t]: inputs[t]
+                        for t in range(args.seq_length)})
+
+    fed = 1.0 / time_per_call(fed_step, args.num_steps)
+
+    prefetcher.start(sess)
+    try:
+      sess.run(queued_op)
+      queued = 1.0 / time_per_call(lambda: sess.run(queued_op),
+                                   args.num_steps)
+    finally:
+      prefetcher.stop(sess)
+
+  return fed, queued
+
+
+def main(args):
+  print "%10s %14s %14s %14s %14s" % ("batch", "per-example", "vectorized",
+                                      "fed steps/s", "queued steps/s")
+  for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+    per_example = time_per_call(
+        lambda: per_example_batch(batch_size, args.seq_length,
+                                  args.vocab_size), args.num_steps)
+    vectorized = time_per_call(
+        lambda: vectorized_batch(batch_size, args.seq_length,
+                                 args.vocab_size), args.num_steps)
+    fed, queued = bench_graph(args, batch_size)
+    print "%10i %13.3fms %13.3fms %14.1f %14.1f" % (
+        batch_size, per_example * 1000, vectorized * 1000, fed, queued)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -0,0 +1,97 @@
+"""
+Benchmark interpreter startup time of rlcomp's TF-free modules and tools,
+and guard against regressions.
+
+Each target is imported (or run with `--help`) in a fresh interpreter, best
+of `--repeats`. Exits with an error if a TF-free target imports TensorFlow,
+or takes longer than `--max_seconds`. `rlcomp.util`, which builds graphs and
+so imports TensorFlow, is timed for comparison only.
+
+    PYTHONPATH=. python benchmarks/bench_startup.py
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--repeats", type=int, default=5)
+argparser.add_argument("--max_seconds", type=float, default=1.0)
+
+
+TF_FREE_MODULES = ["rlcomp.specs", "rlcomp.replay", "rlcomp.flagfile",
+                   "rlcomp.profiling", "rlcomp.summaries",
+                   "rlcomp.numpy_engine", "search", "run_search"]
+TF_FREE_SCRIPTS = ["scripts/summary.py", "scripts/export_policy.py"]
+TF_MODULES = ["rlcomp.util"]
+
+# Exits with status 3 if TensorFlow was imported.
+CHECK_TF = ("import sys; sys.exit(3 if 'tensorflow' in sys.modules "
+            "else 0)")
+
+
+def run(args, argv):
+  """
+  Returns:
+    best_time: Best wall time over `--repeats` runs
+    returncode: Return code of the last run
+  """
+  best_time, returncode = float("inf"), None
+  with open(os.devnull, "w") as devnull:
+    for _ in xrange(args.repeats):
+      start = time.time()
+      returncode = subprocess.call(argv, stdout=devnull)
+      best_time = min(best_time, time.time() - start)
+  return best_time, returncode
+
+
+def module_argv(module):
+  return [sys.executable, "-c", "import %s; %s" % (module, CHECK_TF)]
+
+
+def script_argv(script):
+  # Run the script's argument parsing, then check for TF in the same
+  # interpreter.
+  code = ("import runpy, sys; sys.argv = [%r, '--help']\n"
+          "try:\n  runpy.run_path(%r, run_name='__main__')\n"
+          "except SystemExit:\n  pass\n%s" % (script, script, CHECK_TF))
+  return [sys.executable, "-c", code]
+
+
+def main(args):
+  baseline, _ = run(args, [sys.executable, "-c", "import numpy"])
+  print "%-28s %10.3fs" % ("python + numpy", baseline)
+
+  failures = []
+  targets = ([(module, module_argv(module), True)
+              for module in TF_FREE_MODULES]
+             + [(script, script_argv(script), True)
+                for script in TF_FREE_SCRIPTS]
+             + [(module, module_argv(module), False)
+                for module in TF_MODULES])
+
+  for name, argv, tf_free in targets:
+    elapsed, returncode = run(args, argv)
+    imports_tf = returncode == 3
+    print "%-28s %10.3fs %s" % (name, elapsed,
+                                "imports tensorflow" if imports_tf else "")
+
+    if not tf_free:
+      continue
+    if imports_tf:
+      failures.append("%s imports tensorflow" % name)
+    elif returncode != 0:
+      failures.append("%s failed with status %i" % (name, returncode))
+    elif elapsed > args.max_seconds:
+      failures.append("%s took %.3fs (max %.3fs)"
+                      % (name, elapsed, args.max_seconds))
+
+  if failures:
+    sys.exit("Startup regressions:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
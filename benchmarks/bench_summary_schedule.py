@@ -0,0 +1,109 @@
+"""
+Benchmark sorting training step time with summaries fetched on every step
+(`tf.merge_all_summaries()`, as the trainer did) against a
+`util.SummaryScheduler` computing scalar summaries every K steps and
+histograms every M steps, and against no summaries at all.
+
+The model is a `DynamicSortingDPG` with histogram summaries of all its
+parameters (as with `--verbose_summaries`). Step times include writing the
+summaries.
+
+    PYTHONPATH=. python benchmarks/bench_summary_schedule.py
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import tensorflow as tf
+
+from rlcomp import util
+from rlcomp.tasks import sorting_seq2seq as sorting
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--schedules", default="1:1,10:100,100:1000",
+                       help="Comma-separated K:M scalar:histogram intervals")
+argparser.add_argument("--seq_length", type=int, default=10)
+argparser.add_argument("--batch_size", type=int, default=64)
+argparser.add_argument("--num_steps", type=int, default=200)
+
+
+def build_model(args):
+  sorting.FLAGS.seq_length = args.seq_length
+
+  mdp = util.MDPSpec(sorting.FLAGS.embedding_dim, sorting.FLAGS.embedding_dim)
+  spec = util.DPGSpec([sorting.FLAGS.embedding_dim], [])
+  dpg = sorting.DynamicSortingDPG(mdp, spec, sorting.FLAGS.embedding_dim,
+                                  sorting.FLAGS.vocab_size)
+
+  global_step = tf.Variable(0, trainable=False, name="global_step")
+  agent = sorting.build_updates(dpg, global_step)
+  util.add_histogram_summaries(set(dpg.policy_params + dpg.critic_params))
+  return dpg, [agent.policy_update, agent.critic_update]
+
+
+def time_step(args, sess, dpg, step_fn):
+  """Mean seconds per call of `step_fn(t, feed_dict)`."""
+  feed_dicts = [sorting.make_feed_dict(dpg, args.batch_size)
+                for _ in range(10)]
+  step_fn(0, feed_dicts[0])
+
+  start = time.time()
+  for t in xrange(1, args.num_steps + 1):
+    step_fn(t, feed_dicts[t % len(feed_dicts)])
+  return (time.time() - start) / args.num_steps
+
+
+def main(args):
+  logdir = tempfile.mkdtemp()
+  try:
+    dpg, train_fetches = build_model(args)
+    summary_writer = tf.train.SummaryWriter(logdir)
+    merged = tf.merge_all_summaries()
+
+    schedules = []
+    for schedule in args.schedules.split(","):
+      scalar_interval, histogram_interval = map(int, schedule.split(":"))
+      schedules.append((schedule, util.SummaryScheduler(
+          summary_writer, scalar_interval=scalar_interval,
+          histogram_interval=histogram_interval)))
+
+    with tf.Session() as sess:
+      sess.run(tf.initialize_all_variables())
+      sess.graph.finalize()
+
+      def no_summaries(t, feed_dict):
+        sess.run(train_fetches, feed_dict)
+
+      def every_step(t, feed_dict):
+        summary = sess.run(train_fetches + [merged], feed_dict)[-1]
+        summary_writer.add_summary(summary, t)
+
+      def scheduled(scheduler):
+        def step(t, feed_dict):
+          summary_fetches = scheduler.fetches(t)
+          values = sess.run(train_fetches + summary_fetches, feed_dict)
+          scheduler.write(values[len(train_fetches):], t)
+        return step
+
+      baseline = time_step(args, sess, dpg, every_step)
+      print "%-24s %12s %10s" % ("summaries", "step", "speedup")
+      print "%-24s %11.2fms %9.2fx" % ("every step", baseline * 1000, 1.0)
+      for schedule, scheduler in schedules:
+        step_time = time_step(args, sess, dpg, scheduled(scheduler))
+        print "%-24s %11.2fms %9.2fx" % ("scheduled %s" % schedule,
+                                         step_time * 1000,
+                                         baseline / step_time)
+      step_time = time_step(args, sess, dpg, no_summaries)
+      print "%-24s %11.2fms %9.2fx" % ("none", step_time * 1000,
+                                       baseline / step_time)
+
+    summary_writer.close()
+  finally:
+    shutil.rmtree(logdir)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -0,0 +1,101 @@
+"""
+Benchmark the latency of the soft tracking-model update
+
+    track <- tau * main + (1 - tau) * track
+
+against parameter count, for MLPs of increasing size:
+
+1. one `tf.assign` per parameter, grouped (the original
+   `util.track_model_updates`),
+2. a single assign on a `util.TrackingParams` flat buffer, and
+3. the flat update run only every `--interval` steps with
+   `util.every_n_steps` (mean latency per run).
+
+    PYTHONPATH=. python benchmarks/bench_tracking_update.py
+"""
+
+import argparse
+import time
+
+import tensorflow as tf
+
+from rlcomp import util
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--architectures", default="20;64,64;256,256,256;"
+                                                  "512,512,512,512")
+argparser.add_argument("--input_dim", type=int, default=40)
+argparser.add_argument("--interval", type=int, default=10)
+argparser.add_argument("--num_steps", type=int, default=500)
+
+
+def build_params(input_dim, hidden):
+  """Create the parameters of an MLP in the current variable scope."""
+  params = {}
+  dims = [input_dim] + hidden + [1]
+  for i, (src_dim, tgt_dim) in enumerate(zip(dims, dims[1:])):
+    params["W%i" % i] = tf.get_variable("W%i" % i, (src_dim, tgt_dim))
+    params["b%i" % i] = tf.get_variable("b%i" % i, (tgt_dim,))
+  return params
+
+
+def per_variable_update(params, tau):
+  updates = []
+  with tf.variable_scope("track"):
+    for name, param in params.items():
+      track_param = tf.get_variable(name, param.get_shape())
+      updates.append(tf.assign(track_param,
+                               tau * param + (1 - tau) * track_param))
+  return tf.group(*updates)
+
+
+def flat_update(params, tau):
+  with tf.variable_scope("track"):
+    return util.TrackingParams(params).make_update(tau)
+
+
+def interval_flat_update(interval):
+  def build(params, tau):
+    with tf.variable_scope("track"):
+      tracking = util.TrackingParams(params)
+    return util.every_n_steps(interval, lambda: tracking.make_update(tau))
+  return build
+
+
+def bench(args, hidden, build_fn):
+  with tf.Graph().as_default(), tf.Session() as sess:
+    with tf.variable_scope("main"):
+      params = build_params(args.input_dim, hidden)
+    update = build_fn(params, 0.001)
+
+    sess.run(tf.initialize_all_variables())
+    sess.run(update)
+
+    start = time.time()
+    for _ in xrange(args.num_steps):
+      sess.run(update)
+    elapsed = (time.time() - start) / args.num_steps
+
+    num_params = sum(param.get_shape().num_elements()
+                     for param in params.values())
+    return num_params, len(params), elapsed
+
+
+def main(args):
+  builders = [per_variable_update, flat_update,
+              interval_flat_update(args.interval)]
+
+  print "%12s %8s %16s %16s %16s" % ("params", "vars", "per-variable",
+                                     "flat", "flat every %i" % args.interval)
+  for arch in args.architectures.split(";"):
+    hidden = [int(x) for x in filter(None, arch.split(","))]
+    results = [bench(args, hidden, build_fn) for build_fn in builders]
+    num_params, num_vars, _ = results[0]
+    print "%12i %8i %15.3fms %15.3fms %15.3fms" % (
+        (num_params, num_vars) + tuple(elapsed * 1000
+                                       for _, _, elapsed in results))
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
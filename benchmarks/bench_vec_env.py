@@ -0,0 +1,64 @@
+"""
+Benchmark cartpole experience collection throughput against the number of
+lockstep environment instances.
+
+Uses the pure-NumPy cartpole stand-in, so `tdlearn` is not required. The
+`N = 1 (serial)` row is the original `run_episode` path, which evaluates the
+policy once per state.
+
+    PYTHONPATH=. python benchmarks/bench_vec_env.py
+"""
+
+import argparse
+import time
+
+import tensorflow as tf
+
+from rlcomp import envs
+from rlcomp import util
+from rlcomp.dpg import DPG
+from rlcomp.tasks import cartpole
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--num_envs", default="1,2,4,8,16,32,64,128")
+argparser.add_argument("--episode_length", type=int, default=100)
+argparser.add_argument("--num_episodes", type=int, default=5)
+argparser.add_argument("--policy_dims", default="20")
+
+
+def main(args):
+  mdp_spec = util.MDPSpec(envs.CartPoleSwingUp.dim_S,
+                          envs.CartPoleSwingUp.dim_A)
+  policy_dims = [int(x) for x in args.policy_dims.split(",")]
+  dpg = DPG(mdp_spec, util.DPGSpec(policy_dims, []))
+  buffer = util.ReplayBuffer(10 ** 6, mdp_spec)
+
+  with tf.Session() as sess:
+    sess.run(tf.initialize_all_variables())
+
+    print "%16s %16s" % ("N", "transitions/s")
+
+    mdp = envs.CartPoleSwingUp()
+    start = time.time()
+    for _ in xrange(args.num_episodes):
+      cartpole.run_episode(mdp, dpg, dpg.a_explore, buffer,
+                           max_len=args.episode_length)
+    elapsed = time.time() - start
+    print "%16s %16.0f" % ("1 (serial)",
+                           args.num_episodes * args.episode_length / elapsed)
+
+    for num_envs in [int(x) for x in args.num_envs.split(",")]:
+      vec_env = envs.CartPoleSwingUp(num_envs)
+      start = time.time()
+      for _ in xrange(args.num_episodes):
+        cartpole.run_episodes(vec_env, dpg, dpg.a_explore, buffer,
+                              max_len=args.episode_length)
+      elapsed = time.time() - start
+
+      transitions = args.num_episodes * args.episode_length * num_envs
+      print "%16i %16.0f" % (num_envs, transitions / elapsed)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
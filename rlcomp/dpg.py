@@ -3,20 +3,24 @@ Implementation of a deep deterministic policy gradient RL learner.
 Roughly follows algorithm described in Lillicrap et al. (2015).
 """
 
+from collections import OrderedDict
 from functools import partial
 
 import tensorflow as tf
 from tensorflow.models.rnn import rnn, rnn_cell, seq2seq
 
-from rlcomp.pointer_network import ptr_net_decoder
+from rlcomp.pointer_network import dynamic_ptr_net_decoder, ptr_net_decoder
 from rlcomp import util
 
 
 def policy_model(inp, mdp, spec, name="policy", reuse=None,
-                 track_scope=None):
+                 track_params=None):
   """
   Predict actions for the given input batch.
 
+  If `track_params` (a `util.TrackingParams`) is given, build a tracking
+  model which reads its parameters from it.
+
   Returns:
     actions: `batch_size * action_dim`
   """
@@ -25,7 +29,7 @@ def policy_model(inp, mdp, spec, name="policy", reuse=None,
   with tf.variable_scope(name, reuse=reuse,
                          initializer=tf.truncated_normal_initializer(stddev=0.5)):
     return util.mlp(inp, mdp.state_dim, mdp.action_dim,
-                    hidden=spec.policy_dims, track_scope=track_scope)
+                    hidden=spec.policy_dims, track_params=track_params)
 
 
 def noise_gaussian(inp, actions, stddev, name="noiser"):
@@ -39,10 +43,13 @@ def noise_gaussian(inp, actions, stddev, name="noiser"):
 
 
 def critic_model(inp, actions, mdp, spec, name="critic", reuse=None,
-                 track_scope=None):
+                 track_params=None):
   """
   Predict the Q-value of the given state-action pairs.
 
+  If `track_params` (a `util.TrackingParams`) is given, build a tracking
+  model which reads its parameters from it.
+
   Returns:
     `batch_size` vector of Q-value predictions.
   """
@@ -51,7 +58,7 @@ def critic_model(inp, actions, mdp, spec, name="critic", reuse=None,
     output = util.mlp(tf.concat(1, [inp, actions]),
                       mdp.state_dim + mdp.action_dim, 1,
                       hidden=spec.critic_dims, bias_output=True,
-                      track_scope=track_scope)
+                      track_params=track_params)
 
     return tf.squeeze(output)
 
@@ -59,13 +66,25 @@ def critic_model(inp, actions, mdp, spec, name="critic", reuse=None,
 class DPG(object):
 
   def __init__(self, mdp, spec, inputs=None, q_targets=None, tau=None,
-               noiser=None, name="dpg"):
+               noiser=None, rewards=None, states_next=None, terminals=None,
+               gamma=None, track_interval=1, name="dpg", summary_prefix=""):
     """
     Args:
       mdp:
       spec:
       inputs: Tensor of input values
-      q_targets: Tensor of Q-value targets
+      q_targets: Tensor of Q-value targets. If not given, targets are
+        computed in the graph from `rewards`, `states_next` and `terminals`
+        using the tracking models.
+      rewards: Tensor of rewards `r_t` observed for `inputs`
+      states_next: Tensor of successor states `s_{t+1}`
+      terminals: Float tensor which is 1 where `s_{t+1}` ends an episode
+      gamma: Discount factor (float or scalar tensor)
+      track_interval: Apply the soft tracking-model update on only every
+        `track_interval`th run of `track_update`
+      name: Variable scope of the model. Models with distinct names can be
+        built and trained side by side in one graph.
+      summary_prefix: Prefix for the tags of this model's summaries
     """
 
     if noiser is None:
@@ -81,15 +100,27 @@ class DPG(object):
     self.inputs = inputs
     self.q_targets = q_targets
     self.tau = tau
+    self.rewards = rewards
+    self.states_next = states_next
+    self.terminals = terminals
+    self.gamma = gamma
+    self.track_interval = track_interval
+
+    # `util.TrackingParams` of tracking models, keyed by tracking model name
+    self._tracking = {}
 
     self.name = name
+    self.summary_prefix = summary_prefix
 
     with tf.variable_scope(self.name) as vs:
       self._vs = vs
+      # Parameters of this instance, keyed by sub-model scope.
+      self.registry = util.ParamRegistry(vs.name)
 
-      self._make_params()
-      self._make_inputs()
-      self._make_graph()
+      with self.registry.capture():
+        self._make_params()
+        self._make_inputs()
+        self._make_graph()
       self._make_objectives()
       self._make_updates()
 
@@ -100,10 +131,20 @@ class DPG(object):
     self.inputs = (self.inputs
                    or tf.placeholder(tf.float32, (None, self.mdp_spec.state_dim),
                                      name="inputs"))
-    self.q_targets = (self.q_targets
-                      or tf.placeholder(tf.float32, (None,), name="q_targets"))
     self.tau = self.tau or tf.placeholder(tf.float32, (1,), name="tau")
 
+    # Inputs for in-graph Q-value targets.
+    self.rewards = (self.rewards
+                    or tf.placeholder(tf.float32, (None,), name="rewards"))
+    self.states_next = (self.states_next
+                        or tf.placeholder(tf.float32,
+                                          (None, self.mdp_spec.state_dim),
+                                          name="states_next"))
+    self.terminals = (self.terminals
+                      or tf.placeholder(tf.float32, (None,), name="terminals"))
+    if self.gamma is None:
+      self.gamma = tf.placeholder(tf.float32, (), name="gamma")
+
   def _make_graph(self):
     # Build main model: actor
     self.a_pred = policy_model(self.inputs, self.mdp_spec, self.spec,
@@ -117,40 +158,165 @@ class DPG(object):
                                    self.spec, name="critic", reuse=True)
 
     # Build tracking models.
-    self.a_pred_track = policy_model(self.inputs, self.mdp_spec, self.spec,
-                                     track_scope="%s/policy" % self.name,
-                                     name="policy_track")
-    self.critic_on_track = critic_model(self.inputs, self.a_pred, self.mdp_spec,
-                                        self.spec, name="critic_track",
-                                        track_scope="%s/critic" % self.name)
+    self.a_pred_track = policy_model(
+        self.inputs, self.mdp_spec, self.spec, name="policy_track",
+        track_params=self._track_params("policy"))
+    self.critic_on_track = critic_model(
+        self.inputs, self.a_pred, self.mdp_spec, self.spec,
+        name="critic_track", track_params=self._track_params("critic"))
+
+    self._make_q_targets()
+
+  def _make_q_targets(self):
+    """
+    Build TD targets `r_t + gamma * Q'(s_{t+1}, pi'(s_{t+1}))` from the
+    tracking models, unless targets were provided by the client.
+
+    `self.q_targets` may still be fed directly, in which case the target
+    subgraph is not evaluated.
+    """
+    if self.q_targets is not None:
+      return
+
+    self.a_next_track = policy_model(
+        self.states_next, self.mdp_spec, self.spec, name="policy_track",
+        reuse=True, track_params=self._track_params("policy"))
+    self.q_next_track = critic_model(
+        self.states_next, self.a_next_track, self.mdp_spec, self.spec,
+        name="critic_track", reuse=True,
+        track_params=self._track_params("critic"))
+
+    bootstrap = self.gamma * (1.0 - self.terminals) * self.q_next_track
+    self.q_targets = tf.stop_gradient(self.rewards + bootstrap,
+                                      name="q_targets")
 
   def _make_objectives(self):
-    # TODO: Hacky, will cause clashes if multiple DPG instances.
-    # Can't instantiate a VS cleanly either, because policy params might be
-    # nested in unpredictable way by subclasses.
-    policy_params = [var for var in tf.all_variables()
-                     if "policy/" in var.name]
-    critic_params = [var for var in tf.all_variables()
-                     if "critic/" in var.name]
-    self.policy_params = policy_params
-    self.critic_params = critic_params
+    self.policy_params = self._policy_params()
+    self.critic_params = self.registry.params("critic")
 
     # Policy objective: maximize on-policy critic activations
     self.policy_objective = -tf.reduce_mean(self.critic_on)
 
     # Critic objective: minimize MSE of off-policy Q-value predictions
-    q_errors = tf.square(self.critic_off - self.q_targets)
+    # Per-example TD errors are exposed for prioritized replay.
+    self.td_errors = self.critic_off - self.q_targets
+    q_errors = tf.square(self.td_errors)
     self.critic_objective = tf.reduce_mean(q_errors)
 
+    # Importance-weighted critic objective, for use with prioritized replay.
+    self.critic_weights = tf.placeholder(tf.float32, (None,),
+                                         name="critic_weights")
+    self.critic_objective_weighted = tf.reduce_mean(self.critic_weights
+                                                    * q_errors)
+
+  def _policy_params(self):
+    return self.registry.params("policy")
+
+  def _scalar_summary(self, tag, value):
+    return util.scalar_summary(self.summary_prefix + tag, value)
+
+  def _track_params(self, name, track_name=None):
+    """
+    Get the `util.TrackingParams` which a tracking copy of model `name`
+    reads its parameters from, creating them on first use. Call only after
+    model `name` is built.
+
+    Args:
+      name: Scope of the main model (e.g. `critic`)
+      track_name: Scope of the tracking model. Defaults to `<name>_track`.
+    """
+    track_name = track_name or "%s_track" % name
+    if track_name not in self._tracking:
+      with tf.variable_scope(self._vs), tf.variable_scope(track_name):
+        self._tracking[track_name] = util.TrackingParams(
+            self._tracked_params(name))
+    return self._tracking[track_name]
+
+  def _tracked_params(self, name):
+    """
+    Returns:
+      Dict of the parameters of model `name` which its tracking copy reads
+    """
+    return self.registry.named_params(name)
+
+  def make_policy_copy(self, name="policy_actor"):
+    """
+    Build a copy of the policy network whose parameters change only when the
+    returned sync op is run. Useful for actors which should act with a
+    stable, periodically refreshed policy while the main policy trains.
+
+    Returns:
+      a_explore: Exploratory actions from the policy copy (noised with
+        `self.noiser`), computed on `self.inputs`
+      sync: Op which copies the current main policy parameters into the copy
+    """
+    with tf.variable_scope(self._vs), self.registry.capture():
+      copy_params = self._track_params("policy", name)
+      a_pred = policy_model(self.inputs, self.mdp_spec, self.spec, name=name,
+                            track_params=copy_params)
+      a_explore = self.noiser(self.inputs, a_pred)
+
+    sync = copy_params.make_update(1.0)
+    return a_explore, sync
+
+  def make_train_step(self, policy_optimizer, critic_optimizer,
+                      critic_objective=None, track_update=True):
+    """
+    Build a single op which performs a full DPG training step: a policy
+    update and a critic update computed from the same parameter values,
+    followed by the soft tracking-model update.
+
+    Args:
+      policy_optimizer: `tf.train.Optimizer` for the policy objective
+      critic_optimizer: `tf.train.Optimizer` for the critic objective
+      critic_objective: Critic objective to minimize. Defaults to
+        `self.critic_objective`.
+      track_update: If `True`, also run `self.track_update` (which requires
+        `self.tau` to be fed) after both updates.
+
+    Returns:
+      policy_update, critic_update: Parameter update ops
+      train_step: Op which runs the whole step
+    """
+    if critic_objective is None:
+      critic_objective = self.critic_objective
+
+    policy_grads = policy_optimizer.compute_gradients(
+        self.policy_objective, var_list=self.policy_params)
+    critic_grads = critic_optimizer.compute_gradients(
+        critic_objective, var_list=self.critic_params)
+
+    # Compute all gradients before any parameter changes, since each
+    # objective reads both policy and critic parameters.
+    grads = [grad for grad, _ in policy_grads + critic_grads
+             if grad is not None]
+    with tf.control_dependencies(grads):
+      policy_update = policy_optimizer.apply_gradients(policy_grads)
+      critic_update = critic_optimizer.apply_gradients(critic_grads)
+
+    if track_update:
+      # Build a tracking update which is ordered after the parameter updates.
+      with tf.control_dependencies([policy_update, critic_update]):
+        train_step = self._make_track_update()
+    else:
+      train_step = tf.group(policy_update, critic_update, name="train_step")
+
+    return policy_update, critic_update, train_step
+
   def _make_updates(self):
-    # Make tracking updates.
-    policy_track_update = util.track_model_updates(
-         "%s/policy" % self.name, "%s/policy_track" % self.name, self.tau)
-    critic_track_update = util.track_model_updates(
-        "%s/critic" % self.name, "%s/critic_track" % self.name, self.tau)
-    self.track_update = tf.group(policy_track_update, critic_track_update)
+    self.track_update = self._make_track_update()
 
-    # SGD updates are left to client.
+    # SGD updates are left to client (see also `make_train_step`).
+
+  def _make_track_update(self):
+    """
+    Build an op which moves tracking models toward the main models. Each
+    tracking model is updated with a single assign to its flat parameter
+    buffer.
+    """
+    return util.every_n_steps(self.track_interval, lambda: tf.group(
+        self._track_params("policy").make_update(self.tau),
+        self._track_params("critic").make_update(self.tau)))
 
 
 class PointerNetDPG(DPG):
@@ -169,16 +335,22 @@ class PointerNetDPG(DPG):
   timestep.
   """
 
-  def __init__(self, mdp, spec, input_dim, seq_length, **kwargs):
+  def __init__(self, mdp, spec, input_dim, seq_length, num_heads=1,
+               attention_mode="additive", **kwargs):
     """
     Args:
       mdp:
       spec:
       input_dim: Dimension of input values provided to encoder (`self.inputs`)
       seq_length:
+      num_heads: Number of decoder attention heads
+      attention_mode: `additive` or `dot` decoder attention scoring (see
+        `pointer_network.make_attention`)
     """
     self.input_dim = input_dim
     self.seq_length = seq_length
+    self.num_heads = num_heads
+    self.attention_mode = attention_mode
 
     # state: decoder hidden state + input value
     assert mdp.state_dim == self.input_dim
@@ -197,9 +369,11 @@ class PointerNetDPG(DPG):
     # Encode sequence.
     # TODO: MultilayerRNN?
     encoder_cell = util.GRUCell(self.input_dim, self.spec.policy_dims[0])
-    _, self.encoder_states = rnn.rnn(encoder_cell, self.inputs,
+    # A GRU's outputs are its states. Reading states from the outputs works
+    # whether `rnn.rnn` returns all states or only the final one.
+    self.encoder_states, _ = rnn.rnn(encoder_cell, self.inputs,
                                      dtype=tf.float32, scope="encoder")
-    assert len(self.encoder_states) == self.seq_length # DEV
+    self.encoder_state = self.encoder_states[-1]
 
     # Reshape encoder states into an "attention states" tensor of shape
     # `batch_size * seq_length * policy_dim`.
@@ -220,8 +394,9 @@ class PointerNetDPG(DPG):
 
     # Build pointer-network decoder.
     self.a_pred, dec_states, dec_inputs = ptr_net_decoder(
-        dec_inp, self.encoder_states[-1], attn_states, decoder_cell,
-        loop_function=self._loop_function(), scope="decoder")
+        dec_inp, self.encoder_state, attn_states, decoder_cell,
+        num_heads=self.num_heads, loop_function=self._loop_function(),
+        attention_mode=self.attention_mode, scope="decoder")
     # Store dynamically calculated inputs -- critic may want to use these
     self.decoder_inputs = dec_inputs
     # Again strip the initial state.
@@ -247,16 +422,11 @@ class PointerNetDPG(DPG):
                         for _ in range(self.seq_length)]
 
   def _policy_params(self):
-    return [var for var in tf.all_variables()
-            if "encoder/" in var.name or "decoder/" in var.name]
+    return self.registry.params("encoder", "decoder")
 
   def _make_objectives(self):
-    # TODO: Hacky, will cause clashes if multiple DPG instances.
-    policy_params = self._policy_params()
-    critic_params = [var for var in tf.all_variables()
-                     if "critic/" in var.name]
-    self.policy_params = policy_params
-    self.critic_params = critic_params
+    self.policy_params = self._policy_params()
+    self.critic_params = self.registry.params("critic")
 
     # Policy objective: maximize on-policy critic activations
     mean_critic_over_time = tf.add_n(self.critic_on) / self.seq_length
@@ -264,25 +434,25 @@ class PointerNetDPG(DPG):
     self.policy_objective = -mean_critic
 
     # DEV
-    tf.scalar_summary("critic(a_pred).mean", mean_critic)
+    self._scalar_summary("critic(a_pred).mean", mean_critic)
 
     # Critic objective: minimize MSE of off-policy Q-value predictions
     q_errors = [tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(critic_off_t, q_targets_t))#tf.square(critic_off_t - q_targets_t))
                 for critic_off_t, q_targets_t
                 in zip(self.critic_off_pre, self.q_targets)]
     self.critic_objective = tf.add_n(q_errors) / self.seq_length
-    tf.scalar_summary("critic_objective", self.critic_objective)
+    self._scalar_summary("critic_objective", self.critic_objective)
 
     mean_critic_off = tf.reduce_mean(tf.add_n(self.critic_off)) / self.seq_length
-    tf.scalar_summary("critic(a_explore).mean", mean_critic_off)
+    self._scalar_summary("critic(a_explore).mean", mean_critic_off)
 
-    tf.scalar_summary("a_pred.mean", tf.reduce_mean(tf.add_n(self.a_pred)) / self.seq_length)
-    tf.scalar_summary("a_pred.maxabs", tf.reduce_max(tf.abs(tf.pack(self.a_pred))))
+    self._scalar_summary("a_pred.mean", tf.reduce_mean(tf.add_n(self.a_pred)) / self.seq_length)
+    self._scalar_summary("a_pred.maxabs", tf.reduce_max(tf.abs(tf.pack(self.a_pred))))
 
-  def _make_updates(self):
-    critic_updates = util.track_model_updates(
-        "%s/critic" % self.name, "%s/critic_track" % self.name, self.tau)
-    self.track_update = critic_updates
+  def _make_track_update(self):
+    return util.every_n_steps(
+        self.track_interval,
+        lambda: self._track_params("critic").make_update(self.tau))
 
   def _deref_pointer(self, attn_states, soft_ptr):
     """
@@ -322,41 +492,64 @@ class PointerNetDPG(DPG):
     return loop_fn
 
   def _critic(self, actions_lst, reuse=None):
-    scores_pre, scores, scores_track = [], [], []
+    """
+    Evaluate Q(s, a) at each timestep of a rollout. The state at timestep
+    `t` is the action taken at `t - 1` (zero at `t = 0`).
+
+    The critic is stateless apart from this previous action, so all
+    timesteps are evaluated with a single critic application over the
+    stacked `(seq_length * batch_size)` batch.
 
+    Returns:
+      scores_pre, scores, scores_track: Lists of `batch_size` critic logits,
+        main critic outputs and tracking critic outputs at each timestep
+    """
     # Fetch scaler parameter (shared across critics).
     with tf.variable_scope("critic", reuse=reuse):
       scaler = tf.get_variable("scaler", (1,))
       if reuse is None: # First time fetching this variable; log its value
-        tf.scalar_summary("critic/scaler", scaler[0])
+        self._scalar_summary("critic/scaler", scaler[0])
 
-    prev_action = tf.zeros_like(actions_lst[0])
+    # Stack timesteps along the batch axis: (seq_length * batch_size) * dim
+    prev_actions = [tf.zeros_like(actions_lst[0])] + actions_lst[:-1]
+    states = tf.concat(0, prev_actions)
+    actions = tf.concat(0, actions_lst)
 
-    # Evaluate Q(s, a) at each timestep.
-    for t, actions_t in enumerate(actions_lst):
-      state_t = prev_action
+    critic_pre, critic_track = self._critic_flat(states, actions,
+                                                 reuse=reuse)
+#    critic_pre *= scaler
+#    critic_track *= scaler
 
-      reuse_t = (reuse or t > 0) or None
-      critic_pre = critic_model(state_t, actions_t, self.mdp_spec,
-                                self.spec, name="critic", reuse=reuse_t)
-#      critic_out *= scaler
-      critic_out = tf.sigmoid(critic_pre)
+    scores_pre = tf.split(0, len(actions_lst), critic_pre)
+    scores = tf.split(0, len(actions_lst), tf.sigmoid(critic_pre))
+    scores_track = tf.split(0, len(actions_lst), tf.sigmoid(critic_track))
 
-      # Also build a tracking model
-      critic_track = critic_model(state_t, actions_t, self.mdp_spec,
-                                  self.spec, name="critic_track",
-                                  track_scope="%s/critic" % self.name,
-                                  reuse=reuse_t)
-#      critic_track *= scaler
-      critic_track = tf.sigmoid(critic_track)
+    return scores_pre, scores, scores_track
 
-      prev_action = actions_t
+  def _tracked_params(self, name):
+    params = super(PointerNetDPG, self)._tracked_params(name)
+    if name == "critic":
+      # `scaler` lives in the critic scope but is read by no critic model.
+      params = OrderedDict((name_i, param) for name_i, param in params.items()
+                           if name_i != "scaler")
+    return params
 
-      scores_pre.append(critic_pre)
-      scores.append(critic_out)
-      scores_track.append(critic_track)
+  def _critic_flat(self, states, actions, reuse=None):
+    """
+    Apply the main and tracking critics to a flat batch of state-action
+    pairs.
 
-    return scores_pre, scores, scores_track
+    Returns:
+      critic_pre: Main critic logits
+      critic_track: Tracking critic logits
+    """
+    critic_pre = critic_model(states, actions, self.mdp_spec, self.spec,
+                              name="critic", reuse=reuse)
+    critic_track = critic_model(states, actions, self.mdp_spec, self.spec,
+                                name="critic_track",
+                                track_params=self._track_params("critic"),
+                                reuse=reuse)
+    return critic_pre, critic_track
 
   def harden_actions(self, action_list):
     """
@@ -369,3 +562,149 @@ class PointerNetDPG(DPG):
     # TODO: eventually we'd like to run this within a TF graph when possible.
     # We can probably define hardening solely with TF
     raise NotImplementedError("abstract method")
+
+
+class DynamicPointerNetDPG(PointerNetDPG):
+
+  """
+  Pointer-network DPG whose encoder, decoder and critic are built with loops
+  and batched ops rather than unrolled per timestep.
+
+  Inputs are a single `batch_size * seq_length * input_dim` tensor together
+  with a `batch_size` vector of sequence lengths, where `seq_length` is the
+  longest sequence in the batch. Positions past each sequence's length are
+  padding: the decoder never points at them, and they are masked out of the
+  objectives. Graph size does not depend on sequence length, so one graph
+  trains and serves sequences of any length.
+
+  Rollouts (`a_pred`, `a_explore`) are `batch_size * seq_length *
+  seq_length` soft pointers, and critic outputs and Q-value targets are
+  `batch_size * seq_length`.
+  """
+
+  def __init__(self, mdp, spec, input_dim, lengths=None, **kwargs):
+    """
+    Args:
+      mdp:
+      spec:
+      input_dim: Dimension of input values provided to encoder (`self.inputs`)
+      lengths: int32 `batch_size` vector of sequence lengths
+    """
+    self.lengths = lengths
+    super(DynamicPointerNetDPG, self).__init__(mdp, spec, input_dim, None,
+                                               **kwargs)
+
+  def _make_inputs(self):
+    if self.inputs is None:
+      self.inputs = tf.placeholder(tf.float32, (None, None, self.input_dim),
+                                   name="inputs")
+    if self.lengths is None:
+      self.lengths = tf.placeholder(tf.int32, (None,), name="lengths")
+    self.tau = self.tau or tf.placeholder(tf.float32, (1,), name="tau")
+
+    # batch_size * seq_length; 1 at valid positions, 0 at padding
+    self.max_length = tf.shape(self.inputs)[1]
+    self.mask = tf.to_float(tf.less(
+        tf.expand_dims(tf.range(0, self.max_length), 0),
+        tf.expand_dims(self.lengths, 1)))
+
+  def _make_graph(self):
+    # Encode sequence.
+    encoder_cell = util.GRUCell(self.input_dim, self.spec.policy_dims[0])
+    self.encoder_states, self.encoder_state = tf.nn.dynamic_rnn(
+        encoder_cell, self.inputs, sequence_length=self.lengths,
+        dtype=tf.float32, scope="encoder")
+
+    # As in `PointerNetDPG`, attend over (and point at) the inputs.
+    decoder_cell = util.GRUCell(self.input_dim, self.spec.policy_dims[0])
+    self.a_pred, self.decoder_states, self.decoder_inputs = \
+        dynamic_ptr_net_decoder(self.encoder_state, self.inputs, decoder_cell,
+                                self._loop_function(),
+                                attention_mask=self.mask,
+                                num_heads=self.num_heads,
+                                attention_mode=self.attention_mode,
+                                scope="decoder")
+
+    # Use noiser to build exploratory rollouts.
+    self.a_explore = self.noiser(self.inputs, self.a_pred)
+
+    # Now "dereference" the soft pointers produced by the policy network.
+    a_pred_deref = self._deref_rollout(self.a_pred)
+    a_explore_deref = self._deref_rollout(self.a_explore)
+
+    _, self.critic_on, self.critic_on_track = self._critic(a_pred_deref)
+    self.critic_off_pre, self.critic_off, self.critic_off_track = \
+        self._critic(a_explore_deref, reuse=True)
+
+    self._make_q_targets()
+
+  def _make_q_targets(self):
+    if self.q_targets is None:
+      self.q_targets = tf.placeholder(tf.float32, (None, None),
+                                      name="q_targets")
+
+  def _masked_mean(self, x):
+    return tf.reduce_sum(x * self.mask) / tf.reduce_sum(self.mask)
+
+  def _make_objectives(self):
+    self.policy_params = self._policy_params()
+    self.critic_params = self.registry.params("critic")
+
+    # Policy objective: maximize on-policy critic activations
+    mean_critic = self._masked_mean(self.critic_on)
+    self.policy_objective = -mean_critic
+    self._scalar_summary("critic(a_pred).mean", mean_critic)
+
+    # Critic objective: minimize cross-entropy of off-policy Q-value
+    # predictions at valid timesteps
+    q_errors = tf.nn.sigmoid_cross_entropy_with_logits(self.critic_off_pre,
+                                                       self.q_targets)
+    self.critic_objective = self._masked_mean(q_errors)
+    self._scalar_summary("critic_objective", self.critic_objective)
+
+    self._scalar_summary("critic(a_explore).mean",
+                         self._masked_mean(self.critic_off))
+
+  def _deref_rollout(self, rollout):
+    """
+    Args:
+      rollout: `batch_size * seq_length * seq_length` soft pointers
+
+    Returns:
+      `batch_size * seq_length * input_dim` weighted sums of inputs
+    """
+    return tf.batch_matmul(rollout, self.inputs)
+
+  def _loop_function(self):
+    return lambda output_t, t: self._deref_pointer(self.inputs, output_t)
+
+  def _critic(self, actions, reuse=None):
+    """
+    Evaluate Q(s, a) at every timestep of a batch of rollouts with a single
+    critic application over the flattened `(batch_size * seq_length)` batch.
+    As in `PointerNetDPG`, the state at timestep `t` is the action taken at
+    `t - 1` (zero at `t = 0`).
+
+    Args:
+      actions: `batch_size * seq_length * action_dim`
+
+    Returns:
+      scores_pre, scores, scores_track: `batch_size * seq_length` critic
+        logits, main critic outputs and tracking critic outputs
+    """
+    batch_size = tf.shape(actions)[0]
+    seq_length = tf.shape(actions)[1]
+    action_dim = self.mdp_spec.action_dim
+
+    prev_actions = tf.slice(tf.pad(actions, [[0, 0], [1, 0], [0, 0]]),
+                            [0, 0, 0], tf.pack([-1, seq_length, -1]))
+    states = tf.reshape(prev_actions, [-1, action_dim])
+    actions = tf.reshape(actions, [-1, action_dim])
+
+    critic_pre, critic_track = self._critic_flat(states, actions,
+                                                 reuse=reuse)
+
+    out_shape = tf.pack([batch_size, seq_length])
+    critic_pre = tf.reshape(critic_pre, out_shape)
+    critic_track = tf.reshape(critic_track, out_shape)
+    return critic_pre, tf.sigmoid(critic_pre), tf.sigmoid(critic_track)
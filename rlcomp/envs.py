@@ -0,0 +1,145 @@
+"""
+Vectorized environments: step `N` MDP instances in lockstep, consuming and
+producing `N * dim` arrays so that a policy can be evaluated for all
+instances at once.
+"""
+
+import numpy as np
+
+
+class CartPoleSwingUp(object):
+
+  """
+  Pure-NumPy cart-pole swing-up dynamics, batched over `num_envs` instances.
+
+  This is a stand-in for `tdlearn.examples.PendulumSwingUpCartPole` for use
+  when `tdlearn` is not available. States follow the PILCO cart-pole layout
+  `(x, x_dot, theta_dot, theta)` with `theta = 0` hanging straight down;
+  actions are a scalar horizontal force. The reward is `-cos(theta)`, i.e. 1
+  when the pole is upright.
+
+  Also supports `tdlearn`'s `sample_transition` interface for a single
+  instance.
+  """
+
+  dim_S = 4
+  dim_A = 1
+
+  def __init__(self, num_envs=1, dt=0.1, substeps=10, mass_cart=0.5,
+               mass_pole=0.5, length=0.6, friction=0.1, gravity=9.82,
+               max_force=10.0, start_noise=0.05):
+    self.num_envs = num_envs
+    self.dt = dt
+    self.substeps = substeps
+    self.mass_cart = mass_cart
+    self.mass_pole = mass_pole
+    self.length = length
+    self.friction = friction
+    self.gravity = gravity
+    self.max_force = max_force
+    self.start_noise = start_noise
+
+    self.states = None
+
+  def _start_states(self, n):
+    return self.start_noise * np.random.randn(n, self.dim_S)
+
+  def _rewards(self, states):
+    return -np.cos(states[:, 3])
+
+  def _transition(self, states, actions):
+    """Integrate dynamics forward by `dt` for a batch of states."""
+    M, m, l = self.mass_cart, self.mass_pole, self.length
+    b, g = self.friction, self.gravity
+    u = np.clip(actions[:, 0], -self.max_force, self.max_force)
+
+    x, x_dot, theta_dot, theta = [col.copy() for col in states.T]
+    h = self.dt / self.substeps
+    for _ in xrange(self.substeps):
+      sin, cos = np.sin(theta), np.cos(theta)
+      denom = 4 * (M + m) - 3 * m * cos ** 2
+      x_acc = (2 * m * l * theta_dot ** 2 * sin + 3 * m * g * sin * cos
+               + 4 * u - 4 * b * x_dot) / denom
+      theta_acc = (-3 * m * l * theta_dot ** 2 * sin * cos
+                   - 6 * (M + m) * g * sin
+                   - 6 * (u - b * x_dot) * cos) / (l * denom)
+
+      # Semi-implicit Euler: update velocities first, for stable energy.
+      x_dot += h * x_acc
+      theta_dot += h * theta_acc
+      x += h * x_dot
+      theta += h * theta_dot
+
+    return np.column_stack((x, x_dot, theta_dot, theta))
+
+  def reset(self):
+    """
+    Returns:
+      `num_envs * dim_S` start states
+    """
+    self.states = self._start_states(self.num_envs)
+    return self.states
+
+  def step(self, actions):
+    """
+    Advance every instance by one timestep.
+
+    Args:
+      actions: `num_envs * dim_A`
+
+    Returns:
+      states_next: `num_envs * dim_S`
+      rewards: `num_envs` vector
+    """
+    self.states = self._transition(self.states, np.asarray(actions))
+    return self.states, self._rewards(self.states)
+
+  def sample_transition(self, max_n, policy):
+    """
+    Generate `(s, a, s_next, r)` tuples for a single rollout of length
+    `max_n`, mirroring `tdlearn`'s MDP interface.
+    """
+    s = self._start_states(1)
+    for _ in xrange(max_n):
+      a = np.asarray(policy(s[0])).reshape((1, self.dim_A))
+      s_next = self._transition(s, a)
+      yield s[0], a[0], s_next[0], self._rewards(s_next)[0]
+      s = s_next
+
+
+class MDPVecEnv(object):
+
+  """
+  Lockstep wrapper around `num_envs` independent `tdlearn`-style MDP
+  instances.
+
+  Environment physics still runs per instance, but all instances are stepped
+  together so that the caller can evaluate its policy once per timestep for
+  the whole batch. Relies on the `start_state()`, `statefun(s, a)` and
+  `rewardfun(s, a)` members of `tdlearn.mdp.ContinuousMDP`.
+  """
+
+  def __init__(self, make_mdp, num_envs):
+    """
+    Args:
+      make_mdp: Zero-argument function which builds one MDP instance
+      num_envs:
+    """
+    self.mdps = [make_mdp() for _ in xrange(num_envs)]
+    self.num_envs = num_envs
+    self.dim_S = self.mdps[0].dim_S
+    self.dim_A = self.mdps[0].dim_A
+
+    self.states = np.empty((num_envs, self.dim_S))
+    self.rewards = np.empty((num_envs,))
+
+  def reset(self):
+    for i, mdp in enumerate(self.mdps):
+      self.states[i] = mdp.start_state()
+    return self.states
+
+  def step(self, actions):
+    for i, mdp in enumerate(self.mdps):
+      self.rewards[i] = mdp.rewardfun(self.states[i], actions[i])
+      self.states[i] = mdp.statefun(self.states[i], actions[i])
+    return self.states, self.rewards
@@ -0,0 +1,184 @@
+"""
+Inference-only decoding for trained pointer-network policies.
+
+`PointerNetInference` builds just the encoder and a single pointer-decoder
+step, with the same variable names as `PointerNetDPG` and
+`DynamicPointerNetDPG`, so it can restore the policy from either model's
+checkpoints. Critics, noisers and tracking models are not built.
+
+Decoding runs the encoder once per batch, then steps the decoder from NumPy.
+Each position is pointed at at most once, and padding is never pointed at.
+Beam search keeps the `beam_width` best partial pointer sequences per
+example; `beam_width=1` is masked greedy decoding. After each step, the next
+decoder input is the input at the chosen position.
+"""
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp.pointer_network import decoder_step, make_attention
+from rlcomp import util
+
+
+class PointerNetInference(object):
+
+  def __init__(self, input_dim, policy_dim, vocab_size=None, num_heads=1,
+               attention_mode="additive", name="dpg"):
+    """
+    Args:
+      input_dim: Dimension of encoder inputs
+      policy_dim: Encoder / decoder hidden state dimension (first entry of
+        `DPGSpec.policy_dims`)
+      vocab_size: If given, inputs are fed as `input_tokens` and embedded
+        with the model's `embedding` variable (as in the sorting task)
+      num_heads:
+      attention_mode:
+      name: Variable scope of the trained model
+    """
+    self.input_dim = input_dim
+    self.policy_dim = policy_dim
+    self.vocab_size = vocab_size
+    self.num_heads = num_heads
+
+    registry = util.ParamRegistry(name)
+    with tf.variable_scope(name), registry.capture():
+      if vocab_size:
+        self.embeddings = tf.get_variable("embedding",
+                                          (vocab_size, input_dim))
+        self.input_tokens = tf.placeholder(tf.int32, (None, None),
+                                           name="input_tokens")
+        self.inputs = tf.nn.embedding_lookup(self.embeddings,
+                                             self.input_tokens)
+      else:
+        self.inputs = tf.placeholder(tf.float32, (None, None, input_dim),
+                                     name="inputs")
+      self.lengths = tf.placeholder(tf.int32, (None,), name="lengths")
+
+      max_length = tf.shape(self.inputs)[1]
+      mask = tf.to_float(tf.less(tf.expand_dims(tf.range(0, max_length), 0),
+                                 tf.expand_dims(self.lengths, 1)))
+
+      encoder_cell = util.GRUCell(input_dim, policy_dim)
+      _, self.encoder_state = tf.nn.dynamic_rnn(
+          encoder_cell, self.inputs, sequence_length=self.lengths,
+          dtype=tf.float32, scope="encoder")
+
+      # Single decoder step. Each step feeds back the inputs and attention
+      # keys computed by the encoder run, so these are not recomputed.
+      with tf.variable_scope("decoder"):
+        attention = make_attention(self.inputs, num_heads=num_heads,
+                                   mode=attention_mode, attention_mask=mask)
+        self.keys = attention.keys
+
+        self.dec_inp = tf.placeholder(tf.float32, (None, input_dim),
+                                      name="dec_inp")
+        self.dec_attns = tf.placeholder(tf.float32,
+                                        (None, num_heads * input_dim),
+                                        name="dec_attns")
+        self.dec_state = tf.placeholder(tf.float32, (None, policy_dim),
+                                        name="dec_state")
+
+        decoder_cell = util.GRUCell(input_dim, policy_dim)
+        self.pointer, self.next_attns, self.next_state = decoder_step(
+            decoder_cell, attention, self.dec_inp, self.dec_attns,
+            self.dec_state)
+
+    self.variables = registry.all_params()
+
+  def decode(self, inputs, lengths, beam_width=1):
+    """
+    Decode a batch of sequences.
+
+    Args:
+      inputs: `batch_size * max_length` tokens (if `vocab_size` was given) or
+        `batch_size * max_length * input_dim` inputs, padded past each
+        sequence's length
+      lengths: `batch_size` vector of sequence lengths
+      beam_width:
+
+    Returns:
+      pointers: `batch_size * max_length` int32 matrix of the best pointer
+        sequence for each example; -1 past each sequence's length
+      scores: `batch_size` log-probabilities of the returned sequences
+    """
+    sess = tf.get_default_session()
+    lengths = np.asarray(lengths, dtype=np.int32)
+    batch_size, K = len(lengths), beam_width
+
+    feed_dict = {self.lengths: lengths}
+    feed_dict[self.input_tokens if self.vocab_size else self.inputs] = inputs
+    state, keys, attn_states = sess.run(
+        [self.encoder_state, self.keys, self.inputs], feed_dict)
+    max_length = attn_states.shape[1]
+
+    # Row `i * K + k` holds beam `k` of example `i`.
+    repeat = lambda x: np.repeat(x, K, axis=0)
+    lengths, attn_states, keys, state = \
+        map(repeat, (lengths, attn_states, keys, state))
+    rows = np.arange(batch_size * K)
+    examples = np.arange(batch_size)[:, np.newaxis]
+
+    inp = np.zeros((batch_size * K, self.input_dim), dtype=np.float32)
+    attns = np.zeros((batch_size * K, self.num_heads * self.input_dim),
+                     dtype=np.float32)
+    # Start with a single live beam per example, so that beams are not
+    # duplicates of each other.
+    scores = np.full((batch_size, K), -np.inf)
+    scores[:, 0] = 0.0
+    scores = scores.ravel()
+
+    padding = np.arange(max_length)[np.newaxis, :] >= lengths[:, np.newaxis]
+    used = np.zeros((batch_size * K, max_length), dtype=bool)
+    pointers = np.full((batch_size * K, max_length), -1, dtype=np.int32)
+
+    for t in xrange(max_length):
+      ptr, attns, state = sess.run(
+          [self.pointer, self.next_attns, self.next_state],
+          {self.inputs: attn_states, self.keys: keys, self.lengths: lengths,
+           self.dec_inp: inp, self.dec_attns: attns, self.dec_state: state})
+
+      # Log-probabilities renormalized over positions not yet pointed at.
+      with np.errstate(divide="ignore", invalid="ignore"):
+        logp = np.log(ptr)
+        logp[used | padding] = -np.inf
+        logp_max = logp.max(axis=1, keepdims=True)
+        logp -= logp_max + np.log(np.exp(logp - logp_max).sum(axis=1,
+                                                              keepdims=True))
+
+      # Finished sequences continue with a single zero-cost dummy step.
+      done = t >= lengths
+      logp[done] = -np.inf
+      logp[done, 0] = 0.0
+
+      # Select the K best continuations among all beams of each example.
+      candidates = (scores[:, np.newaxis] + logp).reshape((batch_size, -1))
+      top = np.argpartition(-candidates, K - 1, axis=1)[:, :K]
+      top = top[examples, np.argsort(-candidates[examples, top], axis=1)]
+
+      parents = (examples * K + top // max_length).ravel()
+      positions = (top % max_length).ravel()
+      scores = candidates[examples, top].ravel()
+
+      attns, state = attns[parents], state[parents]
+      used, pointers = used[parents], pointers[parents]
+      live = ~done
+      used[rows[live], positions[live]] = True
+      pointers[rows[live], t] = positions[live]
+      inp = attn_states[rows, positions]
+
+    # Beams are sorted by score, so beam 0 is the best.
+    best = np.arange(batch_size) * K
+    return pointers[best], scores[best]
+
+  def decode_stream(self, batches, beam_width=1):
+    """
+    Decode a stream of batches, e.g. a large dataset in chunks.
+
+    Args:
+      batches: Iterable of `(inputs, lengths)` pairs (see `decode`)
+
+    Yields:
+      `(pointers, scores)` for each batch
+    """
+    for inputs, lengths in batches:
+      yield self.decode(inputs, lengths, beam_width=beam_width)
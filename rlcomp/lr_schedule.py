@@ -0,0 +1,161 @@
+"""
+In-graph learning rate schedules.
+
+Each schedule adjusts a set of learning rate variables with ops built once,
+when the schedule is constructed; schedule state (e.g. the best reward seen
+so far) lives in non-trainable variables, and so is saved with checkpoints.
+
+Schedules expose two ops, either of which may be `None`:
+
+- `step_update`, to run along with every training step, and
+- `eval_update`, to run along with every evaluation. It reads the evaluation
+  reward tensor passed to the schedule, so it should be fetched in the same
+  `Session.run` call as the evaluation itself.
+"""
+
+import tensorflow as tf
+
+
+class LRSchedule(object):
+
+  """No-op schedule: learning rates stay at their initial values."""
+
+  def __init__(self, lrs, name="lr_schedule"):
+    """
+    Args:
+      lrs: List of learning rate variables
+    """
+    self.lrs = lrs
+    self.step_update = None
+    self.eval_update = None
+
+    with tf.variable_scope(name):
+      self._make_updates()
+
+  def _make_updates(self):
+    pass
+
+  def _scale_lrs(self, factor):
+    return [lr.assign(lr * factor) for lr in self.lrs]
+
+
+class ThresholdSchedule(LRSchedule):
+
+  """
+  Multiply learning rates by `decay` once for each threshold the evaluation
+  reward exceeds for the first time.
+  """
+
+  def __init__(self, lrs, reward, thresholds=(0.1, 0.2, 0.3), decay=0.5,
+               **kwargs):
+    self.reward = reward
+    self.thresholds = thresholds
+    self.decay = decay
+    super(ThresholdSchedule, self).__init__(lrs, **kwargs)
+
+  def _make_updates(self):
+    # Number of thresholds crossed so far.
+    self.level = tf.get_variable("level", (), dtype=tf.int32, trainable=False,
+                                 initializer=tf.constant_initializer(0))
+
+    thresholds = tf.constant(self.thresholds, dtype=tf.float32)
+    level = tf.reduce_sum(tf.to_int32(self.reward > thresholds))
+    new_level = tf.maximum(self.level, level)
+    factor = tf.pow(self.decay, tf.to_float(new_level - self.level))
+
+    lr_updates = self._scale_lrs(factor)
+    with tf.control_dependencies(lr_updates):
+      self.eval_update = self.level.assign(new_level)
+
+
+class PlateauSchedule(LRSchedule):
+
+  """
+  Multiply learning rates by `decay` when the evaluation reward has not
+  improved on its best value by more than `min_delta` for `patience`
+  consecutive evaluations.
+  """
+
+  def __init__(self, lrs, reward, patience=3, decay=0.5, min_delta=0.0,
+               **kwargs):
+    self.reward = reward
+    self.patience = patience
+    self.decay = decay
+    self.min_delta = min_delta
+    super(PlateauSchedule, self).__init__(lrs, **kwargs)
+
+  def _make_updates(self):
+    self.best = tf.get_variable("best", (), trainable=False,
+                                initializer=tf.constant_initializer(-1e30))
+    self.num_bad = tf.get_variable("num_bad", (), dtype=tf.int32,
+                                   trainable=False,
+                                   initializer=tf.constant_initializer(0))
+
+    improved = self.reward > self.best + self.min_delta
+    num_bad = tf.select(improved, tf.constant(0), self.num_bad + 1)
+    cut = num_bad >= self.patience
+    factor = tf.select(cut, tf.constant(self.decay), tf.constant(1.0))
+    best = tf.select(improved, self.reward, self.best)
+
+    lr_updates = self._scale_lrs(factor)
+    with tf.control_dependencies(lr_updates):
+      self.eval_update = tf.group(
+          self.best.assign(best),
+          self.num_bad.assign(tf.select(cut, tf.constant(0), num_bad)))
+
+
+class StepSchedule(LRSchedule):
+
+  """
+  Multiply initial learning rates by `decay` every `decay_steps` global
+  steps.
+  """
+
+  def __init__(self, lrs, global_step, decay=0.5, decay_steps=1000,
+               staircase=True, **kwargs):
+    self.global_step = global_step
+    self.decay = decay
+    self.decay_steps = decay_steps
+    self.staircase = staircase
+    super(StepSchedule, self).__init__(lrs, **kwargs)
+
+  def _make_updates(self):
+    p = tf.to_float(self.global_step) / float(self.decay_steps)
+    if self.staircase:
+      p = tf.floor(p)
+    factor = tf.pow(self.decay, p)
+
+    self.step_update = tf.group(*[lr.assign(lr.initial_value * factor)
+                                  for lr in self.lrs])
+
+
+class ExponentialSchedule(StepSchedule):
+
+  """
+  Decay initial learning rates continuously, by a factor of `decay` per
+  `decay_steps` global steps.
+  """
+
+  def __init__(self, lrs, global_step, decay=0.5, decay_steps=1000, **kwargs):
+    super(ExponentialSchedule, self).__init__(lrs, global_step, decay=decay,
+                                              decay_steps=decay_steps,
+                                              staircase=False, **kwargs)
+
+
+def make_lr_schedule(kind, lrs, global_step=None, reward=None, **kwargs):
+  """
+  Build a schedule by name: `none`, `threshold`, `plateau`, `step` or
+  `exponential`. Extra keyword arguments are passed to the schedule.
+  """
+  if kind == "none":
+    return LRSchedule(lrs)
+  elif kind == "threshold":
+    return ThresholdSchedule(lrs, reward, **kwargs)
+  elif kind == "plateau":
+    return PlateauSchedule(lrs, reward, **kwargs)
+  elif kind == "step":
+    return StepSchedule(lrs, global_step, **kwargs)
+  elif kind == "exponential":
+    return ExponentialSchedule(lrs, global_step, **kwargs)
+  else:
+    raise ValueError("Unknown learning rate schedule %s" % kind)
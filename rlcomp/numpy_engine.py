@@ -0,0 +1,307 @@
+"""
+TensorFlow-free forward passes of trained DPG policies.
+
+`export_params` dumps a model's policy parameters from a checkpoint into a
+single `.npz` file. `MLPPolicy` (for `dpg.policy_model`) and
+`PointerNetPolicy` (for the `PointerNetDPG` / `DynamicPointerNetDPG` encoder
+and pointer decoder) run batched forward passes on these parameters with
+NumPy alone, so serving and offline evaluation don't need to import
+TensorFlow or start a session.
+
+Parameters are keyed by their names relative to the model's variable scope,
+e.g. `policy/W0` or `decoder/AttnW`.
+"""
+
+import re
+
+import numpy as np
+
+
+# Policy parameter groups (child scopes of a DPG) exported by default.
+POLICY_GROUPS = ("policy", "embedding", "encoder", "decoder")
+
+# Optimizer slot variables, which are never exported.
+_SLOT_PATTERN = re.compile(r"/(Adam|Adam_1|Momentum|RMSProp|RMSProp_1)$")
+
+
+def export_params(checkpoint_path, out_path, scope="dpg",
+                  groups=POLICY_GROUPS):
+  """
+  Write the parameters of a trained model to an `.npz` file.
+
+  Args:
+    checkpoint_path: TF checkpoint
+    out_path: Output `.npz` path
+    scope: Variable scope of the model in the checkpoint
+    groups: Child scopes of `scope` to export
+
+  Returns:
+    Sorted list of exported parameter names
+  """
+  # Only exporting needs TF.
+  import tensorflow as tf
+
+  reader = tf.train.NewCheckpointReader(checkpoint_path)
+  prefix = scope + "/"
+
+  params = {}
+  for name in reader.get_variable_to_shape_map():
+    if not name.startswith(prefix) or _SLOT_PATTERN.search(name):
+      continue
+    rel_name = name[len(prefix):]
+    if rel_name.split("/")[0] in groups:
+      params[rel_name] = reader.get_tensor(name)
+
+  if not params:
+    raise ValueError("No parameters under scope %s in %s"
+                     % (scope, checkpoint_path))
+
+  np.savez(out_path, **params)
+  return sorted(params)
+
+
+def load_params(path):
+  """Read parameters written by `export_params`."""
+  with np.load(path) as data:
+    return {name: data[name] for name in data.files}
+
+
+def sigmoid(x):
+  # Equivalent to 1 / (1 + exp(-x)), without overflow.
+  return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def softmax(x, axis=-1):
+  e = np.exp(x - x.max(axis=axis, keepdims=True))
+  return e / e.sum(axis=axis, keepdims=True)
+
+
+class MLPPolicy(object):
+
+  """NumPy `dpg.policy_model` (an `util.mlp`)."""
+
+  def __init__(self, params, name="policy", f=np.tanh):
+    """
+    Args:
+      params: Parameters from `load_params`
+      name: Scope of the policy within the model
+      f: Hidden layer activation
+    """
+    self.layers = []
+    while "%s/W%i" % (name, len(self.layers)) in params:
+      i = len(self.layers)
+      self.layers.append((params["%s/W%i" % (name, i)],
+                          params.get("%s/b%i" % (name, i))))
+    if not self.layers:
+      raise ValueError("No parameters for MLP %s" % name)
+    self.f = f
+
+  def __call__(self, states):
+    """
+    Args:
+      states: `batch_size * state_dim`
+
+    Returns:
+      actions: `batch_size * action_dim`
+    """
+    x = np.asarray(states, dtype=np.float32)
+    for i, (W, b) in enumerate(self.layers):
+      x = x.dot(W)
+      if b is not None:
+        x += b
+      if i < len(self.layers) - 1:
+        x = self.f(x)
+    return x
+
+
+class GRUCell(object):
+
+  """NumPy `util.GRUCell`."""
+
+  def __init__(self, params, scope):
+    prefix = scope + "/GRUCell/"
+    self.gates_W = params[prefix + "Gates/Linear/Matrix"]
+    self.gates_b = params[prefix + "Gates/Linear/Bias"]
+    self.candidate_W = params[prefix + "Candidate/Linear/Matrix"]
+    self.candidate_b = params[prefix + "Candidate/Linear/Bias"]
+    self.num_units = self.candidate_b.shape[0]
+
+  def __call__(self, inputs, state):
+    gates = sigmoid(np.concatenate([inputs, state], 1).dot(self.gates_W)
+                    + self.gates_b)
+    r, u = gates[:, :self.num_units], gates[:, self.num_units:]
+    c = np.tanh(np.concatenate([inputs, r * state], 1).dot(self.candidate_W)
+                + self.candidate_b)
+    return u * state + (1 - u) * c
+
+
+class PointerNetPolicy(object):
+
+  """
+  NumPy pointer-network policy: the GRU encoder and multi-head pointer
+  decoder of `PointerNetDPG` and `DynamicPointerNetDPG`.
+
+  Padding past each sequence's length is handled as in
+  `DynamicPointerNetDPG`: the encoder state is carried through it, and it is
+  never attended to.
+  """
+
+  def __init__(self, params):
+    """
+    Args:
+      params: Parameters from `load_params`. If they include an `embedding`,
+        inputs are token matrices (as in the sorting task).
+    """
+    self.embeddings = params.get("embedding")
+    self.encoder_cell = GRUCell(params, "encoder")
+    self.decoder_cell = GRUCell(params, "decoder")
+
+    self.inp_W = params["decoder/inp_to_hidden/Matrix"]
+    self.inp_b = params["decoder/inp_to_hidden/Bias"]
+
+    # Attention mode and head count follow from the parameter names and
+    # shapes (see `pointer_network.make_attention`).
+    if "decoder/AttnW_0" in params:
+      # Single head, which feeds no read vectors to the next step.
+      self.keys_W = params["decoder/AttnW_0"].reshape(
+          params["decoder/AttnW_0"].shape[2:])
+      self.attn_v = params.get("decoder/AttnV_0")
+      if self.attn_v is not None:
+        self.attn_v = self.attn_v.reshape((1, -1))
+      query_scope = "decoder/Attention_0"
+    else:
+      self.keys_W = params["decoder/AttnW"]
+      self.attn_v = params.get("decoder/AttnV")
+      query_scope = "decoder/Attention"
+    self.attn_size = self.keys_W.shape[0]
+    self.num_heads = self.keys_W.shape[1] // self.attn_size
+    self.query_W = params[query_scope + "/Linear/Matrix"]
+    self.query_b = params[query_scope + "/Linear/Bias"]
+
+  def _prepare(self, inputs, lengths):
+    if self.embeddings is not None:
+      inputs = self.embeddings[np.asarray(inputs)]
+    inputs = np.asarray(inputs, dtype=np.float32)
+    batch_size, max_length = inputs.shape[:2]
+
+    if lengths is None:
+      lengths = np.full(batch_size, max_length, dtype=np.int32)
+    lengths = np.asarray(lengths)
+    mask = np.arange(max_length)[np.newaxis, :] < lengths[:, np.newaxis]
+    return inputs, lengths, mask
+
+  def encode(self, inputs, lengths):
+    """
+    Returns:
+      `batch_size * num_units` final encoder states
+    """
+    state = np.zeros((len(inputs), self.encoder_cell.num_units),
+                     dtype=np.float32)
+    for t in xrange(inputs.shape[1]):
+      new_state = self.encoder_cell(inputs[:, t], state)
+      state = np.where((t < lengths)[:, np.newaxis], new_state, state)
+    return state
+
+  def _attention(self, inputs, mask):
+    batch_size, max_length = inputs.shape[:2]
+    H, A = self.num_heads, self.attn_size
+    keys = inputs.reshape((-1, A)).dot(self.keys_W)
+    keys = keys.reshape((batch_size, max_length, H, A))
+    mask_logits = (mask - 1.0)[:, :, np.newaxis] * 1e9
+
+    def attention(query):
+      y = (query.dot(self.query_W) + self.query_b).reshape((-1, 1, H, A))
+      if self.attn_v is not None:
+        s = (self.attn_v * np.tanh(keys + y)).sum(axis=3)
+      else:
+        s = (keys * y).sum(axis=3) / np.sqrt(A)
+
+      # batch_size * num_heads * max_length
+      a = softmax((s + mask_logits).transpose((0, 2, 1)))
+      if H == 1:
+        return a[:, 0], None
+      reads = np.matmul(a, inputs).reshape((-1, H * A))
+      return a[:, 0], reads
+
+    return attention
+
+  def _start(self, inputs, lengths, mask):
+    batch_size, input_dim = len(inputs), inputs.shape[2]
+    inp = np.zeros((batch_size, input_dim), dtype=np.float32)
+    attns = np.zeros((batch_size, self.num_heads * self.attn_size),
+                     dtype=np.float32)
+    return (self._attention(inputs, mask), inp, attns,
+            self.encode(inputs, lengths))
+
+  def _step(self, attention, inp, attns, state):
+    x = np.concatenate([inp, attns], 1).dot(self.inp_W) + self.inp_b
+    state = self.decoder_cell(x, state)
+    pointer, reads = attention(state)
+    if reads is not None:
+      attns = reads
+    return pointer, attns, state
+
+  def rollout(self, inputs, lengths=None):
+    """
+    Compute the policy's soft pointer rollout (`a_pred`), feeding each
+    step's input-weighted pointer to the next step.
+
+    Args:
+      inputs: `batch_size * max_length` tokens (with an embedding) or
+        `batch_size * max_length * input_dim` inputs
+      lengths: Optional `batch_size` sequence lengths. Defaults to
+        `max_length`.
+
+    Returns:
+      `batch_size * max_length * max_length` soft pointers
+    """
+    inputs, lengths, mask = self._prepare(inputs, lengths)
+    attention, inp, attns, state = self._start(inputs, lengths, mask)
+
+    pointers = []
+    for _ in xrange(inputs.shape[1]):
+      pointer, attns, state = self._step(attention, inp, attns, state)
+      pointers.append(pointer)
+      inp = (pointer[:, :, np.newaxis] * inputs).sum(axis=1)
+    return np.stack(pointers, axis=1)
+
+  def decode(self, inputs, lengths=None):
+    """
+    Masked greedy decoding, as `inference.PointerNetInference.decode` with
+    `beam_width=1`: each position is pointed at once, and each step's input
+    is the input at the chosen position.
+
+    Returns:
+      pointers: `batch_size * max_length` int32 matrix; -1 past each
+        sequence's length
+      scores: `batch_size` log-probabilities of the decoded sequences
+    """
+    inputs, lengths, mask = self._prepare(inputs, lengths)
+    attention, inp, attns, state = self._start(inputs, lengths, mask)
+    batch_size, max_length = mask.shape
+    rows = np.arange(batch_size)
+
+    used = np.zeros((batch_size, max_length), dtype=bool)
+    pointers = np.full((batch_size, max_length), -1, dtype=np.int32)
+    scores = np.zeros(batch_size)
+
+    for t in xrange(max_length):
+      pointer, attns, state = self._step(attention, inp, attns, state)
+
+      # Log-probabilities renormalized over positions not yet pointed at.
+      with np.errstate(divide="ignore", invalid="ignore"):
+        logp = np.log(pointer)
+        logp[used | ~mask] = -np.inf
+        logp_max = logp.max(axis=1, keepdims=True)
+        logp -= logp_max + np.log(np.exp(logp - logp_max).sum(axis=1,
+                                                              keepdims=True))
+
+      # Finished sequences continue with a dummy step at position 0.
+      live = t < lengths
+      choices = np.where(live, logp.argmax(axis=1), 0)
+      scores[live] += logp[rows[live], choices[live]]
+      pointers[live, t] = choices[live]
+      used[rows[live], choices[live]] = True
+      inp = inputs[rows, choices]
+
+    return pointers, scores
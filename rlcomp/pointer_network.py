@@ -1,13 +1,149 @@
 """Defines a pointer network decoder."""
 
 
+import math
+
 import tensorflow as tf
 from tensorflow.models.rnn import linear
 
 
+ATTENTION_MODES = ("additive", "dot")
+
+
+def make_attention(attention_states, num_heads=1, mode="additive",
+                   attention_mask=None):
+  """
+  Build multi-head attention over `attention_states`.
+
+  Keys for all heads are computed up front with a single matmul, so each
+  query costs one projection and a handful of batched ops regardless of the
+  number of heads. Head 0 is the pointer head: its attention distribution is
+  the decoder output. With several heads, every head also produces a read
+  vector (the attention-weighted sum of `attention_states`), which decoders
+  feed into their next step.
+
+  A single head has no read vectors, and its variables are named and shaped
+  as in the original single-head decoder, so that its checkpoints restore.
+
+  Args:
+    attention_states: 3D Tensor [batch_size x attn_length x attn_size]. Only
+      `attn_size` must be known.
+    num_heads: Number of attention heads.
+    mode: `additive` (score = v^T tanh(W1 h_j + W2 q)) or `dot` (score =
+      (W1 h_j)^T (W2 q) / sqrt(attn_size), which skips the tanh and the
+      reduction with `v`).
+    attention_mask: Optional float Tensor [batch_size x attn_length] which is
+      1 at valid positions and 0 at padding. No head attends to padding.
+  Returns:
+    A function `attention(query) = (pointer, reads)` mapping a query
+    [batch_size x query_size] to the pointer head's distribution
+    [batch_size x attn_length] and the concatenated read vectors of all heads
+    [batch_size x (num_heads * attn_size)], or `None` with a single head. It
+    creates variables in scope "Attention" ("Attention_0" with a single
+    head) on its first call. The precomputed keys are available as
+    `attention.keys`; callers which attend repeatedly over the same states in
+    separate `Session.run` calls can feed them back to skip recomputation.
+  Raises:
+    ValueError: when num_heads is not positive, mode is unknown, or the last
+      dimension of attention_states is not known.
+  """
+  if num_heads < 1:
+    raise ValueError("With less than 1 heads, use a non-attention decoder.")
+  if mode not in ATTENTION_MODES:
+    raise ValueError("Unknown attention mode %s" % mode)
+  attn_size = attention_states.get_shape()[2].value
+  if attn_size is None:
+    raise ValueError("Shape[2] of attention_states must be known: %s"
+                     % attention_states.get_shape())
+
+  batch_size = tf.shape(attention_states)[0]
+  attn_length = tf.shape(attention_states)[1]
+  static_length = attention_states.get_shape()[1].value
+
+  # Keys W1 * h_j for every position and head, as one plain matmul:
+  # batch_size * attn_length * num_heads * attn_size
+  if num_heads == 1:
+    # Originally a 1x1 convolution kernel.
+    k = tf.reshape(tf.get_variable("AttnW_0", [1, 1, attn_size, attn_size]),
+                   [attn_size, attn_size])
+  else:
+    k = tf.get_variable("AttnW", [attn_size, num_heads * attn_size])
+  keys = tf.matmul(tf.reshape(attention_states, [-1, attn_size]), k)
+  keys = tf.reshape(keys, tf.pack([batch_size, attn_length, num_heads,
+                                   attn_size]))
+  if mode == "additive":
+    if num_heads == 1:
+      v = tf.reshape(tf.get_variable("AttnV_0", [attn_size]), [1, attn_size])
+    else:
+      v = tf.get_variable("AttnV", [num_heads, attn_size])
+  query_scope = "Attention_0" if num_heads == 1 else "Attention"
+
+  def attention(query):
+    with tf.variable_scope(query_scope):
+      # Project the query for all heads at once.
+      y = linear.linear(query, num_heads * attn_size, True)
+      y = tf.reshape(y, [-1, 1, num_heads, attn_size])
+
+      # batch_size * attn_length * num_heads
+      if mode == "additive":
+        s = tf.reduce_sum(v * tf.tanh(keys + y), [3])
+      else:
+        s = tf.reduce_sum(keys * y, [3]) / math.sqrt(attn_size)
+      if attention_mask is not None:
+        # Push logits of padding positions to ~ -inf.
+        s += tf.expand_dims(attention_mask - 1.0, 2) * 1e9
+
+      # Softmax over positions for each head:
+      # batch_size * num_heads * attn_length
+      s = tf.reshape(tf.transpose(s, [0, 2, 1]), tf.pack([-1, attn_length]))
+      a = tf.reshape(tf.nn.softmax(s),
+                     tf.pack([batch_size, num_heads, attn_length]))
+      a.set_shape([None, num_heads, static_length])
+
+      pointer = tf.squeeze(tf.slice(a, [0, 0, 0], [-1, 1, -1]), [1])
+      if num_heads == 1:
+        return pointer, None
+      reads = tf.reshape(tf.batch_matmul(a, attention_states),
+                         [-1, num_heads * attn_size])
+
+      return pointer, reads
+
+  attention.keys = keys
+  return attention
+
+
+def decoder_step(cell, attention, inp, attns, state):
+  """
+  Run one pointer network decoder step.
+
+  Args:
+    cell: rnn_cell.RNNCell defining the cell function and size.
+    attention: Attention function built with `make_attention`.
+    inp: 2D Tensor [batch_size x cell.input_size].
+    attns: Read vectors from the previous step [batch_size x (num_heads *
+      attn_size)]. With a single head, these stay at their initial value
+      (zeros), as in the original decoder.
+    state: 2D Tensor [batch_size x cell.state_size].
+  Returns:
+    output: Soft pointer [batch_size x attn_length].
+    attns: New read vectors.
+    state: New cell state.
+  """
+  # Merge input and previous attentions into one vector of the right size.
+  x = linear.linear([inp, attns], cell.input_size, True, scope="inp_to_hidden")
+
+  # Run the RNN.
+  cell_output, new_state = cell(x, state)
+
+  # Run the attention mechanism.
+  output, reads = attention(cell_output)
+  new_attns = attns if reads is None else reads
+  return output, new_attns, new_state
+
+
 def ptr_net_decoder(decoder_inputs, initial_state, attention_states, cell,
                     num_heads=1, loop_function=None, dtype=tf.float32,
-                    scope=None):
+                    attention_mode="additive", scope=None):
   """
   Pointer network decoder.
 
@@ -20,7 +156,8 @@ def ptr_net_decoder(decoder_inputs, initial_state, attention_states, cell,
     attention_states: 3D Tensor [batch_size x attn_length x attn_size].
     cell: rnn_cell.RNNCell defining the cell function and size.
     output_size: size of the output vectors; if None, we use cell.output_size.
-    num_heads: number of attention heads that read from attention_states.
+    num_heads: number of attention heads that read from attention_states. The
+      first head is the pointer head (see `make_attention`).
     loop_function: if not None, this function will be applied to i-th output
       in order to generate i+1-th input, and decoder_inputs will be ignored,
       except for the first element ("GO" symbol). This can be used for decoding,
@@ -30,7 +167,8 @@ def ptr_net_decoder(decoder_inputs, initial_state, attention_states, cell,
         * i is an integer, the step number (when advanced control is needed),
         * next is a 2D Tensor of shape [batch_size x cell.input_size].
     dtype: The dtype to use for the RNN initial state (default: tf.float32).
-    scope: VariableScope for the created subgraph; default: "attention_decoder".
+    attention_mode: `additive` or `dot` (see `make_attention`).
+    scope: VariableScope for the created subgraph; default: "ptrnet_decoder".
   Returns:
     outputs: A list of the same length as decoder_inputs of 2D Tensors of shape
       [batch_size x seq_length]. These represent the generated outputs.
@@ -40,8 +178,7 @@ def ptr_net_decoder(decoder_inputs, initial_state, attention_states, cell,
         cell_output, new_state = cell(linear(input, prev_attn), prev_state).
       Then, we calculate new attention masks:
         new_attn = softmax(V^T * tanh(W * attention_states + U * new_state))
-      and then we calculate the output:
-        output = linear(cell_output, new_attn).
+      and the output is the attention mask of the first head.
     states: The state of each decoder cell in each time-step. This is a list
       with length len(decoder_inputs) -- one item for each time-step.
       Each item is a 2D Tensor of shape [batch_size x cell.state_size].
@@ -55,50 +192,22 @@ def ptr_net_decoder(decoder_inputs, initial_state, attention_states, cell,
   """
   if not decoder_inputs:
     raise ValueError("Must provide at least 1 input to attention decoder.")
-  if num_heads < 1:
-    raise ValueError("With less than 1 heads, use a non-attention decoder.")
-  if not attention_states.get_shape()[1:2].is_fully_defined():
-    raise ValueError("Shape[1] and [2] of attention_states must be known: %s"
-                     % attention_states.get_shape())
 
   with tf.variable_scope(scope or "ptrnet_decoder"):
     batch_size = tf.shape(decoder_inputs[0])[0]  # Needed for reshaping.
-    attn_length = attention_states.get_shape()[1].value
+    attention = make_attention(attention_states, num_heads=num_heads,
+                               mode=attention_mode)
     attn_size = attention_states.get_shape()[2].value
 
-    # To calculate W1 * h_t we use a 1-by-1 convolution, need to reshape before.
-    hidden = tf.reshape(attention_states, [-1, attn_length, 1, attn_size])
-    hidden_features = []
-    v = []
-    attention_vec_size = attn_size    # Size of query vectors for attention.
-    for a in xrange(num_heads):
-      k = tf.get_variable("AttnW_%d" % a, [1, 1, attn_size, attention_vec_size])
-      hidden_features.append(tf.nn.conv2d(hidden, k, [1, 1, 1, 1], "SAME"))
-      v.append(tf.get_variable("AttnV_%d" % a, [attention_vec_size]))
-
     states = [initial_state]
 
-    def attention(query):
-      """Put attention masks on hidden using hidden_features and query."""
-
-      a = 0
-      with tf.variable_scope("Attention_%i" % a):
-        y = linear.linear(query, attention_vec_size, True)
-        y = tf.reshape(y, [-1, 1, 1, attention_vec_size])
-        # Attention mask is a softmax of v^T * tanh(...).
-        s = tf.reduce_sum(v[a] * tf.tanh(hidden_features[a] + y), [2, 3])
-        a = tf.nn.softmax(s)
-
-        return a
-
     seen_inputs = []
     outputs = []
     prev = None
-    batch_attn_size = tf.pack([batch_size, attn_size])
-    attns = [tf.zeros(batch_attn_size, dtype=dtype)
-             for _ in xrange(num_heads)]
-    for a in attns:  # Ensure the second shape of attention vectors is set.
-      a.set_shape([None, attn_size])
+    batch_attn_size = tf.pack([batch_size, num_heads * attn_size])
+    attns = tf.zeros(batch_attn_size, dtype=dtype)
+    # Ensure the second shape of attention vectors is set.
+    attns.set_shape([None, num_heads * attn_size])
 
     # Begin recurrence.
     for i in xrange(len(decoder_inputs)):
@@ -112,20 +221,99 @@ def ptr_net_decoder(decoder_inputs, initial_state, attention_states, cell,
           inp = tf.stop_gradient(loop_function(prev, i))
       seen_inputs.append(inp)
 
-      # Merge input and previous attentions into one vector of the right size.
-      x = linear.linear([inp] + attns, cell.input_size, True,
-                        scope="inp_to_hidden")
-
-      # Run the RNN.
-      cell_output, new_state = cell(x, states[-1])
+      output, attns, new_state = decoder_step(cell, attention, inp, attns,
+                                              states[-1])
       states.append(new_state)
 
-      # Run the attention mechanism.
-      output = attention(cell_output)
-
       if loop_function is not None:
         # We do not propagate gradients over the loop function.
         prev = tf.stop_gradient(output)
       outputs.append(output)
 
   return outputs, states, seen_inputs
+
+
+def dynamic_ptr_net_decoder(initial_state, attention_states, cell,
+                            loop_function, attention_mask=None,
+                            num_steps=None, num_heads=1, dtype=tf.float32,
+                            attention_mode="additive", scope=None):
+  """
+  Pointer network decoder unrolled with a `tf.while_loop`.
+
+  Unlike `ptr_net_decoder`, neither the number of decoder steps nor the
+  attention length need to be known when the graph is built, so a single
+  graph serves any sequence length. Decoder inputs are always computed with
+  `loop_function` from the previous output; the input at the first timestep
+  is zero.
+
+  Args:
+    initial_state: 2D Tensor [batch_size x cell.state_size].
+    attention_states: 3D Tensor [batch_size x attn_length x attn_size]. Only
+      `attn_size` must be known.
+    cell: rnn_cell.RNNCell defining the cell function and size.
+    loop_function: Function `loop_function(prev, i) = next` mapping the
+      previous output [batch_size x attn_length] and the (scalar tensor) step
+      number to the next input [batch_size x cell.input_size].
+    attention_mask: Optional float Tensor [batch_size x attn_length] which is
+      1 at valid attention positions and 0 at padding. Output pointers never
+      point at masked positions.
+    num_steps: Scalar int Tensor; number of decoder steps. Defaults to
+      `attn_length`.
+    num_heads: Number of attention heads. The first head is the pointer head
+      (see `make_attention`).
+    dtype: The dtype to use for the initial input (default: tf.float32).
+    attention_mode: `additive` or `dot` (see `make_attention`).
+    scope: VariableScope for the created subgraph; default: "ptrnet_decoder".
+  Returns:
+    outputs: [batch_size x num_steps x attn_length] soft pointers (softmax
+      outputs).
+    states: [batch_size x num_steps x cell.state_size] decoder states.
+    seen_inputs: [batch_size x num_steps x cell.input_size] inputs used at
+      each timestep.
+  Raises:
+    ValueError: when num_heads is not positive, or the last dimension of
+      attention_states is not known.
+  """
+  with tf.variable_scope(scope or "ptrnet_decoder"):
+    attention = make_attention(attention_states, num_heads=num_heads,
+                               mode=attention_mode,
+                               attention_mask=attention_mask)
+    attn_size = attention_states.get_shape()[2].value
+
+    batch_size = tf.shape(attention_states)[0]
+    if num_steps is None:
+      num_steps = tf.shape(attention_states)[1]
+
+    inp = tf.zeros(tf.pack([batch_size, cell.input_size]), dtype=dtype)
+    inp.set_shape([None, cell.input_size])
+    attns = tf.zeros(tf.pack([batch_size, num_heads * attn_size]),
+                     dtype=dtype)
+    attns.set_shape([None, num_heads * attn_size])
+
+    outputs = tf.TensorArray(dtype, size=num_steps)
+    states = tf.TensorArray(dtype, size=num_steps)
+    seen_inputs = tf.TensorArray(dtype, size=num_steps)
+
+    def step(t, inp, attns, state, outputs, states, seen_inputs):
+      output, new_attns, new_state = decoder_step(cell, attention, inp, attns,
+                                                  state)
+
+      # We do not propagate gradients over the loop function.
+      with tf.variable_scope("loop_function"):
+        next_inp = tf.stop_gradient(loop_function(tf.stop_gradient(output),
+                                                  t + 1))
+
+      return (t + 1, next_inp, new_attns, new_state,
+              outputs.write(t, output), states.write(t, new_state),
+              seen_inputs.write(t, inp))
+
+    _, _, _, _, outputs, states, seen_inputs = tf.while_loop(
+        lambda t, *_: t < num_steps, step,
+        [tf.constant(0), inp, attns, initial_state, outputs, states,
+         seen_inputs])
+
+    # Time-major -> batch-major.
+    outputs, states, seen_inputs = [tf.transpose(ta.pack(), [1, 0, 2])
+                                    for ta in (outputs, states, seen_inputs)]
+
+  return outputs, states, seen_inputs
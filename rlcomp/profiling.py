@@ -0,0 +1,188 @@
+"""
+Training loop instrumentation.
+
+`StepProfiler` times named sections of each training step (e.g. data
+generation, `sess.run`, checkpoint saves), and periodically reports rolling
+percentiles of their durations as a log line and as scalar summaries. It can
+also capture a full TF trace of a step every so often.
+
+TensorFlow is imported only to write summaries and traces.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import os.path
+import threading
+import time
+
+import numpy as np
+
+
+class RateCounter(object):
+
+  """
+  Thread-safe event counter which reports event rates over the interval
+  since the last report.
+  """
+
+  def __init__(self):
+    self.total = 0
+    self._lock = threading.Lock()
+    self._last_total = 0
+    self._last_time = time.time()
+
+  def add(self, n=1):
+    with self._lock:
+      self.total += n
+
+  def rate(self):
+    """
+    Returns:
+      Events per second since the last call to `rate` (or since creation).
+    """
+    with self._lock:
+      now = time.time()
+      elapsed = max(now - self._last_time, 1e-9)
+      rate = (self.total - self._last_total) / elapsed
+      self._last_total, self._last_time = self.total, now
+    return rate
+
+
+@contextmanager
+def null_section(name):
+  """Stand-in for `StepProfiler.section` when not profiling."""
+  yield
+
+
+class StepProfiler(object):
+
+  """
+  Per-step timing of named training loop sections, with rolling percentiles
+  over each section's last `window` durations.
+
+      for t in xrange(num_iter):
+        with profiler.section("run"):
+          sess.run(fetches, **profiler.run_kwargs(t))
+        profiler.end_step(t)
+
+  The duration of each whole step (from one `end_step` to the next) is kept
+  as section `step`. Every `log_interval` steps, `end_step` prints one line
+  with step throughput and the p50/p95/p99 of every section, and writes the
+  same values as `profile/...` scalar summaries (in milliseconds).
+  """
+
+  def __init__(self, window=1000, log_interval=100, trace_interval=0,
+               logdir=None, summary_writer=None, percentiles=(50, 95, 99)):
+    """
+    Args:
+      window: Number of most recent durations kept per section
+      log_interval: Report every `log_interval` steps; 0 disables reports
+      trace_interval: Capture a full TF trace of every `trace_interval`th
+        step (see `run_kwargs`) into `logdir`; 0 disables tracing
+      logdir: Directory for Chrome-format trace files
+      summary_writer: Optional `tf.train.SummaryWriter` for summaries and
+        run metadata
+      percentiles:
+    """
+    self.window = window
+    self.log_interval = log_interval
+    self.trace_interval = trace_interval
+    self.logdir = logdir
+    self.summary_writer = summary_writer
+    self.percentiles = percentiles
+
+    # Ring buffer of recent durations and total count, per section
+    self._times = OrderedDict()
+    self._counts = {}
+
+    self._steps = RateCounter()
+    self._step_start = time.time()
+    self._run_metadata = None
+
+  @contextmanager
+  def section(self, name):
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.record(name, time.time() - start)
+
+  def record(self, name, seconds):
+    times = self._times.get(name)
+    if times is None:
+      times = self._times[name] = np.zeros((self.window,))
+      self._counts[name] = 0
+
+    times[self._counts[name] % self.window] = seconds
+    self._counts[name] += 1
+
+  def stats(self, name):
+    """
+    Returns:
+      Percentiles of the section's recent durations, in seconds
+    """
+    times = self._times[name][:min(self._counts[name], self.window)]
+    return np.percentile(times, self.percentiles)
+
+  def run_kwargs(self, step):
+    """
+    Returns:
+      Keyword arguments for the step's `Session.run` call. On tracing steps
+      these request a full trace, which `end_step` writes out.
+    """
+    if not self.trace_interval or step % self.trace_interval != 0:
+      return {}
+
+    import tensorflow as tf
+    self._run_metadata = tf.RunMetadata()
+    return {"options": tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            "run_metadata": self._run_metadata}
+
+  def end_step(self, step):
+    now = time.time()
+    self.record("step", now - self._step_start)
+    self._step_start = now
+    self._steps.add()
+
+    if self._run_metadata is not None:
+      self._write_trace(step)
+      self._run_metadata = None
+
+    if self.log_interval and step % self.log_interval == 0:
+      self.report(step)
+
+  def report(self, step):
+    """Print a log line and write summaries of the current statistics."""
+    steps_per_sec = self._steps.rate()
+    values = [("profile/steps_per_sec", steps_per_sec)]
+    parts = ["%i" % step, "%.1f steps/s" % steps_per_sec]
+
+    for name in self._times:
+      stats_ms = self.stats(name) * 1000
+      values.extend(("profile/%s/p%i" % (name, q), value)
+                    for q, value in zip(self.percentiles, stats_ms))
+      parts.append("%s %s" % (name, "/".join("%.1f" % value
+                                             for value in stats_ms)))
+
+    print "\t".join(parts)
+    # Exclude report time itself from the next step.
+    self._step_start = time.time()
+
+    if self.summary_writer is not None:
+      import tensorflow as tf
+      summary = tf.Summary(value=[tf.Summary.Value(tag=tag, simple_value=value)
+                                  for tag, value in values])
+      self.summary_writer.add_summary(summary, step)
+
+  def _write_trace(self, step):
+    from tensorflow.python.client import timeline
+
+    if self.logdir is not None:
+      trace = timeline.Timeline(self._run_metadata.step_stats)
+      path = os.path.join(self.logdir, "trace_%i.json" % step)
+      with open(path, "w") as trace_f:
+        trace_f.write(trace.generate_chrome_trace_format())
+
+    if self.summary_writer is not None:
+      self.summary_writer.add_run_metadata(self._run_metadata,
+                                           "step_%i" % step, step)
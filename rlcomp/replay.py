@@ -0,0 +1,683 @@
+"""
+Replay buffers and their storage backends.
+"""
+
+import json
+import os
+import os.path
+
+import numpy as np
+
+
+class UniformIndexSampler(object):
+
+  """
+  Draws uniform random integer indices into a reused output array.
+
+  Uniform floats are drawn in large blocks and scaled into `[0, high)` on
+  demand, so that steady-state sampling allocates nothing per call.
+  """
+
+  def __init__(self, pool_batches=64):
+    """
+    Args:
+      pool_batches: Number of batches' worth of random numbers to draw at
+        once.
+    """
+    self.pool_batches = pool_batches
+
+    self._pool = None
+    self._cursor = 0
+    self._scaled = None
+    self._idxs = None
+
+  def sample(self, high, size):
+    """
+    Returns:
+      A `size` vector of indices in `[0, high)`. The array is owned by the
+      sampler and overwritten on the next call.
+    """
+    if self._idxs is None or len(self._idxs) != size:
+      self._pool = None
+      self._scaled = np.empty((size,), dtype=np.float64)
+      self._idxs = np.empty((size,), dtype=np.intp)
+
+    if self._pool is None or self._cursor == len(self._pool):
+      self._pool = np.random.random_sample((self.pool_batches * size,))
+      self._cursor = 0
+
+    rand = self._pool[self._cursor:self._cursor + size]
+    self._cursor += size
+
+    # Scale [0, 1) draws to [0, high) and truncate into the index array.
+    np.multiply(rand, high, out=self._scaled)
+    self._idxs[:] = self._scaled
+    return self._idxs
+
+
+class ArrayStorage(object):
+
+  """In-memory storage backend for replay buffers."""
+
+  def array(self, name, shape, dtype, zeros=False):
+    alloc = np.zeros if zeros else np.empty
+    return alloc(shape, dtype=dtype)
+
+  def cursor(self):
+    """Storage for a buffer's `(cursor_write_start, cursor_read_end)`."""
+    return np.zeros((2,), dtype=np.int64)
+
+  def flush(self):
+    pass
+
+
+class MemmapStorage(object):
+
+  """
+  Disk-backed storage backend for replay buffers.
+
+  Every buffer array lives in a raw `np.memmap` file under `directory`,
+  described by `directory/meta.json`. The buffer cursor is kept in a memmap
+  of its own, so that a buffer reopened on the same directory resumes where
+  the last writer stopped.
+
+  Any number of processes on one host may open the same directory with
+  `readonly=True` and sample from it while a single writer extends it. All
+  of them share the OS page cache, so no process holds a private copy of the
+  data. Readers see the writer's cursor as soon as it is updated; a row being
+  overwritten by the writer at that moment may be read half-updated.
+  """
+
+  meta_filename = "meta.json"
+
+  def __init__(self, directory, readonly=False):
+    self.directory = directory
+    self.readonly = readonly
+    self._arrays = []
+
+    if not readonly and not os.path.isdir(directory):
+      os.makedirs(directory)
+
+    meta_path = os.path.join(directory, self.meta_filename)
+    if os.path.exists(meta_path):
+      with open(meta_path, "r") as meta_f:
+        self.meta = json.load(meta_f)
+    elif readonly:
+      raise ValueError("No replay buffer found in %s" % directory)
+    else:
+      self.meta = {}
+
+  def _write_meta(self):
+    meta_path = os.path.join(self.directory, self.meta_filename)
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as meta_f:
+      json.dump(self.meta, meta_f, indent=2, sort_keys=True)
+    os.rename(tmp_path, meta_path)
+
+  def array(self, name, shape, dtype, zeros=False):
+    # New memmap files are zero-filled, so `zeros` needs no special handling.
+    shape = tuple(int(dim) for dim in shape)
+    dtype = np.dtype(dtype)
+    path = os.path.join(self.directory, "%s.dat" % name)
+
+    spec = self.meta.get(name)
+    if spec is not None and os.path.exists(path):
+      if tuple(spec["shape"]) != shape or np.dtype(spec["dtype"]) != dtype:
+        raise ValueError("Replay array %s in %s has shape %s and dtype %s; "
+                         "expected shape %s and dtype %s"
+                         % (name, self.directory, tuple(spec["shape"]),
+                            spec["dtype"], shape, dtype))
+      mode = "r" if self.readonly else "r+"
+    elif self.readonly:
+      raise ValueError("Replay array %s missing from %s"
+                       % (name, self.directory))
+    else:
+      mode = "w+"
+      self.meta[name] = {"shape": list(shape), "dtype": dtype.str}
+      self._write_meta()
+
+    arr = np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+    self._arrays.append(arr)
+    return arr
+
+  def cursor(self):
+    return self.array("cursor", (2,), np.int64)
+
+  def flush(self):
+    if self.readonly:
+      return
+    for arr in self._arrays:
+      arr.flush()
+
+
+class BufferCursorMixin(object):
+
+  """
+  Exposes a buffer's write / read cursors, kept in a two-element
+  `self._cursor` array owned by the buffer's storage backend.
+  """
+
+  @property
+  def cursor_write_start(self):
+    return int(self._cursor[0])
+
+  @cursor_write_start.setter
+  def cursor_write_start(self, value):
+    self._cursor[0] = value
+
+  @property
+  def cursor_read_end(self):
+    return int(self._cursor[1])
+
+  @cursor_read_end.setter
+  def cursor_read_end(self, value):
+    self._cursor[1] = value
+
+  def __len__(self):
+    return self.cursor_read_end
+
+  def flush(self):
+    """Persist buffer contents and cursors to the storage backend."""
+    self.storage.flush()
+
+
+class ReplayBuffer(BufferCursorMixin):
+
+  """
+  Experience replay storage, defined relative to an MDP.
+
+  Stores experience tuples `(s_t, a_t, r_t, s_{t+1}, done_t)` in a fixed-size
+  ring buffer and randomly samples tuples from this buffer on demand. Writes
+  which run past the end of the buffer wrap around and overwrite the oldest
+  experience.
+  """
+
+  def __init__(self, buffer_size, mdp, storage=None):
+    """
+    Args:
+      buffer_size:
+      mdp:
+      storage: Storage backend for buffer arrays. Defaults to in-memory
+        `ArrayStorage`; pass a `MemmapStorage` to keep the buffer on disk.
+    """
+    self.buffer_size = buffer_size
+    self.mdp = mdp
+    self.storage = storage = storage or ArrayStorage()
+
+    # Next row to be written, and number of rows which hold valid data.
+    self._cursor = storage.cursor()
+
+    self.states = storage.array("states", (buffer_size, mdp.state_dim),
+                                np.float32)
+    self.actions = storage.array("actions", (buffer_size, mdp.action_dim),
+                                 np.float32)
+    self.rewards = storage.array("rewards", (buffer_size,), np.float32)
+    self.states_next = storage.array("states_next",
+                                     (buffer_size, mdp.state_dim), np.float32)
+    self.terminals = storage.array("terminals", (buffer_size,), np.bool_)
+
+    self._sampler = UniformIndexSampler()
+
+  @property
+  def columns(self):
+    return (self.states, self.actions, self.rewards, self.states_next,
+            self.terminals)
+
+  def make_batch(self, batch_size):
+    """
+    Allocate a tuple of output arrays which can be passed as the `out`
+    argument of `sample`.
+    """
+    return tuple(np.empty((batch_size,) + column.shape[1:],
+                          dtype=column.dtype)
+                 for column in self.columns)
+
+  def sample_idxs(self, batch_size):
+    """
+    Draw `batch_size` buffer indices uniformly (with replacement).
+
+    The returned array is reused across calls; copy it if it needs to outlive
+    the next call to `sample` / `sample_idxs`.
+    """
+    if self.cursor_read_end < batch_size:
+      raise ValueError("Not enough examples in buffer (just %i) to fill a "
+                       "batch of %i." % (self.cursor_read_end, batch_size))
+
+    return self._sampler.sample(self.cursor_read_end, batch_size)
+
+  def gather(self, idxs, out=None):
+    """
+    Fetch the experience tuples at the given buffer indices.
+
+    Args:
+      idxs: Integer index array
+      out: Optional tuple of output arrays (see `make_batch`). If provided,
+        rows are written directly into these arrays and no new arrays are
+        allocated.
+
+    Returns:
+      Tuple `(states, actions, rewards, states_next, terminals)`
+    """
+    if out is None:
+      return tuple(column[idxs] for column in self.columns)
+
+    for column, out_column in zip(self.columns, out):
+      # `mode="clip"` lets numpy write into `out` without buffering.
+      np.take(column, idxs, axis=0, out=out_column, mode="clip")
+    return out
+
+  def sample(self, batch_size, out=None):
+    """
+    Sample a batch of experience tuples uniformly at random.
+
+    Returns:
+      Tuple `(states, actions, rewards, states_next, terminals)`
+    """
+    return self.gather(self.sample_idxs(batch_size), out=out)
+
+  def extend(self, states, actions, rewards, states_next, terminals=None):
+    """
+    Append a sequence of experience tuples, overwriting the oldest
+    experience once the buffer is full.
+
+    Args:
+      states: `n * state_dim`
+      actions: `n * action_dim`
+      rewards: `n`
+      states_next: `n * state_dim`
+      terminals: Optional boolean `n` vector marking transitions which end an
+        episode. Defaults to all `False`.
+    """
+    n = len(states)
+    if n == 0:
+      return
+    if terminals is None:
+      terminals = np.zeros((n,), dtype=np.bool_)
+
+    data = (states, actions, rewards, states_next, terminals)
+
+    # Only the last `buffer_size` rows of an oversized write would survive.
+    if n > self.buffer_size:
+      data = tuple(np.asarray(column)[-self.buffer_size:] for column in data)
+      n = self.buffer_size
+
+    start = self.cursor_write_start
+    end = start + n
+    if end <= self.buffer_size:
+      for column, new_rows in zip(self.columns, data):
+        column[start:end] = new_rows
+    else:
+      # Wrap around: fill to the end of the buffer, then continue at the start.
+      split = self.buffer_size - start
+      for column, new_rows in zip(self.columns, data):
+        new_rows = np.asarray(new_rows)
+        column[start:] = new_rows[:split]
+        column[:n - split] = new_rows[split:]
+
+    self.cursor_write_start = end % self.buffer_size
+    self.cursor_read_end = min(self.buffer_size, self.cursor_read_end + n)
+
+
+class SumTree(object):
+
+  """
+  Array-backed binary sum tree over a fixed number of non-negative
+  priorities.
+
+  Node `i` has children `2i` and `2i + 1`; the root is node 1 and leaf `j` is
+  node `capacity + j`. Batched sampling descends the tree for the whole batch
+  at once, and batched updates recompute only the ancestors of the touched
+  leaves, so both cost O(batch_size * log n).
+  """
+
+  def __init__(self, size, tree=None):
+    """
+    Args:
+      size: Number of leaves.
+      tree: Optional zero-initialized float64 array of length `2 * capacity`
+        (see `tree_size`) to use as storage.
+    """
+    self.size = size
+    self.capacity = 1
+    while self.capacity < size:
+      self.capacity *= 2
+    self.depth = int(np.log2(self.capacity))
+
+    self.tree = np.zeros((2 * self.capacity,)) if tree is None else tree
+
+  @staticmethod
+  def tree_size(size):
+    capacity = 1
+    while capacity < size:
+      capacity *= 2
+    return 2 * capacity
+
+  @property
+  def total(self):
+    return self.tree[1]
+
+  def get(self, idxs):
+    return self.tree[self.capacity + np.asarray(idxs)]
+
+  def update(self, idxs, values):
+    """Set the priorities of leaves `idxs` to `values`."""
+    nodes = np.asarray(idxs, dtype=np.intp) + self.capacity
+    self.tree[nodes] = values
+
+    for _ in xrange(self.depth):
+      nodes = np.unique(nodes // 2)
+      self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+  def find(self, values):
+    """
+    Find, for each of the given prefix-sum values in `[0, total)`, the leaf
+    whose priority interval contains it.
+    """
+    values = np.array(values, dtype=np.float64)
+    nodes = np.ones(values.shape, dtype=np.intp)
+
+    for _ in xrange(self.depth):
+      left = 2 * nodes
+      left_sums = self.tree[left]
+      go_right = values >= left_sums
+      values -= left_sums * go_right
+      nodes = left + go_right
+
+    # Guard against float round-off walking into an empty leaf at the end.
+    return np.minimum(nodes - self.capacity, self.size - 1)
+
+  def sample(self, batch_size, high=None):
+    """
+    Draw `batch_size` leaves with probability proportional to priority, using
+    stratified sampling over `batch_size` equal slices of the total mass.
+
+    Args:
+      high: Optionally restrict results to leaves `[0, high)`. Leaves at or
+        beyond `high` should carry zero priority.
+    """
+    bounds = (np.arange(batch_size) + np.random.random_sample(batch_size))
+    leaves = self.find(bounds * (self.total / batch_size))
+    if high is not None:
+      leaves = np.minimum(leaves, high - 1)
+    return leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+
+  """
+  Replay buffer which samples experience in proportion to priority
+  (cf. Schaul et al. 2015, http://arxiv.org/abs/1511.05952).
+
+  Priorities are `(|td_error| + epsilon) ** alpha` and are kept in a
+  `SumTree`. Newly added experience receives the largest priority seen so
+  far, so that it is replayed at least once before its TD error is known.
+  """
+
+  def __init__(self, buffer_size, mdp, alpha=0.6, beta=0.4, epsilon=1e-6,
+               storage=None):
+    """
+    Args:
+      alpha: Priority exponent. `alpha = 0` recovers uniform sampling.
+      beta: Default importance-sampling correction exponent.
+      epsilon: Priority offset which keeps zero-error experience sampleable.
+    """
+    super(PrioritizedReplayBuffer, self).__init__(buffer_size, mdp,
+                                                  storage=storage)
+    self.alpha = alpha
+    self.beta = beta
+    self.epsilon = epsilon
+
+    tree = self.storage.array("priorities", (SumTree.tree_size(buffer_size),),
+                              np.float64, zeros=True)
+    self.tree = SumTree(buffer_size, tree=tree)
+    self.max_priority = max(1.0, self.tree.tree[self.tree.capacity:].max())
+
+  def extend(self, states, actions, rewards, states_next, terminals=None):
+    start = self.cursor_write_start
+    n = min(len(states), self.buffer_size)
+    super(PrioritizedReplayBuffer, self).extend(states, actions, rewards,
+                                                states_next, terminals)
+
+    if n > 0:
+      idxs = (start + np.arange(n)) % self.buffer_size
+      self.tree.update(idxs, self.max_priority)
+
+  def sample_idxs(self, batch_size):
+    if self.alpha == 0:
+      return super(PrioritizedReplayBuffer, self).sample_idxs(batch_size)
+
+    if self.cursor_read_end < batch_size:
+      raise ValueError("Not enough examples in buffer (just %i) to fill a "
+                       "batch of %i." % (self.cursor_read_end, batch_size))
+    return self.tree.sample(batch_size, high=self.cursor_read_end)
+
+  def importance_weights(self, idxs, beta=None):
+    """
+    Compute importance-sampling weights `(N * P(i)) ** -beta` for the given
+    buffer indices, normalized by the batch maximum.
+    """
+    beta = self.beta if beta is None else beta
+    if self.alpha == 0:
+      return np.ones((len(idxs),), dtype=np.float32)
+
+    probs = self.tree.get(idxs) / self.tree.total
+    weights = (self.cursor_read_end * probs) ** -beta
+    return (weights / weights.max()).astype(np.float32)
+
+  def sample_prioritized(self, batch_size, beta=None, out=None):
+    """
+    Sample a batch of experience tuples in proportion to priority.
+
+    Returns:
+      batch: Tuple `(states, actions, rewards, states_next, terminals)`
+      weights: `batch_size` float32 vector of importance-sampling weights
+      idxs: Buffer indices of the sampled tuples, to be passed back to
+        `update_priorities`
+    """
+    idxs = self.sample_idxs(batch_size)
+    weights = self.importance_weights(idxs, beta=beta)
+    return self.gather(idxs, out=out), weights, idxs.copy()
+
+  def update_priorities(self, idxs, td_errors):
+    """
+    Update the priorities of previously sampled tuples given their new TD
+    errors (e.g. `DPG.td_errors`).
+    """
+    priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+    self.tree.update(idxs, priorities)
+    self.max_priority = max(self.max_priority, priorities.max())
+
+
+class RecurrentReplayBuffer(BufferCursorMixin):
+
+  """
+  Experience replay storage for fixed-length recurrent rollouts.
+
+  Stores whole trajectories contiguously. Each trajectory's state sequence
+  carries one extra zero-filled slot at timestep `seq_length`, so that the
+  "next state" of the final timestep can be fetched with the same indexing
+  arithmetic as every other timestep.
+  """
+
+  def __init__(self, buffer_size, mdp, input_dim, seq_length, policy_dim,
+               storage=None):
+    """
+    Args:
+      storage: Storage backend for buffer arrays (see `ReplayBuffer`).
+    """
+    self.buffer_size = buffer_size
+    self.mdp = mdp
+    self.seq_length = seq_length
+    self.storage = storage = storage or ArrayStorage()
+
+    self._cursor = storage.cursor()
+
+    self.inputs = storage.array("inputs", (buffer_size, input_dim),
+                                np.float32)
+    self.states = storage.array("states",
+                                (buffer_size, seq_length + 1, policy_dim),
+                                np.float32, zeros=True)
+    self.actions = storage.array("actions",
+                                 (buffer_size, seq_length, mdp.action_dim),
+                                 np.float32)
+    self.rewards = storage.array("rewards", (buffer_size, seq_length),
+                                 np.float32)
+
+    # Timestep-major views used for flat fancy indexing.
+    self._states_flat = self.states.reshape((-1, policy_dim))
+    self._actions_flat = self.actions.reshape((-1, mdp.action_dim))
+    self._rewards_flat = self.rewards.reshape((-1,))
+
+    self._traj_sampler = UniformIndexSampler()
+    self._time_sampler = UniformIndexSampler()
+    self._idx_cache = {}
+
+  def _check_nonempty(self, batch_size):
+    if self.cursor_read_end == 0:
+      raise ValueError("not enough trajectories in buffer (just %i) to fill a "
+                       "batch of %i." % (self.cursor_read_end, batch_size))
+
+  def _scratch(self, key, shape):
+    """Fetch a reusable integer index array of the given shape."""
+    arr = self._idx_cache.get((key, shape))
+    if arr is None:
+      arr = self._idx_cache[key, shape] = np.empty(shape, dtype=np.intp)
+    return arr
+
+  def sample_trajectory(self):
+    self._check_nonempty(1)
+
+    i = np.random.randint(0, self.cursor_read_end)
+    return (self.inputs[i], self.states[i, :self.seq_length], self.actions[i],
+            self.rewards[i])
+
+  def add_trajectory(self, inputs, states, actions, rewards):
+    self.inputs[self.cursor_write_start] = inputs
+    self.states[self.cursor_write_start, :self.seq_length] = states
+    self.actions[self.cursor_write_start] = actions
+    self.rewards[self.cursor_write_start] = rewards
+
+    self.cursor_write_start += 1
+    self.cursor_write_start = self.cursor_write_start % self.buffer_size
+
+    self.cursor_read_end = min(self.buffer_size, self.cursor_read_end + 1)
+
+  def make_batch(self, batch_size):
+    """
+    Allocate a tuple of output arrays which can be passed as the `out`
+    argument of `sample`.
+    """
+    return (np.empty((batch_size,) + self.inputs.shape[1:], dtype=np.float32),
+            np.empty((batch_size,) + self.states.shape[2:], dtype=np.float32),
+            np.empty((batch_size,) + self.states.shape[2:], dtype=np.float32),
+            np.empty((batch_size,) + self.actions.shape[2:], dtype=np.float32),
+            np.empty((batch_size,), dtype=np.float32))
+
+  def make_trajectory_batch(self, batch_size, window=None):
+    """
+    Allocate a tuple of output arrays which can be passed as the `out`
+    argument of `sample_trajectories`.
+    """
+    window = window or self.seq_length
+    return (np.empty((batch_size,) + self.inputs.shape[1:], dtype=np.float32),
+            np.empty((batch_size, window) + self.states.shape[2:],
+                     dtype=np.float32),
+            np.empty((batch_size, window) + self.states.shape[2:],
+                     dtype=np.float32),
+            np.empty((batch_size, window) + self.actions.shape[2:],
+                     dtype=np.float32),
+            np.empty((batch_size, window), dtype=np.float32))
+
+  def _gather(self, traj_idxs, state_idxs, step_idxs, out):
+    """
+    Gather a batch given trajectory indices and flat indices into the state
+    and action/reward arrays. `state_idxs + 1` addresses the next state.
+    """
+    next_state_idxs = self._scratch("next", state_idxs.shape)
+    np.add(state_idxs, 1, out=next_state_idxs)
+
+    sources = (self.inputs, self._states_flat, self._states_flat,
+               self._actions_flat, self._rewards_flat)
+    idxs = (traj_idxs, state_idxs, next_state_idxs, step_idxs, step_idxs)
+
+    if out is None:
+      return tuple(np.take(source, idxs_i, axis=0)
+                   for source, idxs_i in zip(sources, idxs))
+
+    for source, idxs_i, out_i in zip(sources, idxs, out):
+      # `mode="clip"` lets numpy write into `out` without buffering.
+      np.take(source, idxs_i, axis=0, out=out_i, mode="clip")
+    return out
+
+  def sample(self, batch_size, out=None):
+    """
+    Sample a batch of single timesteps, drawn uniformly over all stored
+    trajectories and timesteps.
+
+    Args:
+      batch_size:
+      out: Optional tuple of output arrays (see `make_batch`) to fill in place.
+
+    Returns:
+      Tuple `(inputs, states, states_next, actions, rewards)`. `states_next`
+      is zero for the final timestep of a trajectory.
+    """
+    self._check_nonempty(batch_size)
+
+    traj_idxs = self._traj_sampler.sample(self.cursor_read_end, batch_size)
+    t_idxs = self._time_sampler.sample(self.seq_length, batch_size)
+
+    state_idxs = self._scratch("state", (batch_size,))
+    np.multiply(traj_idxs, self.seq_length + 1, out=state_idxs)
+    state_idxs += t_idxs
+
+    step_idxs = self._scratch("step", (batch_size,))
+    np.multiply(traj_idxs, self.seq_length, out=step_idxs)
+    step_idxs += t_idxs
+
+    return self._gather(traj_idxs, state_idxs, step_idxs, out)
+
+  def sample_trajectories(self, batch_size, window=None, out=None):
+    """
+    Sample a batch of whole trajectories, or of fixed-length windows cut from
+    trajectories at uniformly random offsets.
+
+    Args:
+      batch_size:
+      window: Number of consecutive timesteps per sample. Defaults to the
+        full `seq_length`.
+      out: Optional tuple of output arrays (see `make_trajectory_batch`) to
+        fill in place.
+
+    Returns:
+      Tuple `(inputs, states, states_next, actions, rewards)` where all but
+      `inputs` have a leading `batch_size * window` shape.
+    """
+    self._check_nonempty(batch_size)
+    window = window or self.seq_length
+    if not 0 < window <= self.seq_length:
+      raise ValueError("window must be in [1, %i]; got %i"
+                       % (self.seq_length, window))
+
+    traj_idxs = self._traj_sampler.sample(self.cursor_read_end, batch_size)
+    t_start = self._time_sampler.sample(self.seq_length - window + 1,
+                                        batch_size)
+
+    offsets = self._idx_cache.get(("offsets", window))
+    if offsets is None:
+      offsets = self._idx_cache["offsets", window] = \
+          np.arange(window, dtype=np.intp)[np.newaxis, :]
+
+    state_start = self._scratch("state", (batch_size,))
+    np.multiply(traj_idxs, self.seq_length + 1, out=state_start)
+    state_start += t_start
+    state_idxs = self._scratch("state_window", (batch_size, window))
+    np.add(state_start[:, np.newaxis], offsets, out=state_idxs)
+
+    step_start = self._scratch("step", (batch_size,))
+    np.multiply(traj_idxs, self.seq_length, out=step_start)
+    step_start += t_start
+    step_idxs = self._scratch("step_window", (batch_size, window))
+    np.add(step_start[:, np.newaxis], offsets, out=step_idxs)
+
+    return self._gather(traj_idxs, state_idxs, step_idxs, out)
@@ -0,0 +1,13 @@
+"""
+Model and environment specifications.
+"""
+
+from collections import namedtuple
+
+
+# MDP specification
+MDPSpec = namedtuple("MDPSpec", ["state_dim", "action_dim"])
+
+
+# DPG model specification
+DPGSpec = namedtuple("DPGSpec", ["policy_dims", "critic_dims"])
@@ -0,0 +1,381 @@
+"""
+Read scalar summaries back out of TF event files.
+
+`RunIndex` parses the event files of one run (logdir) once, and keeps every
+scalar tag as columnar NumPy arrays in a compact on-disk cache next to them.
+The cache remembers the size, mtime and parsed byte offset of each event
+file; when a file grows only the new records are parsed. `SummaryIndex`
+queries many runs at once.
+
+Event records are decoded directly from the protobuf wire format, so reading
+summaries does not import TensorFlow.
+"""
+
+import glob
+import os
+import os.path
+import struct
+import zipfile
+
+import numpy as np
+
+
+# Header of one TFRecord: uint64 length, uint32 masked CRC of the length.
+_RECORD_HEADER = struct.Struct("<QI")
+# Each record is followed by a uint32 masked CRC of its data.
+_RECORD_FOOTER_SIZE = 4
+
+_DOUBLE = struct.Struct("<d")
+_FLOAT = struct.Struct("<f")
+
+# Protobuf field numbers of `Event.wall_time`, `Event.step`,
+# `Event.summary`, `Summary.value`, `Summary.Value.tag` and
+# `Summary.Value.simple_value`.
+_EVENT_WALL_TIME, _EVENT_STEP, _EVENT_SUMMARY = 1, 2, 5
+_SUMMARY_VALUE = 1
+_VALUE_TAG, _VALUE_SIMPLE_VALUE = 1, 2
+
+
+def event_files(logdir):
+  """List the event files in `logdir`, oldest first."""
+  paths = glob.glob(os.path.join(logdir, "events.out.tfevents.*"))
+  return sorted(paths, key=os.path.getmtime)
+
+
+def read_records(path, offset=0):
+  """
+  Iterate over complete TFRecords in a file, starting at byte `offset`.
+
+  A truncated record at the end of the file (e.g. one which is still being
+  written) ends iteration without being yielded.
+
+  Yields:
+    `(data, end_offset)` pairs, where `end_offset` is the offset just past the
+    record.
+  """
+  with open(path, "rb") as f:
+    f.seek(offset)
+    while True:
+      header = f.read(_RECORD_HEADER.size)
+      if len(header) < _RECORD_HEADER.size:
+        return
+      length, _ = _RECORD_HEADER.unpack(header)
+
+      data = f.read(length)
+      footer = f.read(_RECORD_FOOTER_SIZE)
+      if len(data) < length or len(footer) < _RECORD_FOOTER_SIZE:
+        return
+
+      offset += _RECORD_HEADER.size + length + _RECORD_FOOTER_SIZE
+      yield data, offset
+
+
+def _read_varint(data, pos):
+  result, shift = 0, 0
+  while True:
+    byte = ord(data[pos])
+    pos += 1
+    result |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return result, pos
+    shift += 7
+
+
+def _iter_fields(data):
+  """
+  Iterate over the fields of a serialized protobuf message.
+
+  Yields:
+    `(field_number, value)` pairs. Varint values are ints; all other values
+    are the raw field bytes.
+  """
+  pos = 0
+  while pos < len(data):
+    key, pos = _read_varint(data, pos)
+    field, wire_type = key >> 3, key & 7
+    if wire_type == 0:
+      value, pos = _read_varint(data, pos)
+    elif wire_type == 1:
+      value, pos = data[pos:pos + 8], pos + 8
+    elif wire_type == 2:
+      length, pos = _read_varint(data, pos)
+      value, pos = data[pos:pos + length], pos + length
+    elif wire_type == 5:
+      value, pos = data[pos:pos + 4], pos + 4
+    else:
+      raise ValueError("Unsupported protobuf wire type %i" % wire_type)
+    yield field, value
+
+
+def parse_scalar_event(data):
+  """
+  Decode the scalar summaries of a serialized `Event` proto.
+
+  Returns:
+    wall_time:
+    step:
+    values: List of `(tag, simple_value)` pairs
+  """
+  wall_time, step, values = 0.0, 0, []
+  for field, value in _iter_fields(data):
+    if field == _EVENT_WALL_TIME:
+      wall_time, = _DOUBLE.unpack(value)
+    elif field == _EVENT_STEP:
+      # int64, two's complement
+      step = value - (1 << 64) if value >= (1 << 63) else value
+    elif field == _EVENT_SUMMARY:
+      for summary_field, summary_value in _iter_fields(value):
+        if summary_field != _SUMMARY_VALUE:
+          continue
+
+        tag, simple_value = None, None
+        for value_field, value_value in _iter_fields(summary_value):
+          if value_field == _VALUE_TAG:
+            tag = value_value
+          elif value_field == _VALUE_SIMPLE_VALUE:
+            simple_value, = _FLOAT.unpack(value_value)
+        if simple_value is not None:
+          values.append((tag, simple_value))
+
+  return wall_time, step, values
+
+
+def reduce_values(values, reduction, window=None):
+  """
+  Reduce a vector of summary values.
+
+  Args:
+    values:
+    reduction: One of `max`, `min`, `mean`, `last` or `window_mean` (mean of
+      the last `window` values)
+    window:
+  """
+  if len(values) == 0:
+    return np.nan
+
+  if reduction == "max":
+    return values.max()
+  elif reduction == "min":
+    return values.min()
+  elif reduction == "mean":
+    return values.mean()
+  elif reduction == "last":
+    return values[-1]
+  elif reduction == "window_mean":
+    if not window:
+      raise ValueError("window_mean reduction requires a window")
+    return values[-window:].mean()
+  else:
+    raise ValueError("Unknown reduction %s" % reduction)
+
+
+class RunIndex(object):
+
+  """
+  Columnar index of all scalar summaries logged in a single logdir, or in a
+  single event file.
+
+  The index of a logdir is cached on disk. A cache which can't be read is
+  rebuilt, and one which can't be written (e.g. in a read-only logdir) is
+  skipped. A single event file is indexed without a cache.
+  """
+
+  cache_filename = ".summary_index.npz"
+
+  def __init__(self, path):
+    """
+    Args:
+      path: Logdir, or path of one event file
+    """
+    self.path = path
+    if os.path.isfile(path):
+      self.logdir = os.path.dirname(path)
+      self.event_files = lambda: [path]
+      self.cache_path = None
+    else:
+      self.logdir = path
+      self.event_files = lambda: event_files(path)
+      self.cache_path = os.path.join(path, self.cache_filename)
+
+    # Event file basename -> (size, mtime, parsed offset)
+    self.files = {}
+    # Tag -> (wall_times, steps, values), sorted by wall time
+    self.columns = {}
+
+    if self.cache_path is not None:
+      self._load()
+
+  def _load(self):
+    try:
+      with np.load(self.cache_path) as cache:
+        for name, size, mtime, offset in zip(cache["file_names"],
+                                             cache["file_sizes"],
+                                             cache["file_mtimes"],
+                                             cache["file_offsets"]):
+          self.files[str(name)] = (int(size), float(mtime), int(offset))
+        for i, tag in enumerate(cache["tags"]):
+          self.columns[str(tag)] = (cache["wall_times_%i" % i],
+                                    cache["steps_%i" % i],
+                                    cache["values_%i" % i])
+    except (IOError, ValueError, KeyError, EOFError, zipfile.BadZipfile):
+      # Missing or unreadable cache. Rebuild from scratch.
+      self.files, self.columns = {}, {}
+
+  def _save(self):
+    names = sorted(self.files)
+    arrays = {
+      "file_names": np.array(names),
+      "file_sizes": np.array([self.files[n][0] for n in names], np.int64),
+      "file_mtimes": np.array([self.files[n][1] for n in names], np.float64),
+      "file_offsets": np.array([self.files[n][2] for n in names], np.int64),
+    }
+
+    tags = sorted(self.columns)
+    arrays["tags"] = np.array(tags)
+    for i, tag in enumerate(tags):
+      wall_times, steps, values = self.columns[tag]
+      arrays["wall_times_%i" % i] = wall_times
+      arrays["steps_%i" % i] = steps
+      arrays["values_%i" % i] = values
+
+    # Write to a temporary file first so that readers never see a partial
+    # cache. (`np.savez` appends `.npz` to names without it.)
+    tmp_path = self.cache_path + ".tmp.npz"
+    try:
+      np.savez(tmp_path, **arrays)
+      os.rename(tmp_path, self.cache_path)
+    except (IOError, OSError):
+      # Not writable; the index is rebuilt on the next read.
+      pass
+
+  def update(self):
+    """
+    Parse any event data written since the index was last updated.
+
+    Returns:
+      `True` if the index changed.
+    """
+    new_rows = {}
+    changed = False
+
+    for path in self.event_files():
+      name = os.path.basename(path)
+      stat = os.stat(path)
+      size, mtime = stat.st_size, stat.st_mtime
+
+      cached = self.files.get(name)
+      if cached is not None and cached[:2] == (size, mtime):
+        continue
+
+      offset = 0
+      if cached is not None and size >= cached[0]:
+        # File grew: resume after the last record we parsed.
+        offset = cached[2]
+      elif cached is not None:
+        # File shrank or was replaced; drop everything and rebuild.
+        self.files, self.columns = {}, {}
+        return self.update()
+
+      offset = self._parse_file(path, offset, new_rows)
+      self.files[name] = (size, mtime, offset)
+      changed = True
+
+    for tag, rows in new_rows.items():
+      wall_times, steps, values = [np.array(col) for col in zip(*rows)]
+      if tag in self.columns:
+        old_wall_times, old_steps, old_values = self.columns[tag]
+        wall_times = np.concatenate([old_wall_times, wall_times])
+        steps = np.concatenate([old_steps, steps])
+        values = np.concatenate([old_values, values])
+
+      order = np.argsort(wall_times, kind="mergesort")
+      self.columns[tag] = (wall_times[order].astype(np.float64),
+                           steps[order].astype(np.int64),
+                           values[order].astype(np.float32))
+
+    if changed and self.cache_path is not None:
+      self._save()
+    return changed
+
+  def _parse_file(self, path, offset, new_rows):
+    """
+    Parse scalar summaries from `path` starting at `offset` into `new_rows`,
+    a dict mapping tags to lists of `(wall_time, step, value)` rows.
+
+    Returns:
+      Offset just past the last complete record.
+    """
+    for data, offset in read_records(path, offset):
+      wall_time, step, values = parse_scalar_event(data)
+      for tag, value in values:
+        new_rows.setdefault(tag, []).append((wall_time, step, value))
+
+    return offset
+
+  def tags(self):
+    return sorted(self.columns)
+
+  def scalars(self, tag):
+    """
+    Returns:
+      steps: int64 vector of global steps
+      values: float32 vector of summary values
+      Both are ordered by the wall time at which values were logged.
+    """
+    if tag not in self.columns:
+      return np.zeros((0,), np.int64), np.zeros((0,), np.float32)
+    _, steps, values = self.columns[tag]
+    return steps, values
+
+
+class SummaryIndex(object):
+
+  """Query scalar summaries across many runs."""
+
+  def __init__(self, paths, update=True):
+    """
+    Args:
+      paths: Logdirs or event files, one per run
+    """
+    self.runs = [RunIndex(path) for path in paths]
+    if update:
+      for run in self.runs:
+        run.update()
+
+  def tags(self):
+    return sorted(set(tag for run in self.runs for tag in run.tags()))
+
+  def query(self, tag, reduction=None, window=None):
+    """
+    Fetch a tag for every run.
+
+    Returns:
+      A list of `(path, result)` pairs. `result` is a `(steps, values)`
+      pair if `reduction` is `None`, and a reduced value otherwise (see
+      `reduce_values`).
+    """
+    results = []
+    for run in self.runs:
+      steps, values = run.scalars(tag)
+      if reduction is not None:
+        results.append((run.path, reduce_values(values, reduction,
+                                                window=window)))
+      else:
+        results.append((run.path, (steps, values)))
+    return results
+
+
+def read_scalars(logdir, tag):
+  """
+  Read every value logged for a scalar summary tag across all event files in
+  a logdir (e.g. from an original and a resumed run), using the run's cached
+  index.
+
+  Returns:
+    steps: int64 vector of global steps
+    values: float32 vector of summary values
+    Both are ordered by the wall time at which values were logged.
+  """
+  run = RunIndex(logdir)
+  run.update()
+  return run.scalars(tag)
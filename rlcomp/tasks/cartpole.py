@@ -1,14 +1,20 @@
 """
 Toy task (not computation-related): cartpole swingup.
 
-We rely heavily on Christoph Dann's `tdlearn` library here.
+We rely heavily on Christoph Dann's `tdlearn` library here. A pure-NumPy
+stand-in for its dynamics (`--env=numpy`) lets the task run without it.
 """
 
+import os.path
+import Queue
+import sys
+import threading
+
 import numpy as np
 import tensorflow as tf
 
-from tdlearn.examples import PendulumSwingUpCartPole
-
+from rlcomp import envs
+from rlcomp import profiling
 from rlcomp import util
 from rlcomp.dpg import DPG
 
@@ -16,21 +22,63 @@ from rlcomp.dpg import DPG
 flags = tf.flags
 FLAGS = flags.FLAGS
 
+flags.DEFINE_string("logdir", "/tmp/rlcomp_cartpole", "")
+flags.DEFINE_string("env", "tdlearn",
+                    "Cartpole implementation: `tdlearn` or `numpy` (pure-NumPy "
+                    "stand-in for `tdlearn`'s dynamics)")
+flags.DEFINE_integer("num_envs", 1,
+                     "Number of environment instances stepped in lockstep "
+                     "when collecting experience.")
+flags.DEFINE_integer("max_episode_length", 100, "")
+
 flags.DEFINE_string("policy_dims", "20", "")
 flags.DEFINE_string("critic_dims", "", "")
 
 flags.DEFINE_integer("batch_size", 64, "")
 flags.DEFINE_integer("buffer_size", 10 ** 6, "")
+flags.DEFINE_boolean("replay_memmap", False,
+                     "Keep the replay buffer in memory-mapped files under "
+                     "`$logdir/replay`, resuming from any buffer already "
+                     "stored there.")
+flags.DEFINE_boolean("prioritized_replay", False,
+                     "Sample replay experience in proportion to critic TD "
+                     "error.")
+flags.DEFINE_float("priority_alpha", 0.6, "")
+flags.DEFINE_float("priority_beta", 0.4, "")
 
 flags.DEFINE_integer("num_iter", 1000, "")
 flags.DEFINE_integer("eval_interval", 10,
                      "Evaluate policy without exploration every $n$ "
                      "iterations.")
+flags.DEFINE_integer("log_interval", 100,
+                     "Log step throughput and section timings every $n$ "
+                     "iterations.")
+flags.DEFINE_integer("profile_window", 1000,
+                     "Number of recent iterations over which timing "
+                     "percentiles are computed.")
+flags.DEFINE_integer("trace_interval", 0,
+                     "Write a full TF trace of every $n$th training step to "
+                     "`--logdir`. 0 disables tracing.")
 flags.DEFINE_float("policy_lr", 0.0001, "")
 flags.DEFINE_float("critic_lr", 0.00001, "")
 flags.DEFINE_float("momentum", 0.9, "")
 flags.DEFINE_float("gamma", 0.95, "")
 flags.DEFINE_float("tau", 0.001, "")
+flags.DEFINE_integer("track_interval", 1,
+                     "Apply the tracking-model update every $n$ training "
+                     "steps.")
+
+# Asynchronous actor / learner mode
+flags.DEFINE_integer("num_actors", 0,
+                     "Number of actor threads collecting experience while the "
+                     "learner trains. 0 alternates collection and training in "
+                     "a single thread.")
+flags.DEFINE_integer("actor_queue_size", 16,
+                     "Maximum number of collected episode batches waiting for "
+                     "the learner. Actors block when the queue is full.")
+flags.DEFINE_integer("actor_sync_interval", 100,
+                     "Copy learner policy parameters to the actors' policy "
+                     "every $n$ learner updates.")
 
 
 def preprocess_state(state):
@@ -70,73 +118,306 @@ def run_episode(mdp, dpg, policy, buffer=None, max_len=100):
   return states, actions, rewards, states_next
 
 
-def train_batch(dpg, policy_update, critic_update, buffer):
+def run_episodes(vec_env, dpg, policy, buffer=None, max_len=100):
+  """
+  Roll out one episode in each instance of a vectorized environment.
+
+  The policy is evaluated once per timestep for all instances, and all
+  transitions are added to `buffer` with a single bulk `extend`.
+
+  Returns:
+    states, actions, rewards, states_next: arrays with leading dimensions
+      `max_len * num_envs`
+  """
+  sess = tf.get_default_session()
+  n = vec_env.num_envs
+
+  states = np.empty((max_len, n, vec_env.dim_S), dtype=np.float32)
+  actions = np.empty((max_len, n, vec_env.dim_A), dtype=np.float32)
+  rewards = np.empty((max_len, n), dtype=np.float32)
+  states_next = np.empty_like(states)
+
+  raw_states = vec_env.reset()
+  states[0] = preprocess_state(raw_states)
+  for t in xrange(max_len):
+    actions[t] = sess.run(policy, {dpg.inputs: states[t]})
+    raw_states, rewards[t] = vec_env.step(preprocess_action(actions[t]))
+    states_next[t] = preprocess_state(raw_states)
+    if t + 1 < max_len:
+      states[t + 1] = states_next[t]
+
+  if buffer is not None:
+    flat = lambda xs: xs.reshape((max_len * n,) + xs.shape[2:])
+    buffer.extend(flat(states), flat(actions), flat(rewards),
+                  flat(states_next))
+  return states, actions, rewards, states_next
+
+
+def train_batch(dpg, train_step, buffer, batch=None, profiler=None, t=0):
+  """
+  Sample a minibatch from the replay buffer and run one fused training step
+  (TD targets, policy update, critic update and tracking update) in a single
+  session call.
+
+  Args:
+    batch: Optional tuple of preallocated sample arrays (see
+      `ReplayBuffer.make_batch`) which will be filled in place.
+    profiler: Optional `profiling.StepProfiler` to time the step's sections
+    t: Training step, for `profiler`
+  """
   sess = tf.get_default_session()
+  section = profiler.section if profiler else profiling.null_section
+
+  prioritized = isinstance(buffer, util.PrioritizedReplayBuffer)
 
   # Sample a training minibatch.
   try:
-    b_states, b_actions, b_rewards, b_states_next = \
-        buffer.sample(FLAGS.batch_size)
+    with section("sample"):
+      if prioritized:
+        batch, b_weights, b_idxs = buffer.sample_prioritized(FLAGS.batch_size,
+                                                             out=batch)
+      else:
+        batch = buffer.sample(FLAGS.batch_size, out=batch)
   except ValueError:
     # Not enough data. Keep collecting trajectories.
     return 0.0
+  b_states, b_actions, b_rewards, b_states_next, b_terminals = batch
+
+  with section("feed"):
+    feed_dict = {dpg.inputs: b_states, dpg.rewards: b_rewards,
+                 dpg.states_next: b_states_next, dpg.terminals: b_terminals,
+                 dpg.tau: [FLAGS.tau]}
+    if prioritized:
+      feed_dict[dpg.critic_weights] = b_weights
+  run_kwargs = profiler.run_kwargs(t) if profiler else {}
+  with section("run"):
+    cost_t, _, td_errors = sess.run(
+        [dpg.critic_objective, train_step, dpg.td_errors], feed_dict,
+        **run_kwargs)
+
+  if prioritized:
+    buffer.update_priorities(b_idxs, td_errors)
 
-  # Compute targets (TD error backups) given current Q function.
-  a_next, q_next = sess.run([dpg.a_pred_track, dpg.critic_on_track],
-                            {dpg.inputs: b_states_next})
-  b_targets = b_rewards + FLAGS.gamma * q_next.flatten()
+  return cost_t
 
-  # Policy update.
-  sess.run(policy_update, {dpg.inputs: b_states})
 
-  # Critic update.
-  cost_t, _, q_pred = sess.run([dpg.critic_objective, critic_update, dpg.critic_off],
-                               {dpg.inputs: b_states, dpg.q_targets: b_targets})
+def make_mdp(num_envs=1):
+  """
+  Build the cartpole environment selected by `--env`.
 
-  return cost_t
+  Returns:
+    A single MDP instance if `num_envs` is 1, or a vectorized environment
+    otherwise.
+  """
+  if FLAGS.env == "numpy":
+    return envs.CartPoleSwingUp(num_envs)
+  elif FLAGS.env == "tdlearn":
+    from tdlearn.examples import PendulumSwingUpCartPole
+    if num_envs == 1:
+      return PendulumSwingUpCartPole()
+    return envs.MDPVecEnv(PendulumSwingUpCartPole, num_envs)
+  else:
+    raise ValueError("Unknown env %s" % FLAGS.env)
 
 
 def build_model():
-  mdp = PendulumSwingUpCartPole()
+  mdp = make_mdp(FLAGS.num_envs)
   mdp_spec = util.MDPSpec(mdp.dim_S, mdp.dim_A)
 
   dpg_spec = util.DPGSpec(FLAGS.policy_dims, FLAGS.critic_dims)
-  dpg = DPG(mdp_spec, dpg_spec)
+  dpg = DPG(mdp_spec, dpg_spec, gamma=FLAGS.gamma,
+            track_interval=FLAGS.track_interval)
 
   return mdp, dpg
 
 
 def build_updates(dpg):
+  """
+  Returns:
+    A fused training step op (see `DPG.make_train_step`).
+  """
   policy_optim = tf.train.MomentumOptimizer(FLAGS.policy_lr, FLAGS.momentum)
-  policy_update = policy_optim.minimize(dpg.policy_objective,
-                                        var_list=dpg.policy_params)
-
   critic_optim = tf.train.MomentumOptimizer(FLAGS.critic_lr, FLAGS.momentum)
-  critic_update = critic_optim.minimize(dpg.critic_objective,
-                                        var_list=dpg.critic_params)
 
-  return policy_update, critic_update
+  critic_objective = dpg.critic_objective
+  if FLAGS.prioritized_replay:
+    critic_objective = dpg.critic_objective_weighted
 
+  _, _, train_step = dpg.make_train_step(policy_optim, critic_optim,
+                                         critic_objective=critic_objective)
+  return train_step
+
+
+def collect_fn(num_envs):
+  """
+  Pick an episode collection function: step all environment instances in
+  lockstep if we have more than one.
+  """
+  return run_episodes if num_envs > 1 else run_episode
 
-def train(mdp, dpg, policy_update, critic_update, replay_buffer):
-  sess = tf.get_default_session()
 
-  for t in xrange(FLAGS.num_iter):
-    print t
-    # Sample a trajectory off-policy, then update the critic.
-    offp_states, offp_actions, offp_rewards, _ = \
-        run_episode(mdp, dpg, dpg.a_explore, replay_buffer)
-    cost_t = train_batch(dpg, policy_update, critic_update, replay_buffer)
+def make_profiler():
+  """
+  Returns:
+    profiler: `profiling.StepProfiler` configured from flags
+    summary_writer: The profiler's summary writer, to be closed by the caller
+  """
+  summary_writer = tf.train.SummaryWriter(FLAGS.logdir)
+  profiler = profiling.StepProfiler(window=FLAGS.profile_window,
+                                    log_interval=FLAGS.log_interval,
+                                    trace_interval=FLAGS.trace_interval,
+                                    logdir=FLAGS.logdir,
+                                    summary_writer=summary_writer)
+  return profiler, summary_writer
 
-    # Update tracking model.
-    sess.run([dpg.track_update], {dpg.tau: [FLAGS.tau]})
 
-    if t % FLAGS.eval_interval == 0:
-      # Evaluate actor by sampling a trajectory on-policy.
-      states, actions, rewards, _ = run_episode(mdp, dpg, dpg.a_pred)
+def train(mdp, dpg, train_step, replay_buffer):
+  # Sample storage reused across iterations.
+  batch = replay_buffer.make_batch(FLAGS.batch_size)
 
-      print np.mean(rewards)
-      # TODO log
+  collect = collect_fn(FLAGS.num_envs)
+  profiler, summary_writer = make_profiler()
+  try:
+    for t in xrange(FLAGS.num_iter):
+      # Sample trajectories off-policy, then update the critic.
+      with profiler.section("collect"):
+        offp_states, offp_actions, offp_rewards, _ = \
+            collect(mdp, dpg, dpg.a_explore, replay_buffer,
+                    max_len=FLAGS.max_episode_length)
+      cost_t = train_batch(dpg, train_step, replay_buffer, batch=batch,
+                           profiler=profiler, t=t)
+
+      if t % FLAGS.eval_interval == 0:
+        # Evaluate actor by sampling a trajectory on-policy.
+        with profiler.section("eval"):
+          states, actions, rewards, _ = collect(
+              mdp, dpg, dpg.a_pred, max_len=FLAGS.max_episode_length)
+
+        print "%i\treward %f" % (t, np.mean(rewards))
+
+      profiler.end_step(t)
+  finally:
+    summary_writer.close()
+
+
+def actor_loop(sess, mdp, dpg, policy, queue, stop, env_steps, errors):
+  """
+  Collect exploratory episodes with `policy` and push them onto `queue` until
+  `stop` is set. Blocks while the queue is full.
+
+  If collection fails, the exception info is appended to `errors` and `stop`
+  is set, so that the learner can re-raise it.
+  """
+  collect = collect_fn(FLAGS.num_envs)
+
+  try:
+    with sess.as_default():
+      while not stop.is_set():
+        episode = collect(mdp, dpg, policy, max_len=FLAGS.max_episode_length)
+        if FLAGS.num_envs > 1:
+          # Flatten leading `max_len * num_envs` dimensions.
+          episode = [xs.reshape((-1,) + xs.shape[2:]) for xs in episode]
+        else:
+          episode = [np.asarray(xs) for xs in episode]
+        n = len(episode[0])
+
+        while not stop.is_set():
+          try:
+            queue.put(episode, timeout=0.1)
+            break
+          except Queue.Full:
+            continue
+        env_steps.add(n)
+  except Exception:
+    errors.append(sys.exc_info())
+    stop.set()
+
+
+def train_async(mdp, dpg, train_step, replay_buffer, actor_policy,
+                actor_sync):
+  """
+  Train with `FLAGS.num_actors` actor threads collecting experience with a
+  periodically synced policy copy, while this thread keeps training on the
+  replay buffer.
+  """
+  sess = tf.get_default_session()
+
+  batch = replay_buffer.make_batch(FLAGS.batch_size)
+
+  queue = Queue.Queue(maxsize=FLAGS.actor_queue_size)
+  stop = threading.Event()
+  updates, env_steps = util.RateCounter(), util.RateCounter()
+  actor_errors = []
+
+  sess.run(actor_sync)
+  actors = [threading.Thread(target=actor_loop,
+                             args=(sess, make_mdp(FLAGS.num_envs), dpg,
+                                   actor_policy, queue, stop, env_steps,
+                                   actor_errors))
+            for _ in xrange(FLAGS.num_actors)]
+  for actor in actors:
+    actor.daemon = True
+    actor.start()
+
+  def check_actors():
+    if actor_errors:
+      error = actor_errors[0]
+      raise error[0], error[1], error[2]
+    if not any(actor.is_alive() for actor in actors):
+      raise RuntimeError("All actor threads have exited")
+
+  def get_episode():
+    # Wait with a timeout, so that we notice failed actors (and stay
+    # interruptible).
+    while True:
+      check_actors()
+      try:
+        return queue.get(timeout=0.1)
+      except Queue.Empty:
+        continue
+
+  def add_episode(episode):
+    states, actions, rewards, states_next = episode
+    replay_buffer.extend(states, actions, rewards, states_next)
+
+  collect = collect_fn(FLAGS.num_envs)
+  profiler, summary_writer = make_profiler()
+  try:
+    for t in xrange(FLAGS.num_iter):
+      # Move everything the actors have collected into the replay buffer,
+      # waiting for data if there isn't yet enough for a batch.
+      check_actors()
+      with profiler.section("replay"):
+        while len(replay_buffer) < FLAGS.batch_size:
+          add_episode(get_episode())
+        while True:
+          try:
+            add_episode(queue.get_nowait())
+          except Queue.Empty:
+            break
+
+      train_batch(dpg, train_step, replay_buffer, batch=batch,
+                  profiler=profiler, t=t)
+      updates.add()
+
+      if (t + 1) % FLAGS.actor_sync_interval == 0:
+        with profiler.section("sync"):
+          sess.run(actor_sync)
+
+      if t % FLAGS.eval_interval == 0:
+        # Evaluate actor by sampling a trajectory on-policy.
+        with profiler.section("eval"):
+          states, actions, rewards, _ = collect(
+              mdp, dpg, dpg.a_pred, max_len=FLAGS.max_episode_length)
+        print "%i\treward %f\tupdates/s %.1f\tenv steps/s %.1f" \
+            % (t, np.mean(rewards), updates.rate(), env_steps.rate())
+
+      profiler.end_step(t)
+  finally:
+    stop.set()
+    for actor in actors:
+      actor.join()
+    summary_writer.close()
 
 
 def main(unused_args):
@@ -144,12 +425,31 @@ def main(unused_args):
   FLAGS.critic_dims = [int(x) for x in filter(None, FLAGS.critic_dims.split(","))]
 
   mdp, dpg = build_model()
-  policy_update, critic_update = build_updates(dpg)
-  replay_buffer = util.ReplayBuffer(FLAGS.buffer_size, dpg.mdp_spec)
+  train_step = build_updates(dpg)
+  if FLAGS.num_actors > 0:
+    actor_policy, actor_sync = dpg.make_policy_copy()
+
+  storage = None
+  if FLAGS.replay_memmap:
+    storage = util.MemmapStorage(os.path.join(FLAGS.logdir, "replay"))
+  if FLAGS.prioritized_replay:
+    replay_buffer = util.PrioritizedReplayBuffer(
+        FLAGS.buffer_size, dpg.mdp_spec, alpha=FLAGS.priority_alpha,
+        beta=FLAGS.priority_beta, storage=storage)
+  else:
+    replay_buffer = util.ReplayBuffer(FLAGS.buffer_size, dpg.mdp_spec,
+                                      storage=storage)
 
   with tf.Session() as sess:
     sess.run(tf.initialize_all_variables())
-    train(mdp, dpg, policy_update, critic_update, replay_buffer)
+    try:
+      if FLAGS.num_actors > 0:
+        train_async(mdp, dpg, train_step, replay_buffer, actor_policy,
+                    actor_sync)
+      else:
+        train(mdp, dpg, train_step, replay_buffer)
+    finally:
+      replay_buffer.flush()
 
 
 if __name__ == "__main__":
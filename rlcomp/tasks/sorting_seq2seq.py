@@ -2,25 +2,43 @@
 Easy computation task: sorting sequences of distinct discrete elements.
 """
 
+from collections import namedtuple
 import os
 import os.path
 import pprint
+import sys
+import time
 
 import numpy as np
 import tensorflow as tf
 from tensorflow.models.rnn import rnn_cell, seq2seq
 
-from rlcomp import util
-from rlcomp.dpg import PointerNetDPG
+from rlcomp import lr_schedule, profiling, util
+from rlcomp.dpg import DynamicPointerNetDPG, PointerNetDPG
+from rlcomp.inference import PointerNetInference
 
 
 flags = tf.flags
 FLAGS = flags.FLAGS
 
-flags.DEFINE_string("mode", "train", "`train` or `test`")
+flags.DEFINE_string("mode", "train", "`train`, `test` or `infer`")
 flags.DEFINE_string("logdir", "/tmp/rlcomp_sorting", "")
 flags.DEFINE_string("checkpoint_path", None,
-                    "Path to model checkpoint. Used only in `test` mode")
+                    "Path to model checkpoint. Used only in `test` and "
+                    "`infer` modes")
+flags.DEFINE_boolean("resume", True,
+                     "Resume training from the latest checkpoint in "
+                     "`--logdir`, if there is one.")
+flags.DEFINE_integer("keep_checkpoints", 5,
+                     "Number of most recent periodic checkpoints kept in "
+                     "`--logdir`. The checkpoint with the best evaluation "
+                     "reward is kept in addition.")
+flags.DEFINE_integer("checkpoint_secs", 600,
+                     "Save a checkpoint every $n$ seconds. 0 disables "
+                     "time-based checkpoints.")
+flags.DEFINE_integer("checkpoint_interval", 0,
+                     "Save a checkpoint every $n$ iterations. 0 disables "
+                     "step-based checkpoints.")
 flags.DEFINE_boolean("verbose_summaries", False,
                     "Log very detailed summaries of parameter magnitudes, "
                     "activations, etc.")
@@ -29,9 +47,42 @@ flags.DEFINE_integer("eval_interval", 9999,
                      "Evaluate policy without exploration every $n$ "
                      "iterations.")
 flags.DEFINE_integer("summary_flush_interval", 120, "")
+flags.DEFINE_integer("summary_interval", 10,
+                     "Compute scalar summaries every $n$ iterations.")
+flags.DEFINE_integer("histogram_interval", 100,
+                     "Compute histogram summaries (see --verbose_summaries) "
+                     "every $n$ iterations.")
+flags.DEFINE_integer("log_interval", 100,
+                     "Log step throughput and section timings every $n$ "
+                     "iterations.")
+flags.DEFINE_integer("profile_window", 1000,
+                     "Number of recent iterations over which timing "
+                     "percentiles are computed.")
+flags.DEFINE_integer("trace_interval", 0,
+                     "Write a full TF trace of every $n$th training step to "
+                     "`--logdir`. 0 disables tracing.")
+flags.DEFINE_integer("num_agents", 1,
+                     "Number of independently initialized agents to train "
+                     "side by side in one graph, each with its own variables "
+                     "and optimizers. All agents step in one `Session.run`.")
+flags.DEFINE_boolean("shared_batches", True,
+                     "With --num_agents > 1, train all agents on the same "
+                     "batches. Otherwise each agent draws its own.")
+flags.DEFINE_integer("intra_op_threads", 0,
+                     "Threads per TF op. 0 lets TF pick based on core count.")
+flags.DEFINE_integer("inter_op_threads", 0,
+                     "Threads for running independent TF ops. 0 lets TF pick "
+                     "based on core count.")
 
 # Data parameters
 flags.DEFINE_integer("seq_length", 5, "")
+flags.DEFINE_boolean("dynamic", False,
+                     "Build a single loop-based graph which handles sequences "
+                     "of any length (see `DynamicSortingDPG`).")
+flags.DEFINE_integer("min_seq_length", None,
+                     "With --dynamic, train on sequences of lengths drawn "
+                     "uniformly between this and --seq_length. Defaults to "
+                     "--seq_length.")
 flags.DEFINE_integer("vocab_size", 10, "")
 
 # Initialization hyperparameters
@@ -42,6 +93,9 @@ flags.DEFINE_integer("embedding_dim", 20, "")
 flags.DEFINE_string("policy_dims", "20", "")
 flags.DEFINE_string("critic_dims", "", "")
 flags.DEFINE_boolean("batch_normalize_actions", False, "")
+flags.DEFINE_integer("num_heads", 1, "Number of decoder attention heads.")
+flags.DEFINE_string("attention_mode", "additive",
+                    "Decoder attention scoring: `additive` or `dot`.")
 
 # Autoencoder
 flags.DEFINE_integer("pretrain_autoencoder", 0, "")
@@ -50,14 +104,48 @@ flags.DEFINE_integer("pretrain_autoencoder", 0, "")
 flags.DEFINE_integer("batch_size", 64, "")
 flags.DEFINE_integer("buffer_size", 10 ** 6, "")
 flags.DEFINE_integer("num_iter", 10000, "")
+flags.DEFINE_boolean("prefetch", True,
+                     "Generate training batches in background threads and "
+                     "stage them in a queue in the graph, rather than "
+                     "feeding each batch from the training loop.")
+flags.DEFINE_integer("prefetch_capacity", 16,
+                     "Maximum number of batches staged by --prefetch.")
+flags.DEFINE_integer("prefetch_threads", 1,
+                     "Number of batch producer threads for --prefetch.")
 flags.DEFINE_float("policy_lr", 0.0001, "")
 flags.DEFINE_float("critic_lr", 0.00001, "")
 flags.DEFINE_float("momentum", 0.9, "")
 flags.DEFINE_float("gamma", 0.95, "")
 flags.DEFINE_float("tau", 0.001, "")
-flags.DEFINE_boolean("cut_lr", True, "")
+flags.DEFINE_boolean("cut_lr", True,
+                     "If false, disable --lr_schedule and keep learning rates "
+                     "fixed.")
+flags.DEFINE_string("lr_schedule", "threshold",
+                    "Learning rate schedule: `none`, `threshold` (decay when "
+                    "the eval reward first exceeds each of --lr_thresholds), "
+                    "`plateau` (decay when the eval reward stops improving), "
+                    "`step` or `exponential` (decay every --lr_decay_steps).")
+flags.DEFINE_float("lr_decay", 0.5, "Learning rate decay factor.")
+flags.DEFINE_integer("lr_decay_steps", 1000, "")
+flags.DEFINE_string("lr_thresholds", "0.1,0.2,0.3", "")
+flags.DEFINE_integer("lr_patience", 3,
+                     "Number of evaluations without improvement before a "
+                     "`plateau` decay.")
+flags.DEFINE_float("lr_min_delta", 0.0, "")
 flags.DEFINE_float("explore_strength", 0.3, "Mean of permute strength")
 
+# Inference
+flags.DEFINE_integer("beam_width", 1,
+                     "Beam width for `infer` mode. 1 is masked greedy "
+                     "decoding.")
+flags.DEFINE_integer("infer_num_examples", 100000,
+                     "Number of sequences to decode in `infer` mode, in "
+                     "chunks of --batch_size.")
+flags.DEFINE_integer("infer_agent", 0,
+                     "Agent to decode with in `infer` mode, for checkpoints "
+                     "of --num_agents > 1 runs. --num_agents must match the "
+                     "training run.")
+
 
 class SortingDPG(PointerNetDPG):
 
@@ -69,9 +157,15 @@ class SortingDPG(PointerNetDPG):
   """
 
   def __init__(self, mdp, spec, embedding_dim, vocab_size, seq_length,
-               **kwargs):
+               input_tokens=None, **kwargs):
+    """
+    Args:
+      input_tokens: Optional list of `seq_length` int32 `batch_size` token
+        tensors (e.g. from a `util.QueuePrefetcher`). Placeholders by default.
+    """
     self.vocab_size = vocab_size
     self.embedding_dim = embedding_dim
+    self.input_tokens = input_tokens
 
     kwargs["noiser"] = kwargs.get("noiser", self._noise_actions)
 
@@ -80,12 +174,7 @@ class SortingDPG(PointerNetDPG):
 
   def _make_params(self):
     super(SortingDPG, self)._make_params()
-
-    embedding_init = tf.random_normal_initializer(
-        stddev=FLAGS.embedding_init_range)
-    self.embeddings = tf.get_variable(
-        "embedding", (self.vocab_size, self.embedding_dim),
-        initializer=embedding_init)
+    self.embeddings = make_embeddings(self.vocab_size, self.embedding_dim)
 
   def _policy_params(self):
     params = super(SortingDPG, self)._policy_params()
@@ -93,8 +182,9 @@ class SortingDPG(PointerNetDPG):
     return params
 
   def _make_inputs(self):
-    self.input_tokens = [tf.placeholder(tf.int32, (None,))
-                         for _ in range(self.seq_length)]
+    if self.input_tokens is None:
+      self.input_tokens = [tf.placeholder(tf.int32, (None,))
+                           for _ in range(self.seq_length)]
     self.inputs = [tf.nn.embedding_lookup(self.embeddings, tokens_t)
                    for tokens_t in self.input_tokens]
     super(SortingDPG, self)._make_inputs()
@@ -105,12 +195,13 @@ class SortingDPG(PointerNetDPG):
     self.rewards_pred, _ = self._calc_rewards(self.a_pred, name="rewards_pred")
     self.rewards_explore, rewards_explore_unpacked = \
         self._calc_rewards(self.a_explore, name="rewards_explore")
+    self.mean_rewards_pred = tf.reduce_mean(self.rewards_pred)
 
-    tf.scalar_summary("rewards/pred.mean", tf.reduce_mean(self.rewards_pred))
-    tf.scalar_summary("rewards/explore.mean", tf.reduce_mean(self.rewards_explore))
+    self._scalar_summary("rewards/pred.mean", self.mean_rewards_pred)
+    self._scalar_summary("rewards/explore.mean", tf.reduce_mean(self.rewards_explore))
 
-    tf.scalar_summary("rewards/pred.max_mean", tf.reduce_max(tf.reduce_mean(self.rewards_pred, 0)))
-    tf.scalar_summary("rewards/explore.max_mean", tf.reduce_max(tf.reduce_mean(self.rewards_explore, 0)))
+    self._scalar_summary("rewards/pred.max_mean", tf.reduce_max(tf.reduce_mean(self.rewards_pred, 0)))
+    self._scalar_summary("rewards/explore.max_mean", tf.reduce_max(tf.reduce_mean(self.rewards_explore, 0)))
 
     # Compute bootstrap Q(s_next, pi_off(s_next))
     bootstraps = [self.critic_off_track[t + 1]
@@ -123,28 +214,10 @@ class SortingDPG(PointerNetDPG):
 #    self.q_targets[0] = tf.Print(self.q_targets[0], [self.q_targets[1], bootstraps[1], tf.reduce_mean(self.rewards_explore)], summarize=100)
 
   def _calc_rewards(self, action_list, name="rewards"):
-    action_list = tf.transpose(self.harden_actions(action_list))
-    action_list = tf.unpack(action_list, FLAGS.batch_size)
-
     # batch_size * seq_length
+    actions = tf.transpose(self.harden_actions(action_list))
     token_matrix = tf.transpose(tf.pack(self.input_tokens))
-    token_matrix = tf.unpack(token_matrix, FLAGS.batch_size)
-
-    # "Dereference" the predicted sorts, which are index sequences.
-    predicted = [tf.gather(token_matrix[i], action_list[i])
-                 for i in range(FLAGS.batch_size)]
-#    predicted[0] = tf.Print(predicted[0], [predicted[0]], "predicted_" + name, summarize=100)
-    predicted = tf.concat(0, [tf.expand_dims(predicted_i, 0)
-                              for predicted_i in predicted])
-    #predicted = tf.Print(predicted, [predicted], "predicted_" + name, summarize=100)
-
-    # Compute per-timestep rewards by evaluating constraint violations.
-    rewards = (tf.slice(predicted, [0, 1], [-1, -1])
-               > tf.slice(predicted, [0, 0], [-1, self.seq_length - 1]))
-    rewards = tf.cast(rewards, tf.float32)
-    # Add reward for t = 0, fixed as 0
-    rewards = tf.concat(1, [tf.zeros((FLAGS.batch_size, 1)),
-                            rewards])
+    rewards = sort_rewards(token_matrix, actions, self.seq_length)
 
     rewards = tf.transpose(rewards)
     rewards_unpacked = tf.unpack(rewards, self.seq_length,
@@ -187,12 +260,161 @@ class SortingDPG(PointerNetDPG):
     return tf.pack(ret)
 
 
-def build_updates(dpg):
+class DynamicSortingDPG(DynamicPointerNetDPG):
+
+  """
+  Sorting on top of `DynamicPointerNetDPG`: a single graph for sequences of
+  any length.
+
+  Tokens are fed as one zero-padded `batch_size * seq_length` matrix
+  `input_tokens` together with the sequence lengths `lengths`. Rewards and
+  Q-value targets are `batch_size * seq_length`, and zero at padding.
+  """
+
+  def __init__(self, mdp, spec, embedding_dim, vocab_size, input_tokens=None,
+               **kwargs):
+    """
+    Args:
+      input_tokens: Optional int32 `batch_size * seq_length` token tensor
+        (e.g. from a `util.QueuePrefetcher`). A placeholder by default.
+    """
+    self.vocab_size = vocab_size
+    self.embedding_dim = embedding_dim
+    self.input_tokens = input_tokens
+
+    kwargs["noiser"] = kwargs.get("noiser", self._noise_actions)
+
+    super(DynamicSortingDPG, self).__init__(mdp, spec, embedding_dim,
+                                            **kwargs)
+
+  def _make_params(self):
+    super(DynamicSortingDPG, self)._make_params()
+    self.embeddings = make_embeddings(self.vocab_size, self.embedding_dim)
+
+  def _make_inputs(self):
+    if self.input_tokens is None:
+      self.input_tokens = tf.placeholder(tf.int32, (None, None),
+                                         name="input_tokens")
+    self.inputs = tf.nn.embedding_lookup(self.embeddings, self.input_tokens)
+    super(DynamicSortingDPG, self)._make_inputs()
+
+  def _make_q_targets(self):
+    # batch_size * seq_length
+    self.rewards_pred = self._calc_rewards(self.a_pred)
+    self.rewards_explore = self._calc_rewards(self.a_explore)
+    self.mean_rewards_pred = self._masked_mean(self.rewards_pred)
+
+    self._scalar_summary("rewards/pred.mean", self.mean_rewards_pred)
+    self._scalar_summary("rewards/explore.mean",
+                         self._masked_mean(self.rewards_explore))
+
+    # Compute bootstrap Q(s_next, pi_off(s_next)), which is zero at the last
+    # timestep of each sequence.
+    shift_left = lambda x: tf.slice(tf.pad(x, [[0, 0], [0, 1]]), [0, 1],
+                                    [-1, -1])
+    bootstraps = shift_left(self.critic_off_track) * shift_left(self.mask)
+
+    self.q_targets = self.rewards_explore + FLAGS.gamma * bootstraps
+
+  def _calc_rewards(self, actions):
+    rewards = sort_rewards(self.input_tokens, self.harden_actions(actions))
+    return rewards * self.mask
+
+  def _noise_actions(self, inputs, actions, name="noiser"):
+    # Replace the pointer at some timesteps with a pointer to a random valid
+    # position. (Permuting softmax columns as `SortingDPG` does would point
+    # at padding once sequences in a batch differ in length.)
+    shape = tf.shape(actions)
+    random_logits = (tf.random_uniform(shape)
+                     + (tf.expand_dims(self.mask, 1) - 1.0) * 1e9)
+    random_ptrs = tf.one_hot(tf.argmax(random_logits, 2), shape[2],
+                             on_value=1.0, off_value=0.0)
+
+    # With some weight favor less replacement over more replacement.
+    permute_strength = tf.maximum(
+        0.0, tf.random_normal((1,), mean=FLAGS.explore_strength, stddev=0.2))
+    replace = tf.to_float(
+        tf.random_uniform(tf.pack([shape[0], shape[1], 1])) < permute_strength)
+
+    return replace * random_ptrs + (1.0 - replace) * actions
+
+  def harden_actions(self, actions):
+    # batch_size * seq_length hard pointers
+    return tf.argmax(actions, 2)
+
+
+def make_embeddings(vocab_size, embedding_dim):
+  embedding_init = tf.random_normal_initializer(
+      stddev=FLAGS.embedding_init_range)
+  return tf.get_variable("embedding", (vocab_size, embedding_dim),
+                         initializer=embedding_init)
+
+
+def sort_rewards(token_matrix, actions, seq_length=None):
+  """
+  Compute per-timestep sorting rewards for a batch of predicted sorts.
+
+  Args:
+    token_matrix: `batch_size * seq_length` int tensor of input tokens
+    actions: `batch_size * seq_length` int tensor of hard pointers into each
+      row of `token_matrix`
+    seq_length: Row length of `token_matrix`. If `None`, it is read from
+      `token_matrix` when the graph runs.
+
+  Returns:
+    `batch_size * seq_length` float tensor. Reward at `t > 0` is 1 if the
+    token pointed to at `t` is greater than the one pointed to at `t - 1`;
+    reward at `t = 0` is fixed as 0.
+  """
+  # "Dereference" the predicted sorts, which are index sequences, with a
+  # single gather into the flattened token matrix. Row `i` of the batch
+  # starts at offset `i * seq_length`.
+  batch_size = tf.shape(token_matrix)[0]
+  if seq_length is None:
+    seq_length = tf.shape(token_matrix)[1]
+  offsets = tf.expand_dims(tf.range(0, batch_size) * seq_length, 1)
+  predicted = tf.gather(tf.reshape(token_matrix, [-1]),
+                        tf.to_int32(actions) + offsets)
+
+  # Compute per-timestep rewards by evaluating constraint violations.
+  rewards = (tf.slice(predicted, [0, 1], [-1, -1])
+             > tf.slice(predicted, [0, 0], tf.pack([-1, seq_length - 1])))
+  rewards = tf.cast(rewards, tf.float32)
+  # Add reward for t = 0, fixed as 0
+  return tf.pad(rewards, [[0, 0], [1, 0]])
+
+
+# Training ops of one agent.
+Agent = namedtuple("Agent", ["dpg", "schedule", "policy_update",
+                             "critic_update"])
+
+
+def agent_name(i):
+  """Variable scope of agent `i`. A lone agent keeps the default `dpg`."""
+  return "dpg" if FLAGS.num_agents == 1 else "dpg_%i" % i
+
+
+def build_updates(dpg, global_step, increment_step=True, name=None):
+  """
+  Args:
+    global_step: Step counter variable
+    increment_step: If true, increment `global_step` with each critic update
+    name: Optional variable scope for the agent's learning rates and
+      schedule state
+
+  Returns:
+    An `Agent`
+  """
+  if name is not None:
+    with tf.variable_scope(name):
+      return build_updates(dpg, global_step, increment_step=increment_step)
+
   policy_params = dpg.policy_params
   if FLAGS.pretrain_autoencoder > 0:
     # We already trained the encoder using autoencoder task. Remove encoder
     # weights from optimization.
-    policy_params = [p for p in policy_params if "encoder" not in p.name]
+    encoder_params = set(dpg.registry.params("encoder"))
+    policy_params = [p for p in policy_params if p not in encoder_params]
 
   policy_lr = tf.Variable(FLAGS.policy_lr, name="policy_lr")
   policy_optim = tf.train.AdamOptimizer(policy_lr)
@@ -202,9 +424,31 @@ def build_updates(dpg):
   critic_lr = tf.Variable(FLAGS.critic_lr, name="critic_lr")
   critic_optim = tf.train.AdamOptimizer(critic_lr)
   critic_update = critic_optim.minimize(dpg.critic_objective,
-                                        var_list=dpg.critic_params)
+                                        var_list=dpg.critic_params,
+                                        global_step=(global_step
+                                                     if increment_step
+                                                     else None))
+
+  schedule = build_lr_schedule(dpg, [policy_lr, critic_lr], global_step)
+
+  return Agent(dpg, schedule, policy_update, critic_update)
 
-  return policy_lr, critic_lr, policy_update, critic_update
+
+def build_lr_schedule(dpg, lrs, global_step):
+  kind = FLAGS.lr_schedule if FLAGS.cut_lr else "none"
+  kwargs = {}
+  if kind in ["threshold", "plateau", "step", "exponential"]:
+    kwargs["decay"] = FLAGS.lr_decay
+  if kind == "threshold":
+    kwargs["thresholds"] = [float(x) for x in FLAGS.lr_thresholds.split(",")]
+  elif kind == "plateau":
+    kwargs["patience"] = FLAGS.lr_patience
+    kwargs["min_delta"] = FLAGS.lr_min_delta
+  elif kind in ["step", "exponential"]:
+    kwargs["decay_steps"] = FLAGS.lr_decay_steps
+
+  return lr_schedule.make_lr_schedule(kind, lrs, global_step=global_step,
+                                      reward=dpg.mean_rewards_pred, **kwargs)
 
 
 def build_autoencoder(dpg):
@@ -216,7 +460,7 @@ def build_autoencoder(dpg):
   dec_inp = [tf.zeros_like(dpg.input_tokens[0], name="adec_inp%i" % t)
              for t in range(dpg.seq_length)]
   dec_out, _ = util.embedding_rnn_decoder(
-      dec_inp, dpg.encoder_states[-1], dec_cell, FLAGS.vocab_size,
+      dec_inp, dpg.encoder_state, dec_cell, FLAGS.vocab_size,
       feed_previous=True, embedding=dpg.embeddings, scope="adec")
 
   labels = [tf.placeholder(tf.int32, shape=(None,), name="labels%i" % t)
@@ -252,88 +496,285 @@ def pretrain_autoencoder(dpg, autoencoder, num_iters):
     print loss_t
 
 
-def gen_inputs():
-  xs = np.random.choice(FLAGS.vocab_size, replace=False,
-                        size=FLAGS.seq_length)
-  return xs
+def gen_inputs(batch_size, length):
+  """
+  Returns:
+    `batch_size * length` int32 matrix whose rows are sequences of distinct
+    tokens, drawn uniformly at random
+  """
+  # Rows of argsorted uniform noise are uniform random permutations of the
+  # vocabulary; their prefixes are random distinct-token sequences.
+  noise = np.random.random((batch_size, FLAGS.vocab_size))
+  return np.argsort(noise, axis=1)[:, :length].astype(np.int32)
 
 
 def make_batch(batch_size):
-  inputs = np.array([gen_inputs() for _ in range(batch_size)])
-  return inputs.T
+  # seq_length * batch_size
+  return gen_inputs(batch_size, FLAGS.seq_length).T
+
+
+def make_dynamic_batch(batch_size):
+  """
+  Returns:
+    tokens: `batch_size * max_length` token matrix, zero-padded past each
+      sequence's length
+    lengths: `batch_size` vector of sequence lengths, uniform between
+      `--min_seq_length` and `--seq_length`
+  """
+  min_length = FLAGS.min_seq_length or FLAGS.seq_length
+  lengths = np.random.randint(min_length, FLAGS.seq_length + 1,
+                              size=batch_size)
+  tokens = gen_inputs(batch_size, lengths.max())
+  tokens[np.arange(lengths.max())[np.newaxis, :]
+         >= lengths[:, np.newaxis]] = 0
+  return tokens, lengths.astype(np.int32)
+
+
+def make_prefetcher():
+  """
+  Build a queue of training batches, and the input tensors which consume it.
+
+  Returns:
+    prefetcher: `util.QueuePrefetcher`
+    dpg_inputs: Keyword arguments which make a `SortingDPG` or
+      `DynamicSortingDPG` read its inputs from the queue
+  """
+  if FLAGS.dynamic:
+    prefetcher = util.QueuePrefetcher(
+        lambda: make_dynamic_batch(FLAGS.batch_size), [tf.int32, tf.int32],
+        [(None, None), (None,)], capacity=FLAGS.prefetch_capacity,
+        num_threads=FLAGS.prefetch_threads)
+    tokens, lengths = prefetcher.outputs
+    return prefetcher, {"input_tokens": tokens, "lengths": lengths}
+
+  prefetcher = util.QueuePrefetcher(
+      lambda: [gen_inputs(FLAGS.batch_size, FLAGS.seq_length)], [tf.int32],
+      [(None, FLAGS.seq_length)], capacity=FLAGS.prefetch_capacity,
+      num_threads=FLAGS.prefetch_threads)
+  tokens, = prefetcher.outputs
+  return prefetcher, {"input_tokens": tf.unpack(tf.transpose(tokens),
+                                                FLAGS.seq_length)}
+
+
+def sample_batches(dpgs, batch_size):
+  """
+  Sample a batch of inputs for each of the given models (one batch for all
+  with --shared_batches).
+  """
+  batches, batch = [], None
+  for dpg in dpgs:
+    if batch is None or not FLAGS.shared_batches:
+      batch = (make_dynamic_batch(batch_size)
+               if isinstance(dpg, DynamicSortingDPG)
+               else make_batch(batch_size))
+    batches.append(batch)
+  return batches
+
 
+def make_feed_dict(dpgs, batch_size, batches=None):
+  """
+  Build a feed dict of input batches for each of the given models. This also
+  overrides inputs which would otherwise be read from a prefetch queue.
 
-def train(dpg, policy_lr, critic_lr, policy_update, critic_update):
+  Args:
+    batches: Optional batches from `sample_batches`. Sampled if not given.
+  """
+  if not isinstance(dpgs, (list, tuple)):
+    dpgs = [dpgs]
+  if batches is None:
+    batches = sample_batches(dpgs, batch_size)
+
+  feed_dict = {}
+  for dpg, batch in zip(dpgs, batches):
+    if isinstance(dpg, DynamicSortingDPG):
+      tokens, lengths = batch
+      feed_dict.update({dpg.input_tokens: tokens, dpg.lengths: lengths})
+    else:
+      # inputs: seq_length * batch_size
+      feed_dict.update({dpg.input_tokens[t]: batch[t]
+                        for t in range(FLAGS.seq_length)})
+
+  return feed_dict
+
+
+def train(agents, global_step, checkpoints, resume_path=None,
+          prefetchers=()):
+  """
+  Train one or more agents, stepping all of them with each `Session.run`.
+
+  All ops are built before the training loop starts, and the graph is then
+  finalized: creating an op inside the loop raises an error.
+
+  Args:
+    agents: List of `Agent`s
+    global_step: Step counter, incremented once per training step
+    checkpoints: `util.CheckpointManager`. Periodic checkpoints are saved at
+      its cadence and at the end of training, and the best checkpoint by
+      mean evaluation reward (over agents) after each evaluation.
+    resume_path: Optional checkpoint to restore before training. Training
+      continues from the checkpoint's `global_step`.
+    prefetchers: `util.QueuePrefetcher`s which supply the agents' training
+      inputs. If none are given, batches are fed at each step.
+  """
   sess = tf.get_default_session()
+  dpgs = [agent.dpg for agent in agents]
 
-  summary_op = tf.merge_all_summaries()
   summary_writer = tf.train.SummaryWriter(FLAGS.logdir, sess.graph_def,
                                           flush_secs=FLAGS.summary_flush_interval)
-  saver = tf.train.Saver()
+  summaries = util.SummaryScheduler(
+      summary_writer, scalar_interval=FLAGS.summary_interval,
+      histogram_interval=FLAGS.histogram_interval)
+
+  if resume_path:
+    checkpoints.restore(sess, resume_path)
+    print "Resumed from %s" % resume_path
+  start_t = sess.run(global_step)
+
+  train_fetches = []
+  eval_fetches, eval_updates = [], []
+  for agent in agents:
+    train_fetches.extend([agent.policy_update, agent.critic_update])
+    if agent.schedule.step_update is not None:
+      train_fetches.append(agent.schedule.step_update)
+
+    eval_fetches.append(agent.dpg.mean_rewards_pred)
+    if agent.schedule.eval_update is not None:
+      eval_updates.append(agent.schedule.eval_update)
+
+  sess.graph.finalize()
+
+  profiler = profiling.StepProfiler(window=FLAGS.profile_window,
+                                    log_interval=FLAGS.log_interval,
+                                    trace_interval=FLAGS.trace_interval,
+                                    logdir=FLAGS.logdir,
+                                    summary_writer=summary_writer)
+
+  for prefetcher in prefetchers:
+    prefetcher.start(sess)
+  checkpoints.start(sess)
 
-  halved_yet = 0
-  for t in xrange(FLAGS.num_iter):
-    print t
-
-    # inputs: seq_length * batch_size
-    inputs = make_batch(FLAGS.batch_size)
-    feed_dict = {dpg.input_tokens[t]: inputs[t]
-                 for t in range(FLAGS.seq_length)}
-
-    # Run a batch of rollouts and execute policy + critic update
-    cost_t, summary, _, _ = sess.run(
-        [dpg.critic_objective, summary_op, policy_update, critic_update],
-        feed_dict)
-
-    # Now update tracking model
-    # sess.run(dpg.track_update) DEV: Not necessary
-
-    if summary:
-      summary_writer.add_summary(summary, t)
-
-    if t % FLAGS.eval_interval == 0:
-      inputs = make_batch(FLAGS.batch_size)
-      feed_dict = {dpg.input_tokens[t]: inputs[t]
-                   for t in range(FLAGS.seq_length)}
-      rewards_fetch = tf.reduce_mean(dpg.rewards_pred)
-      rewards = sess.run(rewards_fetch, feed_dict)
-
-      # DEV
-      if FLAGS.cut_lr:
-        if rewards > 0.1 and halved_yet < 1:
-          sess.run([tf.assign(policy_lr, policy_lr * 0.5),
-                    tf.assign(critic_lr, critic_lr * 0.5)])
-          halved_yet = max(halved_yet, 1)
-        if rewards > 0.2 and halved_yet < 2:
-          sess.run([tf.assign(policy_lr, policy_lr * 0.5),
-                    tf.assign(critic_lr, critic_lr * 0.5)])
-          halved_yet = max(halved_yet, 2)
-        if rewards > 0.3 and halved_yet < 3:
-          sess.run([tf.assign(policy_lr, policy_lr * 0.5),
-                    tf.assign(critic_lr, critic_lr * 0.5)])
-          halved_yet = max(halved_yet, 3)
-
-      print "\t", rewards
-
-    if t % FLAGS.eval_interval == 0 or t + 1 == FLAGS.num_iter:
-      save_path = os.path.join(FLAGS.logdir, "model.ckpt")
-      saver.save(sess, save_path, global_step=t)
-
-
-def test(dpg):
+  try:
+    try:
+      for t in xrange(start_t, FLAGS.num_iter):
+        # With prefetching, inputs are dequeued inside the graph.
+        feed_dict = None
+        if not prefetchers:
+          with profiler.section("data"):
+            batches = sample_batches(dpgs, FLAGS.batch_size)
+          with profiler.section("feed"):
+            feed_dict = make_feed_dict(dpgs, FLAGS.batch_size, batches)
+
+        # Run a batch of rollouts and execute policy + critic updates of all
+        # agents, along with any summaries due at this step
+        summary_fetches = summaries.fetches(t)
+        with profiler.section("run"):
+          values = sess.run(train_fetches + summary_fetches, feed_dict,
+                            **profiler.run_kwargs(t))
+
+        if summary_fetches:
+          with profiler.section("summary"):
+            summaries.write(values[len(train_fetches):], t)
+
+        reward = None
+        if t % FLAGS.eval_interval == 0:
+          with profiler.section("eval"):
+            feed_dict = make_feed_dict(dpgs, FLAGS.batch_size)
+            # Schedule eval updates read the same evaluation rewards.
+            rewards = sess.run(eval_fetches + eval_updates,
+                               feed_dict)[:len(eval_fetches)]
+
+          print "%i\treward %s" % (t, " ".join(str(rewards_i)
+                                               for rewards_i in rewards))
+          reward = np.mean(rewards)
+
+        # Only snapshots here; checkpoints are written in the background.
+        with profiler.section("save"):
+          checkpoints.save(sess, t, reward=reward,
+                           force=t + 1 == FLAGS.num_iter)
+
+        profiler.end_step(t)
+    except:
+      # Only report background thread errors, so that they don't hide this
+      # one.
+      exc_info = sys.exc_info()
+      for prefetcher in prefetchers:
+        prefetcher.stop(sess, raise_error=False)
+      checkpoints.stop(raise_error=False)
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+    for prefetcher in prefetchers:
+      prefetcher.stop(sess)
+    checkpoints.stop()
+  finally:
+    # Flush the final summaries, which are read as soon as the run exits
+    # (e.g. by `run_search.py`).
+    summary_writer.close()
+
+
+def test(dpgs):
   sess = tf.get_default_session()
 
-  mean_reward = tf.reduce_mean(
-          tf.reduce_sum(dpg.rewards_pred, 0) / tf.to_float(dpg.seq_length - 1))
+  mean_rewards = []
+  for dpg in dpgs:
+    if isinstance(dpg, DynamicSortingDPG):
+      # Length-1 sequences have no pairs to reward; avoid dividing by zero
+      # as in `infer`.
+      num_pairs = tf.to_float(tf.maximum(dpg.lengths - 1, 1))
+      mean_reward = tf.reduce_mean(
+          tf.reduce_sum(dpg.rewards_pred, 1) / num_pairs)
+    else:
+      mean_reward = tf.reduce_mean(
+            tf.reduce_sum(dpg.rewards_pred, 0) / tf.to_float(dpg.seq_length - 1))
+    mean_rewards.append(mean_reward)
+
+  sess.graph.finalize()
 
   for t in xrange(FLAGS.num_iter):
-    inputs = make_batch(FLAGS.batch_size)
-    feed_dict = {dpg.input_tokens[t]: inputs[t]
-                 for t in range(FLAGS.seq_length)}
+    feed_dict = make_feed_dict(dpgs, FLAGS.batch_size)
 
     # Run a batch of rollouts and calculate average reward.
-    rewards_t = sess.run(mean_reward, feed_dict)
-    print rewards_t
+    rewards_t = sess.run(mean_rewards, feed_dict)
+    print " ".join(str(rewards_i) for rewards_i in rewards_t)
+
+
+def infer(engine):
+  """
+  Decode `--infer_num_examples` random sequences (lengths as in
+  `make_dynamic_batch`) with the inference engine, and report throughput and
+  accuracy.
+  """
+  def batches():
+    for start in xrange(0, FLAGS.infer_num_examples, FLAGS.batch_size):
+      yield make_dynamic_batch(min(FLAGS.batch_size,
+                                   FLAGS.infer_num_examples - start))
+
+  num_seqs, num_sorted, rewards_sum, decode_time = 0, 0, 0.0, 0.0
+  for tokens, lengths in batches():
+    start = time.time()
+    pointers, _ = engine.decode(tokens, lengths, beam_width=FLAGS.beam_width)
+    decode_time += time.time() - start
+
+    # Dereference the pointers, and count increasing pairs as in
+    # `sort_rewards`.
+    predicted = tokens[np.arange(len(tokens))[:, np.newaxis],
+                       np.maximum(pointers, 0)]
+    valid = np.arange(tokens.shape[1])[np.newaxis, :] < lengths[:, np.newaxis]
+    increases = ((predicted[:, 1:] > predicted[:, :-1])
+                 & valid[:, 1:]).sum(axis=1)
+
+    num_seqs += len(tokens)
+    num_sorted += (increases == lengths - 1).sum()
+    rewards_sum += (increases / np.maximum(lengths - 1, 1.0)).sum()
+
+  print "%i sequences in %.2fs: %.1f seq/s" % (num_seqs, decode_time,
+                                               num_seqs / decode_time)
+  print "accuracy (fully sorted): %.4f" % (num_sorted / float(num_seqs))
+  print "mean reward: %.4f" % (rewards_sum / num_seqs)
+
+
+def session_config():
+  return tf.ConfigProto(intra_op_parallelism_threads=FLAGS.intra_op_threads,
+                        inter_op_parallelism_threads=FLAGS.inter_op_threads)
 
 
 def main(unused_args):
@@ -350,32 +791,102 @@ def main(unused_args):
   mdp_spec = util.MDPSpec(state_dim, FLAGS.embedding_dim)#FLAGS.policy_dims[0])
   dpg_spec = util.DPGSpec(FLAGS.policy_dims, FLAGS.critic_dims)
 
-  dpg = SortingDPG(mdp_spec, dpg_spec, FLAGS.embedding_dim,
-                   FLAGS.vocab_size, FLAGS.seq_length, tau=FLAGS.tau)
+  if FLAGS.mode == "infer":
+    if not 0 <= FLAGS.infer_agent < FLAGS.num_agents:
+      raise ValueError("--infer_agent must be in [0, --num_agents); pass the "
+                       "--num_agents of the training run")
+
+    # Build only the encoder and decoder, and restore them from a checkpoint
+    # of either the static or the dynamic model.
+    engine = PointerNetInference(FLAGS.embedding_dim, FLAGS.policy_dims[0],
+                                 vocab_size=FLAGS.vocab_size,
+                                 num_heads=FLAGS.num_heads,
+                                 attention_mode=FLAGS.attention_mode,
+                                 name=agent_name(FLAGS.infer_agent))
+    with tf.Session(config=session_config()) as sess:
+      saver = tf.train.Saver(engine.variables)
+      saver.restore(sess, FLAGS.checkpoint_path)
+
+      infer(engine)
+    return
+
+  if FLAGS.pretrain_autoencoder > 0:
+    if FLAGS.dynamic:
+      raise ValueError("--pretrain_autoencoder is not supported with "
+                       "--dynamic")
+    if FLAGS.num_agents > 1:
+      raise ValueError("--pretrain_autoencoder is not supported with "
+                       "--num_agents > 1")
+
+  # Inputs of each agent. With --shared_batches, agents read the same queue.
+  prefetchers, dpg_inputs = [], [{}] * FLAGS.num_agents
+  if FLAGS.mode == "train" and FLAGS.prefetch:
+    if FLAGS.shared_batches:
+      prefetcher, inputs = make_prefetcher()
+      prefetchers, dpg_inputs = [prefetcher], [inputs] * FLAGS.num_agents
+    else:
+      prefetchers, dpg_inputs = zip(*[make_prefetcher()
+                                      for _ in range(FLAGS.num_agents)])
+
+  dpgs = []
+  for i in range(FLAGS.num_agents):
+    name = agent_name(i)
+    summary_prefix = "agent_%i/" % i if FLAGS.num_agents > 1 else ""
+    if FLAGS.dynamic:
+      dpg = DynamicSortingDPG(mdp_spec, dpg_spec, FLAGS.embedding_dim,
+                              FLAGS.vocab_size, tau=FLAGS.tau,
+                              num_heads=FLAGS.num_heads,
+                              attention_mode=FLAGS.attention_mode, name=name,
+                              summary_prefix=summary_prefix, **dpg_inputs[i])
+    else:
+      dpg = SortingDPG(mdp_spec, dpg_spec, FLAGS.embedding_dim,
+                       FLAGS.vocab_size, FLAGS.seq_length, tau=FLAGS.tau,
+                       num_heads=FLAGS.num_heads,
+                       attention_mode=FLAGS.attention_mode, name=name,
+                       summary_prefix=summary_prefix, **dpg_inputs[i])
+    dpgs.append(dpg)
 
   if FLAGS.mode == "train":
-    policy_lr, critic_lr, policy_update, critic_update = build_updates(dpg)
+    # Counts training steps; saved with checkpoints so that training can
+    # resume where it left off. Agents step together, so only the first
+    # increments it.
+    global_step = tf.Variable(0, trainable=False, name="global_step")
+    agents = [build_updates(dpg, global_step, increment_step=i == 0,
+                            name=(None if FLAGS.num_agents == 1
+                                  else "%s_train" % dpg.name))
+              for i, dpg in enumerate(dpgs)]
 
     if FLAGS.pretrain_autoencoder > 0:
-      autoencoder = build_autoencoder(dpg)
+      autoencoder = build_autoencoder(dpgs[0])
 
     if FLAGS.verbose_summaries:
-      util.add_histogram_summaries(set(dpg.policy_params + dpg.critic_params))
+      for dpg in dpgs:
+        util.add_histogram_summaries(set(dpg.policy_params
+                                         + dpg.critic_params))
 
-    with tf.Session() as sess:
+    checkpoints = util.CheckpointManager(
+        FLAGS.logdir, max_to_keep=FLAGS.keep_checkpoints,
+        save_secs=FLAGS.checkpoint_secs, save_steps=FLAGS.checkpoint_interval)
+
+    with tf.Session(config=session_config()) as sess:
       sess.run(tf.initialize_all_variables())
 
-      if FLAGS.pretrain_autoencoder > 0:
-        pretrain_autoencoder(dpg, autoencoder, FLAGS.pretrain_autoencoder)
+      resume_path = None
+      if FLAGS.resume:
+        resume_path = checkpoints.latest_checkpoint()
+
+      if FLAGS.pretrain_autoencoder > 0 and not resume_path:
+        pretrain_autoencoder(dpgs[0], autoencoder, FLAGS.pretrain_autoencoder)
 
-      train(dpg, policy_lr, critic_lr, policy_update, critic_update)
+      train(agents, global_step, checkpoints, resume_path=resume_path,
+            prefetchers=prefetchers)
 
   elif FLAGS.mode == "test":
-    with tf.Session() as sess:
+    with tf.Session(config=session_config()) as sess:
       saver = tf.train.Saver()
       saver.restore(sess, FLAGS.checkpoint_path)
 
-      test(dpg)
+      test(dpgs)
 
 
 if __name__ == "__main__":
@@ -1,82 +1,201 @@
-from collections import namedtuple
-import logging
-import re
+"""
+TensorFlow model-building utilities.
+
+TF-free utilities live in their own modules, which import quickly without
+TensorFlow: `rlcomp.specs`, `rlcomp.replay`, `rlcomp.flagfile` and
+`rlcomp.profiling`. They are re-exported here for existing callers.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import os.path
+import Queue
 import sys
+import threading
+import time
+import traceback
 
-import numpy as np
 import tensorflow as tf
 from tensorflow.models.rnn import linear, rnn_cell, seq2seq
-from tensorflow.python.ops.variable_scope import _VariableScope # HACK
 
+from rlcomp.flagfile import read_flagfile
+from rlcomp.profiling import RateCounter
+from rlcomp.replay import (UniformIndexSampler, ArrayStorage, MemmapStorage,
+                           BufferCursorMixin, ReplayBuffer, SumTree,
+                           PrioritizedReplayBuffer, RecurrentReplayBuffer)
+from rlcomp.specs import MDPSpec, DPGSpec
 
-# MDP specification
-MDPSpec = namedtuple("MDPSpec", ["state_dim", "action_dim"])
 
+# Collections of scalar and histogram summaries, which `SummaryScheduler`
+# fetches at separate intervals. Summaries are also added to the default
+# `tf.GraphKeys.SUMMARIES` collection.
+SCALAR_SUMMARIES = "scalar_summaries"
+HISTOGRAM_SUMMARIES = "histogram_summaries"
 
-# DPG model specification
-DPGSpec = namedtuple("DPGSpec", ["policy_dims", "critic_dims"])
 
+class TrackingParams(object):
 
-def match_variable(name, scope_name):
   """
-  Match a variable (initialize with same value) from another variable scope.
+  Tracking copies of a model's parameters, stored contiguously in a single
+  flat variable.
 
-  After initialization, the values of the two variables are not tied in any
-  way.
-  """
-
-  # HACK: Using private _VariableScope API in order to be able to get an
-  # absolute-path to the given variable scope name (i.e., not have it treated
-  # as a relative path and placed under whatever variable scope might contain
-  # this function call)
-  with tf.variable_scope(_VariableScope(True, scope_name), reuse=True):
-    track_var = tf.get_variable(name)
-
-  # Create a dummy initializer.
-  initializer = lambda *args, **kwargs: track_var.initialized_value()
+  The tracking model reads its parameters as reshaped slices of the flat
+  variable (see `get`), so the soft update
 
-  return tf.get_variable(name, shape=track_var.get_shape(),
-                         initializer=initializer)
+      track <- tau * main + (1 - tau) * track
 
+  of all parameters is one `tf.assign` on the flat buffer, rather than an
+  assign per parameter.
+  """
 
-def track_model_updates(main_name, track_name, tau):
+  def __init__(self, params, name="params"):
+    """
+    Args:
+      params: Dict mapping parameter names (relative to the main model's
+        scope) to main model variables, e.g. from
+        `ParamRegistry.named_params`. Tracking parameters are initialized
+        with the values of these variables.
+      name: Name of the flat variable, created in the current variable scope
+    """
+    self.names = list(params.keys())
+    self.params = [params[name_i] for name_i in self.names]
+    shapes = [param.get_shape() for param in self.params]
+    sizes = [shape.num_elements() for shape in shapes]
+
+    # Flat view of the main parameters, read by the soft update.
+    self.main_flat = tf.concat(0, [tf.reshape(param, [-1])
+                                   for param in self.params])
+
+    # Initialize from the main parameters' initial values.
+    init_value = tf.concat(0, [tf.reshape(param.initialized_value(), [-1])
+                               for param in self.params])
+    initializer = lambda *args, **kwargs: init_value
+    self.flat = tf.get_variable(name, (sum(sizes),), trainable=False,
+                                initializer=initializer)
+
+    self._views = {}
+    offset = 0
+    for name_i, shape, size in zip(self.names, shapes, sizes):
+      view = tf.slice(self.flat, [offset], [size])
+      self._views[name_i] = tf.reshape(view, shape.as_list())
+      offset += size
+
+  def get(self, name):
+    """
+    Returns:
+      Tensor holding the tracking value of main parameter `name`
+    """
+    return self._views[name]
+
+  def make_update(self, tau):
+    """
+    Build an op which moves the tracking parameters toward the main
+    parameters at rate `tau` (1 copies them).
+    """
+    return self.flat.assign(tau * self.main_flat + (1 - tau) * self.flat)
+
+
+def every_n_steps(n, make_op, name="every_n_steps"):
+  """
+  Build an op which runs the op built by `make_op` on every `n`th run (the
+  first run included), and does nothing otherwise. The run count is kept in
+  a variable, so it is saved with checkpoints.
   """
-  Build an update op to make parameters of a tracking model follow a main model.
+  if n == 1:
+    return make_op()
 
-  Call outside of the scope of both the main and tracking model.
+  count = tf.Variable(0, trainable=False, name="%s_count" % name)
 
-  Returns:
-    A group of `tf.assign` ops which require no inputs (only parameter values).
-  """
+  def run_op():
+    with tf.control_dependencies([make_op()]):
+      return tf.constant(True)
 
-  updates = []
-  params = [var for var in tf.all_variables()
-            if var.name.startswith(main_name + "/")]
+  ran = tf.cond(tf.equal(count % n, 0), run_op, lambda: tf.constant(False))
+  with tf.control_dependencies([ran]):
+    return count.assign_add(1)
 
-  for param in params:
-    track_param_name = param.op.name.replace(main_name + "/",
-                                             track_name + "/")
-    with tf.variable_scope(_VariableScope(True), reuse=True):
-      try:
-        track_param = tf.get_variable(track_param_name)
-      except ValueError:
-        logging.warn("Tracking model variable %s does not exist",
-                     track_param_name)
-        continue
 
-    # TODO sparse params
-    update_op = tf.assign(track_param,
-                          tau * param + (1 - tau) * track_param)
-    updates.append(update_op)
+class ParamRegistry(object):
 
-  return tf.group(*updates)
+  """
+  Records the variables created under a variable scope, grouped by the child
+  scope which contains them (e.g. `policy`, `critic_track`).
 
+  Lookups read the recorded groups directly, rather than scanning every
+  variable in the graph, so models built under different scopes never see
+  each other's parameters.
+  """
 
-def mlp(inp, inp_dim, outp_dim, track_scope=None, hidden=None, f=tf.tanh,
+  def __init__(self, scope_name):
+    """
+    Args:
+      scope_name: Full name of the variable scope. May be empty, in which
+        case groups are top-level scopes.
+    """
+    self.scope_name = scope_name
+    self._groups = OrderedDict()
+    # Index of the next unrecorded variable while capturing.
+    self._next = None
+
+  @contextmanager
+  def capture(self):
+    """
+    Record all variables created within this context. Variables created
+    so far can be looked up before the context exits.
+    """
+    self._next = len(tf.get_collection(tf.GraphKeys.VARIABLES))
+    yield
+    self._sync()
+    self._next = None
+
+  def _sync(self):
+    if self._next is None:
+      return
+
+    new_vars = tf.get_collection(tf.GraphKeys.VARIABLES)[self._next:]
+    for var in new_vars:
+      self.add(var)
+    self._next += len(new_vars)
+
+  def add(self, var):
+    prefix = self.scope_name + "/" if self.scope_name else ""
+    if not var.op.name.startswith(prefix):
+      return
+
+    group, _, name = var.op.name[len(prefix):].partition("/")
+    self._groups.setdefault(group, OrderedDict())[name] = var
+
+  def named_params(self, group):
+    """
+    Returns:
+      Dict mapping names relative to `group` to the group's variables
+    """
+    self._sync()
+    return self._groups.get(group, OrderedDict())
+
+  def params(self, *groups):
+    """
+    Returns:
+      List of the variables in each of the given groups, in creation order
+    """
+    return [var for group in groups
+            for var in self.named_params(group).values()]
+
+  def all_params(self):
+    self._sync()
+    return self.params(*self._groups.keys())
+
+
+def mlp(inp, inp_dim, outp_dim, track_params=None, hidden=None, f=tf.tanh,
         bias_output=False):
   """
   Basic multi-layer neural network implementation, with custom architecture
   and activation function.
+
+  Args:
+    track_params: Optional `TrackingParams` of a main network with the same
+      architecture. If given, this network is a tracking copy which reads its
+      parameters from it, and creates no variables.
   """
   if not hidden:
     hidden = []
@@ -87,15 +206,15 @@ def mlp(inp, inp_dim, outp_dim, track_scope=None, hidden=None, f=tf.tanh,
   for i, (src_dim, tgt_dim) in enumerate(zip(layer_dims, layer_dims[1:])):
     Wi_name, bi_name = "W%i" % i, "b%i" % i
 
-    Wi = ((track_scope and match_variable(Wi_name, track_scope))
-          or tf.get_variable("W%i" % i, (src_dim, tgt_dim)))
+    Wi = (track_params.get(Wi_name) if track_params
+          else tf.get_variable(Wi_name, (src_dim, tgt_dim)))
     x = tf.matmul(x, Wi)
 
     final_layer = i == len(layer_dims) - 2
     if not final_layer or bias_output:
-      bi = ((track_scope and match_variable(bi_name, track_scope))
-            or tf.get_variable("b%i" % i, (tgt_dim,),
-                               initializer=tf.zeros_initializer))
+      bi = (track_params.get(bi_name) if track_params
+            else tf.get_variable(bi_name, (tgt_dim,),
+                                 initializer=tf.zeros_initializer))
       x += bi
 
     if not final_layer:
@@ -200,164 +319,352 @@ def embedding_rnn_decoder(decoder_inputs, initial_state, cell, num_symbols,
                                loop_function=loop_function)
 
 
+def scalar_summary(tag, value):
+  return tf.scalar_summary(tag, value, collections=[tf.GraphKeys.SUMMARIES,
+                                                    SCALAR_SUMMARIES])
+
+
 def add_histogram_summaries(xs):
   for x in xs:
-    tf.histogram_summary(x.name, x)
+    tf.histogram_summary(x.name, x, collections=[tf.GraphKeys.SUMMARIES,
+                                                 HISTOGRAM_SUMMARIES])
 
 
-class ReplayBuffer(object):
+class SummaryScheduler(object):
 
   """
-  Experience replay storage, defined relative to an MDP.
-
-  Stores experience tuples `(s_t, a_t, r_t, s_{t+1})` in a fixed-size cyclic
-  buffer and randomly samples tuples from this buffer on demand.
-  """
-
-  def __init__(self, buffer_size, mdp):
-    self.buffer_size = buffer_size
-    self.mdp = mdp
-
-    self.cursor_write_start = 0
-    self.cursor_read_end = 0
-
-    self.states = np.empty((buffer_size, mdp.state_dim), dtype=np.float32)
-    self.actions = np.empty((buffer_size,), dtype=np.int32)
-    self.rewards = np.empty((buffer_size,), dtype=np.int32)
-    self.states_next = np.empty_like(self.states)
+  Compute scalar summaries every `scalar_interval` steps and histogram
+  summaries every `histogram_interval` steps.
 
-  def sample(self, batch_size):
-    if self.cursor_read_end - 1 < batch_size:
-      raise ValueError("Not enough examples in buffer (just %i) to fill a batch of %i."
-               % (self.cursor_read_end, batch_size))
+  Due summary ops are fetched in the same `Session.run` as the training step,
+  so they reuse its activations; on other steps, nothing that only feeds
+  summaries is computed.
 
-    idxs = np.random.choice(self.cursor_read_end, size=batch_size, replace=False)
-    return (self.states[idxs], self.actions[idxs], self.rewards[idxs],
-            self.states_next[idxs])
-
-  def extend(self, states, actions, rewards, states_next):
-    # If the buffer is near full, fit what we can and drop the rest
-    remaining_space = self.buffer_size - self.cursor_write_start
-    if len(states) >= self.buffer_size - self.cursor_write_start:
-      states = states[:remaining_space]
-      actions = actions[:remaining_space]
-      rewards = rewards[:remaining_space]
-      states_next = states_next[:remaining_space]
-
-      # Reset for next time
-      self.cursor_write_start = 0
-
-    # Write into buffer.
-    self.states[self.cursor_write_start:len(states)] = states
-    self.actions[self.cursor_write_start:len(states)] = actions
-    self.rewards[self.cursor_write_start:len(states)] = rewards
-    self.states_next[self.cursor_write_start:len(states)] = states_next
-
-    self.cursor_read_end = min(self.buffer_size, self.cursor_read_end + len(states))
-
-
-class RecurrentReplayBuffer(object):
-
-  def __init__(self, buffer_size, mdp, input_dim, seq_length, policy_dim):
-    self.buffer_size = buffer_size
-    self.mdp = mdp
-
-    self.cursor_write_start = 0
-    self.cursor_read_end = 0
-
-    self.inputs = np.empty((buffer_size, input_dim), dtype=np.float32)
-    self.states = np.empty((buffer_size, seq_length, policy_dim),
-                           dtype=np.float32)
-    self.actions = np.empty((buffer_size, seq_length, mdp.action_dim),
-                            dtype=np.float32)
-    self.rewards = np.empty((buffer_size, seq_length), dtype=np.int32)
-
-  def sample_trajectory(self):
-    if self.cursor_read_end == 0:
-      raise ValueError("not enough trajectories in buffer (just %i) to fill a "
-                       "batch of %i." % (self.cursor_read_end, 1))
+      summary_fetches = scheduler.fetches(t)
+      values = sess.run(train_fetches + summary_fetches, feed_dict)
+      scheduler.write(values[len(train_fetches):], t)
+  """
 
-    i = np.random.randint(0, self.cursor_read_end)
-    return self.inputs[i], self.states[i], self.actions[i], self.rewards[i]
+  def __init__(self, summary_writer, scalar_interval=1, histogram_interval=0,
+               name="summaries"):
+    """
+    Args:
+      summary_writer: `tf.train.SummaryWriter`
+      scalar_interval: Steps between scalar summaries. 0 disables them.
+      histogram_interval: Steps between histogram summaries. 0 disables them.
+    """
+    self.summary_writer = summary_writer
+
+    # (interval, merged summary op) pairs.
+    self._schedule = []
+    with tf.name_scope(name):
+      for collection, interval in [(SCALAR_SUMMARIES, scalar_interval),
+                                   (HISTOGRAM_SUMMARIES, histogram_interval)]:
+        summaries = tf.get_collection(collection)
+        if interval and summaries:
+          self._schedule.append((interval, tf.merge_summary(summaries)))
+
+  def fetches(self, step):
+    """Summary ops to fetch at `step`."""
+    return [op for interval, op in self._schedule if step % interval == 0]
+
+  def write(self, summaries, step):
+    """Write the fetched values of `fetches(step)`."""
+    for summary in summaries:
+      self.summary_writer.add_summary(summary, step)
+
+
+def _raise_or_log(exc_info, raise_error, source):
+  """
+  Re-raise an exception caught in a background thread, or only print it
+  (e.g. when another exception is already propagating).
+  """
+  if raise_error:
+    raise exc_info[0], exc_info[1], exc_info[2]
+  print >> sys.stderr, "Error in %s:" % source
+  traceback.print_exception(*exc_info)
 
-  def add_trajectory(self, inputs, states, actions, rewards):
-    self.inputs[self.cursor_write_start] = inputs
-    self.states[self.cursor_write_start] = states
-    self.actions[self.cursor_write_start] = actions
-    self.rewards[self.cursor_write_start] = rewards
 
-    self.cursor_write_start += 1
-    self.cursor_write_start = self.cursor_write_start % self.buffer_size
+class QueuePrefetcher(object):
 
-    self.cursor_read_end = min(self.buffer_size, self.cursor_read_end + 1)
+  """
+  Produce batches in background threads and stage them in a `tf.FIFOQueue`,
+  so that training steps consume ready tensors (`self.outputs`) rather than
+  being fed a batch from Python at each step.
 
-  def sample(self, batch_size):
-    b_inputs, b_states, b_states_next, b_actions, b_rewards = \
-        [], [], [], [], []
+  Ops built on `self.outputs` may still be fed explicitly, in which case the
+  queue is not touched.
 
-    for _ in range(batch_size):
-      inputs, states, actions, rewards = self.sample_trajectory()
+  If a producer fails, the queue is closed, so that dequeues fail with
+  `tf.errors.OutOfRangeError` once it is empty rather than blocking. `stop`
+  then re-raises the producer's exception.
+  """
 
-      # Sample a single timestep.
-      t = np.random.randint(0, states.shape[0])
-      state, action, reward = states[t], actions[t], rewards[t]
+  def __init__(self, make_batch, dtypes, shapes, capacity=16, num_threads=1,
+               name="prefetch"):
+    """
+    Args:
+      make_batch: Zero-argument function which returns a batch as a list of
+        arrays, one per element of `dtypes`
+      dtypes: Types of each batch component
+      shapes: (Possibly partial) shapes of each batch component
+      capacity: Maximum number of batches staged in the queue
+      num_threads: Number of producer threads
+    """
+    self.make_batch = make_batch
+    self.num_threads = num_threads
+
+    with tf.name_scope(name):
+      self.placeholders = [tf.placeholder(dtype, shape)
+                           for dtype, shape in zip(dtypes, shapes)]
+      self.queue = tf.FIFOQueue(capacity, dtypes)
+      self.enqueue_op = self.queue.enqueue(self.placeholders)
+      self.close_op = self.queue.close(cancel_pending_enqueues=True)
+      self.size = self.queue.size()
+
+      outputs = self.queue.dequeue()
+      if not isinstance(outputs, (list, tuple)):
+        outputs = [outputs]
+      for output, shape in zip(outputs, shapes):
+        output.set_shape(shape)
+      self.outputs = list(outputs)
+
+    self._stop = threading.Event()
+    self._threads = []
+    self._error = None
+
+  def _run(self, sess):
+    try:
+      while not self._stop.is_set():
+        batch = self.make_batch()
+        sess.run(self.enqueue_op, dict(zip(self.placeholders, batch)))
+    except Exception:
+      # Enqueues are cancelled when the queue is closed on stop.
+      if self._stop.is_set():
+        return
+      if self._error is None:
+        self._error = sys.exc_info()
       try:
-        state_next = states[t + 1]
-      except IndexError:
-        # TODO hack.
-        state_next = np.zeros((self.mdp.state_dim), dtype=np.float32)#0.0
+        sess.run(self.close_op)
+      except tf.errors.OpError:
+        pass
+
+  def start(self, sess):
+    for _ in xrange(self.num_threads):
+      thread = threading.Thread(target=self._run, args=(sess,))
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def stop(self, sess, raise_error=True):
+    """
+    Args:
+      raise_error: If false, print a producer's exception instead of
+        re-raising it.
+    """
+    self._stop.set()
+    sess.run(self.close_op)
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+
+    if self._error is not None:
+      error, self._error = self._error, None
+      _raise_or_log(error, raise_error, "prefetch thread")
+
+
+class CheckpointManager(object):
 
-      b_inputs.append(inputs)
-      b_states.append(state)
-      b_states_next.append(state_next)
-      b_actions.append(action)
-      b_rewards.append(reward)
-
-    b_inputs = np.array(b_inputs)
-    b_states = np.array(b_states)
-    b_states_next = np.array(b_states_next)
-    b_actions = np.array(b_actions)
-    b_rewards = np.array(b_rewards)
+  """
+  Write checkpoints in a background thread, so that training steps don't wait
+  on disk I/O.
 
-    return b_inputs, b_states, b_states_next, b_actions, b_rewards
+  `save` copies all variables to in-graph shadow copies with a single
+  `Session.run`, and a writer thread then saves the shadow copies while
+  training continues. (The shadow copies double the memory held by
+  variables.) Checkpoints are written under the original variable names, so
+  they restore with a plain `tf.train.Saver`.
 
+  Two sets of checkpoints are kept in `logdir`:
 
-def read_flagfile():
-  """
-  Fake gflag's `flagfile` feature.
+  - the last `max_to_keep` periodic checkpoints, `model.ckpt-<step>`, listed
+    in `checkpoint` (so `tf.train.latest_checkpoint` finds them), and
+  - the checkpoint with the best evaluation reward so far,
+    `model-best.ckpt-<step>`, listed in `checkpoint_best`.
 
-  Search for a --flagfile option in `sys.argv`; if it exists; prepend items
-  from the flagfile to `sys.argv`.
+  Periodic checkpoints are due every `save_secs` seconds and / or every
+  `save_steps` steps. A due checkpoint is deferred while the writer is still
+  busy with the previous one.
   """
 
-  flagfile_re = re.compile(r"^--flagfile=?(.*)$", re.I)
-  flagfile = None
-  remove_slice = None
-
-  # Find a flagfile arg.
-  for i, arg in enumerate(sys.argv):
-    matches = flagfile_re.findall(arg)
-    if matches:
-      if matches[0]:
-        flagfile = matches[0]
-        remove_slice = i, 1
-        break
-      elif i < len(sys.argv) - 1:
-        flagfile = sys.argv[i + 1]
-        remove_slice = i, 2
-        break
-
-  # Slice out the flagfile arg.
-  new_argv = sys.argv
-  if flagfile is None:
-    return
-  elif remove_slice is not None:
-    slice_start, slice_len = remove_slice
-    new_argv = new_argv[:slice_start] + new_argv[slice_start + slice_len:]
-
-  with open(flagfile, "r") as flagfile_f:
-    flags = [line.strip() for line in flagfile_f]
-
-  # Prepend loaded flags directly after script name
-  new_argv = new_argv[:1] + flags + new_argv[1:]
-  sys.argv = new_argv
+  def __init__(self, logdir, var_list=None, max_to_keep=5, save_secs=600,
+               save_steps=0, name="checkpoints"):
+    """
+    Args:
+      logdir: Checkpoint directory
+      var_list: Variables to save. Defaults to all variables.
+      max_to_keep: Number of periodic checkpoints kept
+      save_secs: Save a periodic checkpoint every `save_secs` seconds. 0
+        disables time-based saves.
+      save_steps: Save a periodic checkpoint every `save_steps` steps. 0
+        disables step-based saves.
+    """
+    if var_list is None:
+      var_list = tf.all_variables()
+    self.logdir = logdir
+    self.save_secs = save_secs
+    self.save_steps = save_steps
+
+    with tf.name_scope(name):
+      # Best evaluation reward so far. Saved with the model, so that a resumed
+      # run only replaces the best checkpoint with a better one.
+      self.best_reward = tf.Variable(float("-inf"), trainable=False,
+                                     name="best_reward")
+      self._new_best_reward = tf.placeholder(tf.float32, ())
+      self._set_best_reward = self.best_reward.assign(self._new_best_reward)
+      var_list = list(var_list) + [self.best_reward]
+      self.var_list = var_list
+
+      # Kept out of all collections: shadow copies are neither initialized
+      # with the model nor saved by other savers.
+      shadows = OrderedDict()
+      for var in var_list:
+        shadows[var.op.name] = tf.Variable(
+            tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype),
+            trainable=False, collections=[], name=var.op.name)
+      self._snapshot = tf.group(*[shadow.assign(var) for var, shadow
+                                  in zip(var_list, shadows.values())])
+
+    self._savers = {
+        "periodic": (tf.train.Saver(shadows, max_to_keep=max_to_keep),
+                     "model.ckpt", None),
+        "best": (tf.train.Saver(shadows, max_to_keep=1),
+                 "model-best.ckpt", "checkpoint_best"),
+    }
+
+    # Pick up checkpoints of a previous run in `logdir`, so that they count
+    # towards `max_to_keep`.
+    for saver, _, latest_filename in self._savers.values():
+      state = tf.train.get_checkpoint_state(logdir, latest_filename)
+      if state is not None:
+        saver.set_last_checkpoints(list(state.all_model_checkpoint_paths))
+
+    self._jobs = Queue.Queue()
+    self._idle = threading.Event()
+    self._idle.set()
+    self._error = None
+    self._thread = None
+
+    self._best = float("-inf")
+    self._last_time, self._last_step = time.time(), None
+
+  def latest_checkpoint(self):
+    """Path of the latest periodic checkpoint in `logdir`, or `None`."""
+    return tf.train.latest_checkpoint(self.logdir)
+
+  def restore(self, sess, path):
+    """
+    Restore variables from a checkpoint. Variables which the checkpoint
+    doesn't have keep their current values: `best_reward` in checkpoints
+    written without a `CheckpointManager`, and any state added to the model
+    since the checkpoint was written. Call before the graph is finalized.
+    """
+    reader = tf.train.NewCheckpointReader(path)
+    found = [var for var in self.var_list if reader.has_tensor(var.op.name)]
+    for var in self.var_list:
+      if var not in found and var is not self.best_reward:
+        print "Not in checkpoint, left at its initial value: %s" % var.op.name
+    tf.train.Saver(found).restore(sess, path)
+
+  def _run(self, sess):
+    while True:
+      job = self._jobs.get()
+      if job is None:
+        return
+
+      step, kinds = job
+      try:
+        for kind in kinds:
+          saver, basename, latest_filename = self._savers[kind]
+          saver.save(sess, os.path.join(self.logdir, basename),
+                     global_step=step, latest_filename=latest_filename)
+      except Exception:
+        self._error = sys.exc_info()
+      finally:
+        self._idle.set()
+
+  def _check_error(self, raise_error=True):
+    if self._error is not None:
+      error, self._error = self._error, None
+      _raise_or_log(error, raise_error, "checkpoint writer")
+
+  def start(self, sess):
+    """Start the writer thread. Call after restoring any checkpoint."""
+    self._best = sess.run(self.best_reward)
+    self._last_time = time.time()
+
+    self._thread = threading.Thread(target=self._run, args=(sess,))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self, raise_error=True):
+    """
+    Wait for pending writes and stop the writer thread.
+
+    Args:
+      raise_error: If false, print a failed write's exception instead of
+        re-raising it.
+    """
+    self._jobs.put(None)
+    self._thread.join()
+    self._thread = None
+    self._check_error(raise_error)
+
+  def due(self, step):
+    if self.save_steps and (self._last_step is None
+                            or step - self._last_step >= self.save_steps):
+      return True
+    return bool(self.save_secs
+                and time.time() - self._last_time >= self.save_secs)
+
+  def save(self, sess, step, reward=None, force=False):
+    """
+    Snapshot the model for writing if a periodic checkpoint is due, or if
+    `reward` is the best evaluation reward so far.
+
+    Args:
+      step: Training step, appended to checkpoint names
+      reward: Optional evaluation reward of the current model
+      force: Save a periodic checkpoint whether or not one is due, waiting
+        for the writer if it is busy
+
+    Returns:
+      Whether a snapshot was taken.
+    """
+    self._check_error()
+
+    best = reward is not None and reward > self._best
+    kinds = []
+    if force or self.due(step):
+      kinds.append("periodic")
+    if best:
+      kinds.append("best")
+    if not kinds:
+      return False
+
+    if not self._idle.is_set():
+      if not (force or best):
+        return False
+      self._idle.wait()
+      self._check_error()
+
+    if best:
+      sess.run(self._set_best_reward, {self._new_best_reward: reward})
+      self._best = reward
+    sess.run(self._snapshot)
+
+    self._idle.clear()
+    self._jobs.put((step, kinds))
+    if "periodic" in kinds:
+      self._last_time, self._last_step = time.time(), step
+    return True
@@ -0,0 +1,250 @@
+"""
+Run a random hyperparameter sweep over `search.ranges` on a pool of worker
+processes.
+
+Each trial gets its own logdir `$sweep_dir/${name}_$id` holding its flagfile,
+its log and a result file written when the trial finishes. Trials whose
+result file records success are skipped when an interrupted sweep is
+restarted. Finished trials are appended to the results index
+`$sweep_dir/$name.jsonl` as they complete.
+
+With `--scheduler=halving`, trials are run by successive halving: every
+trial first trains for `--min_budget` iterations, then the best `1 / eta` of
+them (ranked by the mean of their last `--metric_window` values of
+`--metric`) resume from their checkpoints for `eta` times as many
+iterations, and so on up to `--max_budget`.
+
+    python run_search.py --sweep_dir=/mnt/experiments --num_trials=1000 \
+        [-- extra flags for every trial]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import os.path
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from rlcomp import summaries
+import search
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--sweep_dir", default="/mnt/experiments")
+argparser.add_argument("--name", default=None,
+                       help="Sweep name. Defaults to "
+                            "rlcomp_sorting_$commit.")
+argparser.add_argument("--script", default="rlcomp/tasks/sorting_seq2seq.py")
+argparser.add_argument("--num_trials", type=int, default=1000)
+argparser.add_argument("--first_trial", type=int, default=1)
+argparser.add_argument("--seed", type=int, default=0,
+                       help="Base seed; trial $i samples its parameters "
+                            "with seed + $i.")
+argparser.add_argument("--intra_op_threads", type=int, default=1)
+argparser.add_argument("--inter_op_threads", type=int, default=1)
+argparser.add_argument("--num_workers", type=int, default=None,
+                       help="Number of concurrent trials. Defaults to the "
+                            "number of cores divided by the per-trial thread "
+                            "cap.")
+
+argparser.add_argument("--scheduler", choices=["none", "halving"],
+                       default="none")
+argparser.add_argument("--min_budget", type=int, default=500,
+                       help="Training iterations for the first halving rung.")
+argparser.add_argument("--max_budget", type=int, default=10000,
+                       help="Training iterations for the final halving rung.")
+argparser.add_argument("--eta", type=int, default=3,
+                       help="Keep the best 1/eta trials at each rung, and "
+                            "multiply their budget by eta.")
+argparser.add_argument("--metric", default="rewards/pred.mean",
+                       help="Scalar summary tag used to rank trials. Higher "
+                            "is better.")
+argparser.add_argument("--metric_window", type=int, default=100,
+                       help="Rank trials by the mean of this many of the most "
+                            "recent metric values.")
+
+argparser.add_argument("remaining_args", nargs=argparse.REMAINDER)
+
+
+def git_commit():
+  try:
+    return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                   cwd=REPO_DIR).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return "nocommit"
+
+
+def read_result(logdir, result_name="result.json"):
+  try:
+    with open(os.path.join(logdir, result_name), "r") as result_f:
+      return json.load(result_f)
+  except (IOError, ValueError):
+    return None
+
+
+def is_complete(trial):
+  result = read_result(trial["logdir"], trial["result_name"])
+  return result is not None and result["returncode"] == 0
+
+
+def prepare_trial(args, trial_id):
+  """
+  Create a trial's logdir and flagfile. An existing flagfile is kept, so a
+  resumed trial runs with the parameters it was first assigned.
+  """
+  logdir = os.path.join(args.sweep_dir, "%s_%i" % (args.name, trial_id))
+  if not os.path.isdir(logdir):
+    os.makedirs(logdir)
+
+  flagfile = os.path.join(logdir, "flagfile")
+  if not os.path.exists(flagfile):
+    random.seed(args.seed + trial_id)
+    np.random.seed(args.seed + trial_id)
+    params = search.make_params()
+    with open(flagfile, "w") as flagfile_f:
+      flagfile_f.write("\n".join(search.format_flags(params)) + "\n")
+
+  extra_args = [arg for arg in args.remaining_args if arg != "--"]
+  return {"id": trial_id, "logdir": logdir, "flagfile": flagfile,
+          "script": args.script, "extra_args": extra_args,
+          "intra_op_threads": args.intra_op_threads,
+          "inter_op_threads": args.inter_op_threads,
+          "num_iter": None, "resume": False, "result_name": "result.json"}
+
+
+def run_trial(trial):
+  """Run one trial to completion in a subprocess and record its result."""
+  logdir = trial["logdir"]
+  cmd = [sys.executable, os.path.join(REPO_DIR, trial["script"]),
+         "--flagfile=%s" % trial["flagfile"], "--logdir=%s" % logdir,
+         "--intra_op_threads=%i" % trial["intra_op_threads"],
+         "--inter_op_threads=%i" % trial["inter_op_threads"]]
+  cmd += trial["extra_args"]
+  if trial["num_iter"] is not None:
+    cmd.append("--num_iter=%i" % trial["num_iter"])
+  if trial["resume"]:
+    cmd.append("--resume")
+
+  env = dict(os.environ)
+  env["PYTHONPATH"] = REPO_DIR
+  env["OMP_NUM_THREADS"] = str(trial["intra_op_threads"])
+
+  start = time.time()
+  with open(os.path.join(logdir, "log"), "a") as log_f:
+    returncode = subprocess.call(cmd, stdout=log_f, stderr=subprocess.STDOUT,
+                                 env=env)
+
+  with open(trial["flagfile"], "r") as flagfile_f:
+    flags = [line.strip() for line in flagfile_f if line.strip()]
+
+  result = {"id": trial["id"], "logdir": logdir, "returncode": returncode,
+            "seconds": time.time() - start, "flags": flags,
+            "extra_args": trial["extra_args"], "num_iter": trial["num_iter"]}
+  with open(os.path.join(logdir, trial["result_name"]), "w") as result_f:
+    json.dump(result, result_f)
+  return result
+
+
+def run_trials(pool, trials, index_f, extra_fields=None):
+  """
+  Run all incomplete trials on the pool, appending results to the index as
+  they finish.
+  """
+  pending = [trial for trial in trials if not is_complete(trial)]
+  print "%i trials, %i already complete; running %i" \
+      % (len(trials), len(trials) - len(pending), len(pending))
+
+  for result in pool.imap_unordered(run_trial, pending):
+    result.update(extra_fields or {})
+    index_f.write(json.dumps(result) + "\n")
+    index_f.flush()
+    print "%i -> %s (exit %i, %.0fs)" % (result["id"], result["logdir"],
+                                          result["returncode"],
+                                          result["seconds"])
+
+
+def trial_metric(args, trial):
+  """Score a trial by the mean of its most recent metric values."""
+  _, values = summaries.read_scalars(trial["logdir"], args.metric)
+  if len(values) == 0:
+    return -np.inf
+  return float(summaries.reduce_values(values, "window_mean",
+                                       window=args.metric_window))
+
+
+def halving_budgets(args):
+  budgets = []
+  budget = args.min_budget
+  while budget < args.max_budget:
+    budgets.append(budget)
+    budget *= args.eta
+  budgets.append(args.max_budget)
+  return budgets
+
+
+def run_halving(args, pool, trials, index_f):
+  """
+  Successive halving: train all trials on a small budget, then repeatedly
+  promote the best `1 / eta` to an `eta` times larger budget, resuming each
+  promoted trial from its latest checkpoint.
+  """
+  survivors = trials
+  budgets = halving_budgets(args)
+  for rung, budget in enumerate(budgets):
+    rung_trials = [dict(trial, num_iter=budget, resume=rung > 0,
+                        result_name="result_%i.json" % budget)
+                   for trial in survivors]
+    print "Rung %i: %i trials, %i iterations" % (rung, len(rung_trials),
+                                                 budget)
+    run_trials(pool, rung_trials, index_f,
+               extra_fields={"rung": rung, "budget": budget})
+
+    scores = dict((trial["id"], trial_metric(args, trial))
+                  for trial in rung_trials)
+    ranked = sorted(rung_trials, key=lambda trial: scores[trial["id"]],
+                    reverse=True)
+    for trial in ranked[:5]:
+      print "\t%i\t%f\t%s" % (trial["id"], scores[trial["id"]],
+                               trial["logdir"])
+
+    if rung + 1 < len(budgets):
+      survivors = ranked[:max(1, len(ranked) // args.eta)]
+
+
+def main(args):
+  if args.name is None:
+    args.name = "rlcomp_sorting_%s" % git_commit()
+  if args.num_workers is None:
+    threads = max(args.intra_op_threads, args.inter_op_threads)
+    args.num_workers = max(1, multiprocessing.cpu_count() // threads)
+
+  trial_ids = range(args.first_trial, args.first_trial + args.num_trials)
+  trials = [prepare_trial(args, trial_id) for trial_id in trial_ids]
+  print "Running on %i workers" % args.num_workers
+
+  index_path = os.path.join(args.sweep_dir, "%s.jsonl" % args.name)
+  pool = multiprocessing.Pool(args.num_workers)
+  try:
+    with open(index_path, "a") as index_f:
+      if args.scheduler == "halving":
+        run_halving(args, pool, trials, index_f)
+      else:
+        run_trials(pool, trials, index_f)
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -0,0 +1,91 @@
+"""
+Convert a checkpoint written before tracking models were stored in flat
+buffers (`util.TrackingParams`) to the current format.
+
+Old checkpoints hold one variable per tracking parameter, e.g.
+`dpg/critic_track/W0` and `dpg/critic_track/b0`. These are concatenated,
+in the order the MLP creates them (`W0, b0, W1, b1, ...`), into the single
+flat variable `dpg/critic_track/params`. All other variables are copied
+unchanged. (The tracking buffer holds only the parameters the tracking MLP
+reads, so e.g. `dpg/critic/scaler` has no tracking copy.)
+
+    python scripts/convert_tracking_checkpoint.py OLD_CHECKPOINT NEW_CHECKPOINT
+"""
+
+import argparse
+import re
+
+import numpy as np
+import tensorflow as tf
+
+
+argparser = argparse.ArgumentParser(usage=__doc__)
+argparser.add_argument("checkpoint_path")
+argparser.add_argument("out_path")
+argparser.add_argument("--track_scopes",
+                       default="policy_track,critic_track,policy_actor",
+                       help="Comma-separated names of tracking model scopes.")
+
+
+_MLP_PARAM = re.compile(r"^(.*)/([Wb])(\d+)$")
+
+
+def convert(tensors, track_scopes):
+  """
+  Args:
+    tensors: Dict mapping variable names to values
+    track_scopes: Names of tracking model scopes
+
+  Returns:
+    Dict mapping converted variable names to values
+  """
+  converted, tracking = {}, {}
+  for name, value in tensors.items():
+    match = _MLP_PARAM.match(name)
+    if match and match.group(1).split("/")[-1] in track_scopes:
+      scope, kind, layer = match.groups()
+      # Creation order within `util.mlp`: W0, b0, W1, b1, ...
+      tracking.setdefault(scope, []).append(((int(layer), kind != "W"),
+                                             value))
+    else:
+      converted[name] = value
+
+  for scope, params in tracking.items():
+    params.sort(key=lambda (key, _): key)
+    converted[scope + "/params"] = np.concatenate(
+        [value.reshape(-1) for _, value in params])
+  return converted
+
+
+def convert_checkpoint(checkpoint_path, out_path, track_scopes):
+  """
+  Convert the checkpoint at `checkpoint_path` and save it to `out_path`.
+
+  Returns:
+    Names of the variables added by the conversion
+  """
+  reader = tf.train.NewCheckpointReader(checkpoint_path)
+  tensors = {name: reader.get_tensor(name)
+             for name in reader.get_variable_to_shape_map()}
+  converted = convert(tensors, track_scopes)
+
+  with tf.Graph().as_default(), tf.Session() as sess:
+    variables = {name: tf.Variable(value, name=name)
+                 for name, value in converted.items()}
+    sess.run(tf.initialize_all_variables())
+    tf.train.Saver(variables).save(sess, out_path)
+
+  return sorted(set(converted) - set(tensors))
+
+
+def main(args):
+  added = convert_checkpoint(args.checkpoint_path, args.out_path,
+                             args.track_scopes.split(","))
+  for name in added:
+    print name
+  print "Wrote checkpoint with %i new variables to %s" % (len(added),
+                                                          args.out_path)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
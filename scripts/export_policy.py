@@ -0,0 +1,33 @@
+"""
+Export the policy parameters of a trained DPG checkpoint to an `.npz` file,
+for use with the NumPy engines in `rlcomp.numpy_engine`.
+
+    python scripts/export_policy.py CHECKPOINT OUT.npz [--scope dpg]
+"""
+
+import argparse
+
+from rlcomp import numpy_engine
+
+
+argparser = argparse.ArgumentParser(usage=__doc__)
+argparser.add_argument("checkpoint_path")
+argparser.add_argument("out_path")
+argparser.add_argument("--scope", default="dpg",
+                       help="Variable scope of the model, e.g. dpg_0 for the "
+                            "first agent of a --num_agents run.")
+argparser.add_argument("--groups", default=",".join(numpy_engine.POLICY_GROUPS),
+                       help="Comma-separated child scopes to export.")
+
+
+def main(args):
+  names = numpy_engine.export_params(args.checkpoint_path, args.out_path,
+                                     scope=args.scope,
+                                     groups=args.groups.split(","))
+  for name in names:
+    print name
+  print "Exported %i parameters to %s" % (len(names), args.out_path)
+
+
+if __name__ == "__main__":
+  main(argparser.parse_args())
@@ -1,53 +1,71 @@
-"""Tool to read TF summary log files."""
-
-import argparse
-
-import tensorflow as tf
+"""
+Tool to read TF summary log files.
 
+    python scripts/summary.py RUN [RUN ...] read [TAG] [--reduction=max]
 
-argparser = argparse.ArgumentParser()
-argparser.add_argument("file")
-argparser.add_argument("command")
+Each `RUN` is a logdir or a single event file. All event files in a logdir
+are read through the run's cached summary index (see `rlcomp.summaries`), so
+repeated queries over many runs only parse event data written since the last
+query. An event file is read on its own, without the cache.
 
-argparser.add_argument("--reduction")
+Without a tag, lists the scalar tags logged in any run. With a tag, prints
+its values (one per line) for a single run, or one line per run when reading
+several runs.
+"""
 
-argparser.add_argument("remaining_args", nargs=argparse.REMAINDER)
+import argparse
 
+from rlcomp import summaries
 
-def list_fields(it):
-  event = next(it)
-  # Skip over empty events in the start
-  while not event.summary.value:
-    event = next(it)
 
-  print "\n".join(sorted(val.tag for val in event.summary.value))
+argparser = argparse.ArgumentParser(usage=__doc__)
+argparser.add_argument("paths", nargs="+")
 
+argparser.add_argument("--reduction",
+                       choices=["max", "min", "mean", "last", "window_mean"])
+argparser.add_argument("--window", type=int, default=100,
+                       help="Number of trailing values averaged by the "
+                            "window_mean reduction.")
+argparser.add_argument("--sort", action="store_true",
+                       help="Sort runs by reduced value, best (highest) "
+                            "first.")
 
-def read_field(it, field):
-  ret = []
-  for event in it:
-    for val in event.summary.value:
-      if val.tag == field:
-        ret.append((event.step, val.simple_value))
 
-  return ret
+def split_command(paths):
+  """Split `RUN [RUN ...] read [TAG]` positionals."""
+  if "read" not in paths:
+    argparser.error("expected a command (read)")
+  idx = paths.index("read")
+  runs, rest = paths[:idx], paths[idx + 1:]
+  if not runs or len(rest) > 1:
+    argparser.error("usage: RUN [RUN ...] read [TAG]")
+  return runs, rest[0] if rest else None
 
 
 def main(args):
-  it = tf.train.summary_iterator(args.file)
-
-  if args.command == "read":
-    if len(args.remaining_args) == 0:
-      list_fields(it)
+  runs, tag = split_command(args.paths)
+  index = summaries.SummaryIndex(runs)
+
+  if tag is None:
+    print "\n".join(index.tags())
+    return
+
+  results = index.query(tag, reduction=args.reduction, window=args.window)
+  if args.reduction:
+    if args.sort:
+      results = sorted(results, key=lambda (_, value): value, reverse=True)
+    if len(results) == 1:
+      print results[0][1]
     else:
-      vals = [val for step, val in read_field(it, args.remaining_args[0])]
-
-      if args.reduction:
-        fn = max if args.reduction == "max" else None # TODO
-        reduced = reduce(fn, vals)
-        print reduced
-      else:
-        print "\n".join(str(val) for val in vals)
+      for path, value in results:
+        print "%s\t%s" % (value, path)
+  elif len(results) == 1:
+    _, (_, values) = results[0]
+    print "\n".join(str(val) for val in values)
+  else:
+    for path, (steps, values) in results:
+      for step, val in zip(steps, values):
+        print "%s\t%i\t%s" % (path, step, val)
 
 
 if __name__ == "__main__":
@@ -47,7 +47,11 @@ def make_params():
   return params
 
 
+def format_flags(params):
+  """Render a parameter dict as flagfile lines (see `flagfile.read_flagfile`)."""
+  return ["--%s=%s" % (param, value) for param, value in params.items()]
+
+
 if __name__ == "__main__":
   params = make_params()
-  for param, value in params.items():
-    print "--%s=%s" % (param, value)
+  print "\n".join(format_flags(params))
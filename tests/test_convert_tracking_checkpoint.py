@@ -0,0 +1,92 @@
+"""
+Round trip of `scripts/convert_tracking_checkpoint.py`: a checkpoint in the
+old per-parameter tracking layout, converted, restores into the current
+model with `util.CheckpointManager.restore`.
+"""
+
+import imp
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from rlcomp import util
+from rlcomp.tasks import sorting_seq2seq as sorting
+
+
+convert_tracking_checkpoint = imp.load_source(
+    "convert_tracking_checkpoint",
+    os.path.join(os.path.dirname(__file__), os.pardir, "scripts",
+                 "convert_tracking_checkpoint.py"))
+
+
+def legacy_values(sess, dpg):
+  """
+  Values of all model variables, named as in checkpoints written before
+  tracking models used flat buffers.
+  """
+  values = {}
+  flats = [track_params.flat for track_params in dpg._tracking.values()]
+  for var in tf.all_variables():
+    if var not in flats:
+      values[var.op.name] = sess.run(var)
+
+  # Old tracking models created their own MLP variables.
+  for track_name, track_params in dpg._tracking.items():
+    for name_i in track_params.names:
+      values["%s/%s/%s" % (dpg._vs.name, track_name, name_i)] = \
+          sess.run(track_params.get(name_i))
+  return values
+
+
+class ConvertTrackingCheckpointTest(unittest.TestCase):
+
+  def setUp(self):
+    self.logdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.logdir)
+
+  def test_restore_converted(self):
+    old_path = os.path.join(self.logdir, "old.ckpt")
+    new_path = os.path.join(self.logdir, "new.ckpt")
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+      mdp = util.MDPSpec(4, 4)
+      spec = util.DPGSpec([4], [3])
+      dpg = sorting.SortingDPG(mdp, spec, 4, 10, 3)
+      checkpoints = util.CheckpointManager(self.logdir)
+      sess.run(tf.initialize_all_variables())
+
+      # Move the tracking models away from the main models.
+      sess.run(dpg.track_update, {dpg.tau: [0.5]})
+      sess.run([tf.assign_add(var, tf.ones_like(var))
+                for var in dpg.critic_params])
+      sess.run(dpg.track_update, {dpg.tau: [0.5]})
+
+      expected = {var.op.name: sess.run(var) for var in tf.all_variables()
+                  if var is not checkpoints.best_reward}
+      legacy = legacy_values(sess, dpg)
+
+      # Write the checkpoint in the old layout.
+      with tf.Graph().as_default(), tf.Session() as legacy_sess:
+        variables = {name: tf.Variable(value, name=name)
+                     for name, value in legacy.items()}
+        legacy_sess.run(tf.initialize_all_variables())
+        tf.train.Saver(variables).save(legacy_sess, old_path)
+
+      convert_tracking_checkpoint.convert_checkpoint(
+          old_path, new_path, ["policy_track", "critic_track", "policy_actor"])
+
+      sess.run(tf.initialize_all_variables())
+      checkpoints.restore(sess, new_path)
+      for var in tf.all_variables():
+        if var is not checkpoints.best_reward:
+          np.testing.assert_allclose(sess.run(var), expected[var.op.name])
+
+
+if __name__ == "__main__":
+  unittest.main()
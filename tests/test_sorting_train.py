@@ -0,0 +1,94 @@
+"""
+Regression test: `sorting_seq2seq.train` builds all of its ops before the
+graph is finalized, and none inside the training loop.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import tensorflow as tf
+
+from rlcomp import util
+from rlcomp.tasks import sorting_seq2seq as sorting
+
+
+FLAGS = sorting.FLAGS
+
+
+class TrainGraphTest(unittest.TestCase):
+
+  def setUp(self):
+    self.logdir = tempfile.mkdtemp()
+
+    # Reading a flag parses the command line, which would otherwise reset the
+    # values set below.
+    FLAGS.mode
+    self._old_flags = dict(FLAGS.__dict__["__flags"])
+
+    FLAGS.num_iter = 4
+    FLAGS.batch_size = 8
+    FLAGS.seq_length = 4
+    # Evaluate, write summaries, save and log on every step.
+    FLAGS.eval_interval = 1
+    FLAGS.summary_interval = 1
+    FLAGS.histogram_interval = 2
+    FLAGS.log_interval = 1
+    FLAGS.checkpoint_interval = 1
+
+  def tearDown(self):
+    FLAGS.__dict__["__flags"].clear()
+    FLAGS.__dict__["__flags"].update(self._old_flags)
+    shutil.rmtree(self.logdir)
+
+  def _train(self, dynamic):
+    FLAGS.logdir = tempfile.mkdtemp(dir=self.logdir)
+    graph = tf.Graph()
+    with graph.as_default():
+      mdp = util.MDPSpec(FLAGS.embedding_dim, FLAGS.embedding_dim)
+      spec = util.DPGSpec([FLAGS.embedding_dim], [])
+      if dynamic:
+        dpg = sorting.DynamicSortingDPG(mdp, spec, FLAGS.embedding_dim,
+                                        FLAGS.vocab_size)
+      else:
+        dpg = sorting.SortingDPG(mdp, spec, FLAGS.embedding_dim,
+                                 FLAGS.vocab_size, FLAGS.seq_length)
+      global_step = tf.Variable(0, trainable=False, name="global_step")
+      agent = sorting.build_updates(dpg, global_step)
+      util.add_histogram_summaries(dpg.policy_params)
+      checkpoints = util.CheckpointManager(FLAGS.logdir, save_secs=0,
+                                           save_steps=1)
+
+      # Record the op count at the point `train` finalizes the graph.
+      num_ops = []
+      finalize = graph.finalize
+      def finalize_and_count():
+        num_ops.append(len(graph.get_operations()))
+        finalize()
+      graph.finalize = finalize_and_count
+
+      with tf.Session() as sess:
+        sess.run(tf.initialize_all_variables())
+        sorting.train([agent], global_step, checkpoints)
+        self.assertEqual(sess.run(global_step), FLAGS.num_iter)
+
+    self.assertTrue(graph.finalized)
+    self.assertEqual(num_ops, [len(graph.get_operations())])
+
+  def test_threshold_schedule(self):
+    # Schedule updated at each evaluation.
+    FLAGS.lr_schedule = "threshold"
+    FLAGS.lr_thresholds = "-1,0"
+    for dynamic in [False, True]:
+      self._train(dynamic)
+
+  def test_step_schedule(self):
+    # Schedule updated at each training step.
+    FLAGS.lr_schedule = "step"
+    FLAGS.lr_decay_steps = 1
+    for dynamic in [False, True]:
+      self._train(dynamic)
+
+
+if __name__ == "__main__":
+  unittest.main()